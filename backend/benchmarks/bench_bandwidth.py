@@ -0,0 +1,140 @@
+"""Benchmark: aggregate throughput under the bandwidth governor.
+
+Starts a local HTTP server that serves incompressible files, downloads
+several of them at once through yt-dlp with the backend's progress hook
+(so every byte is charged to ``main.bandwidth_governor``), and compares
+the aggregate and per-job throughput with the configured caps.
+
+With ``--job-cap`` the first job gets its own lower limit; the remaining
+budget should be split evenly between the other jobs.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_bandwidth.py --jobs 4 --limit-kbps 2048 --seconds 10
+    python benchmarks/bench_bandwidth.py --jobs 4 --limit-kbps 2048 --job-cap-kbps 256
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 下载库与任务日志放在临时目录，不影响本机的真实数据
+import isolated_env  # noqa: F401
+
+import yt_dlp  # noqa: E402
+
+import main  # noqa: E402
+
+PAYLOAD = os.urandom(1024 * 1024)
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """Serves /<size>/<name>.bin as ``size`` bytes of random data."""
+
+    def do_GET(self):
+        size = int(self.path.split('/')[1])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        sent = 0
+        try:
+            while sent < size:
+                chunk = PAYLOAD[:min(len(PAYLOAD), size - sent)]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    do_HEAD = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+def download(url: str, job_id: str, out_dir: str, samples: dict):
+    hook = main.DownloadProgress()
+    hook.job_id = job_id
+
+    def record(d):
+        if d['status'] == 'downloading':
+            samples[job_id] = (time.monotonic(), d.get('downloaded_bytes') or 0, d.get('speed'))
+
+    opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'noprogress': True,
+        'outtmpl': os.path.join(out_dir, f'{job_id}.%(ext)s'),
+        'progress_hooks': [hook, record],
+        'buffersize': 64 * 1024,
+        'noresizebuffer': True,
+    }
+    try:
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            ydl.download([url])
+    finally:
+        main.bandwidth_governor.release(job_id)
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=4)
+    parser.add_argument('--limit-kbps', type=int, default=2048, help='global cap in KiB/s')
+    parser.add_argument('--job-cap-kbps', type=int, default=0, help='separate cap for the first job')
+    parser.add_argument('--seconds', type=float, default=10.0, help='measurement window')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    limit = args.limit_kbps * 1024
+    main.bandwidth_governor.set_limits(limit, None)
+    job_ids = [f'bench{i}' for i in range(args.jobs)]
+    if args.job_cap_kbps:
+        main.bandwidth_governor.set_job_limit(job_ids[0], args.job_cap_kbps * 1024)
+
+    # 文件足够大，测量窗口内所有任务都保持活跃
+    size = int(limit * (args.seconds + 5))
+    samples = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        threads = [
+            threading.Thread(
+                target=download,
+                args=(f'http://127.0.0.1:{port}/{size}/{job_id}.bin', job_id, out_dir, samples),
+                daemon=True
+            )
+            for job_id in job_ids
+        ]
+        for thread in threads:
+            thread.start()
+
+        # 跳过启动阶段（突发额度、提取）后开始计量
+        time.sleep(2.0)
+        start = {job_id: samples.get(job_id, (time.monotonic(), 0, None)) for job_id in job_ids}
+        time.sleep(args.seconds)
+        end = {job_id: samples.get(job_id, (time.monotonic(), 0, None)) for job_id in job_ids}
+        stats = main.bandwidth_governor.stats()
+
+        total = 0.0
+        print(f"{'job':<10} {'rate KiB/s':>12} {'measured KiB/s':>15} {'yt-dlp speed':>13}")
+        for job_id in job_ids:
+            (t0, b0, _), (t1, b1, speed) = start[job_id], end[job_id]
+            measured = (b1 - b0) / (t1 - t0) if t1 > t0 else 0.0
+            total += measured
+            rate = stats['active'].get(job_id, {}).get('rate_kbps')
+            print(f"{job_id:<10} {rate!s:>12} {measured / 1024:>15.1f} {(speed or 0) / 1024:>13.1f}")
+
+        error = (total - limit) / limit * 100
+        print(f"\naggregate: {total / 1024:.1f} KiB/s, cap {args.limit_kbps} KiB/s, error {error:+.1f}%")
+        status = 'OK' if abs(error) <= 5 else 'OUT OF TOLERANCE'
+        print(f"within 5% of cap: {status}")
+
+    # 剩余下载线程直接随进程退出
+    os._exit(0 if abs(error) <= 5 else 1)
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,150 @@
+"""Benchmark: format selection over real-sized yt-dlp info dicts.
+
+Builds a corpus of info dicts shaped like YouTube responses. Each one has
+video formats at every height in mp4/webm and several codecs, audio-only
+tracks in many languages with DRC variants, muxed formats, HLS variants
+and storyboards, for several hundred formats in total. The benchmark
+times every (format, quality) request against two implementations:
+
+* legacy: the selection code as it was before this change. It makes
+  several filter passes, a fallback re-scan, a sort, a list comprehension
+  and then rebuilds a spec string.
+* compiled: ``main.compile_format_selector(...).select`` followed by
+  ``download_spec``. This is one pass with a precompiled predicate and
+  ranking key.
+
+Both must pick the same format for each request. The check stops at the
+first disagreement.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_format_selection.py --infos 200 --formats 300
+"""
+import argparse
+import random
+import sys
+import time
+
+# 下载库与任务日志放在临时目录，不影响本机的真实数据
+import isolated_env  # noqa: F401
+
+import main  # noqa: E402
+
+HEIGHTS = [144, 240, 360, 480, 720, 1080, 1440, 2160, 4320]
+VIDEO_CODECS = {'mp4': ['avc1.4d401e', 'av01.0.08M.08'], 'webm': ['vp9', 'vp09.00.51.08']}
+LANGUAGES = ['en', 'de', 'fr', 'es', 'ja', 'ko', 'pt', 'ru', 'it', 'hi', 'ar', 'zh', 'nl', 'pl', 'tr']
+
+
+def make_info(rng: random.Random, target: int) -> dict:
+    formats = [
+        # 故事板
+        {'format_id': f'sb{i}', 'ext': 'mhtml', 'vcodec': 'none', 'acodec': 'none', 'height': 45 * (i + 1)}
+        for i in range(4)
+    ]
+    # 多语言音轨（含 DRC 版本）
+    for lang in LANGUAGES:
+        for ext, codec, abr in (('m4a', 'mp4a.40.2', 129), ('m4a', 'mp4a.40.5', 48), ('webm', 'opus', 160), ('webm', 'opus', 70)):
+            for drc in ('', '-drc'):
+                formats.append({
+                    'format_id': f'{lang}-{codec}-{abr}{drc}', 'ext': ext, 'vcodec': 'none', 'acodec': codec,
+                    'abr': abr + rng.random(), 'tbr': abr, 'language': lang,
+                })
+    # 仅视频流、HLS 变体与少量音视频混合流
+    while len(formats) < target:
+        ext = rng.choice(['mp4', 'webm'])
+        height = rng.choice(HEIGHTS)
+        muxed = rng.random() < 0.05
+        formats.append({
+            'format_id': f'{len(formats)}', 'ext': ext, 'height': height, 'width': height * 16 // 9,
+            'vcodec': rng.choice(VIDEO_CODECS[ext]), 'acodec': 'mp4a.40.2' if muxed else 'none',
+            'tbr': height * (2 + rng.random()), 'fps': rng.choice([24, 30, 60]),
+            'protocol': rng.choice(['https', 'm3u8_native']),
+        })
+    for f in formats:
+        f['url'] = f"https://rr1---sn-example.googlevideo.com/videoplayback?itag={f['format_id']}&expire=1700000000"
+    rng.shuffle(formats)
+    return {'id': f'{rng.getrandbits(40):x}', 'title': 'bench', 'formats': formats}
+
+
+def legacy_select(info: dict, format: str, quality: str) -> tuple:
+    """Copy of extract_video_info's selection before the compiled engine."""
+    formats = info.get('formats', [])
+    target_height = 0
+    if quality != 'best':
+        target_height = int(quality[:-1])
+    suitable_formats = []
+    for f in formats:
+        if format == 'mp3':
+            if f.get('acodec') != 'none' and f.get('vcodec') == 'none':
+                suitable_formats.append(f)
+        else:
+            if f.get('ext') == format and f.get('vcodec') != 'none':
+                height = f.get('height', 0)
+                if quality == 'best' or (height and height <= target_height):
+                    suitable_formats.append(f)
+    if not suitable_formats:
+        for f in formats:
+            if format == 'mp3':
+                if f.get('acodec') != 'none':
+                    suitable_formats.append(f)
+            elif f.get('vcodec') != 'none':
+                suitable_formats.append(f)
+    if format == 'mp3':
+        best_format = max(suitable_formats, key=lambda f: f.get('abr', 0) or 0)
+    else:
+        suitable_formats.sort(key=lambda f: (f.get('height', 0) or 0, f.get('tbr', 0) or 0), reverse=True)
+        if quality == 'best':
+            best_format = suitable_formats[0]
+        else:
+            target_formats = [f for f in suitable_formats if f.get('height', 0) <= target_height]
+            best_format = target_formats[0] if target_formats else suitable_formats[-1]
+    if format == 'mp3':
+        format_spec = 'bestaudio[ext=mp3]/bestaudio'
+    elif quality == 'best':
+        format_spec = f'best[ext={format}]/best'
+    else:
+        format_spec = f'bestvideo[height<={target_height}][ext={format}]+bestaudio[ext=m4a]/best[height<={target_height}][ext={format}]'
+    return best_format, format_spec
+
+
+def compiled_select(info: dict, format: str, quality: str) -> tuple:
+    selector = main.compile_format_selector(format, quality)
+    best, audio, _ = selector.select(info['formats'])
+    return best, selector.download_spec(best, audio)
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--infos', type=int, default=200)
+    parser.add_argument('--formats', type=int, default=300, help='formats per info dict')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = [make_info(rng, args.formats) for _ in range(args.infos)]
+    requests = [(f, q) for f in ('mp4', 'webm', 'mp3', '3gp') for q in ('360p', '480p', '720p', '1080p', 'best')]
+
+    # 两种实现必须选出同一格式
+    for info in corpus:
+        for format, quality in requests:
+            legacy, _ = legacy_select(info, format, quality)
+            compiled, _ = compiled_select(info, format, quality)
+            if legacy is not compiled:
+                sys.exit(f"mismatch for {format}/{quality}: {legacy['format_id']} != {compiled['format_id']}")
+
+    results = {}
+    for name, select in (('legacy', legacy_select), ('compiled', compiled_select)):
+        start = time.perf_counter()
+        for info in corpus:
+            for format, quality in requests:
+                select(info, format, quality)
+        elapsed = time.perf_counter() - start
+        results[name] = elapsed
+        calls = len(corpus) * len(requests)
+        print(f"{name:<9} {elapsed * 1000:8.1f} ms total  {elapsed / calls * 1e6:7.1f} us/selection")
+    print(f"\n{len(corpus)} info dicts x {args.formats} formats x {len(requests)} requests, "
+          f"speedup {results['legacy'] / results['compiled']:.2f}x")
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,155 @@
+"""Benchmark: standard vs parallel download mode for DASH formats.
+
+Serves a synthetic DASH video stream and audio stream from a local HTTP
+server. Every fragment request pays a fixed latency and is limited per
+connection, which is how CDNs behave. The script then downloads both
+streams two ways:
+
+* standard: what yt-dlp does by default. The streams are fetched one
+  after the other and the fragments of each stream one at a time.
+* parallel: ``main.prefetch_streams`` fetches both streams at once, with
+  ``concurrent_fragment_downloads`` set to the requested fan-out.
+
+Only the download stage is timed. The FFmpeg merge that follows is the
+same in both modes.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_fragments.py --fragments 40 --fanout 8
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 下载库与任务日志放在临时目录，不影响本机的真实数据
+import isolated_env  # noqa: F401
+
+import yt_dlp  # noqa: E402
+
+import main  # noqa: E402
+
+PAYLOAD = os.urandom(4 * 1024 * 1024)
+
+
+class FragmentHandler(BaseHTTPRequestHandler):
+    """Serves /<stream>/<size>/seg-<n> with per-request latency and rate."""
+
+    latency = 0.05
+    rate = 2 * 1024 * 1024  # bytes/s per connection
+
+    def do_GET(self):
+        size = int(self.path.split('/')[2])
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        sent = 0
+        started = time.monotonic()
+        try:
+            while sent < size:
+                chunk = PAYLOAD[sent % len(PAYLOAD):][:min(64 * 1024, size - sent)]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                ahead = sent / self.rate - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def make_info(port: int, fragments: int, fragment_size: int) -> dict:
+    def dash_format(format_id: str, ext: str, vcodec: str, acodec: str, count: int) -> dict:
+        base = f'http://127.0.0.1:{port}/{format_id}/{fragment_size}/'
+        return {
+            'format_id': format_id,
+            'ext': ext,
+            'vcodec': vcodec,
+            'acodec': acodec,
+            'protocol': 'http_dash_segments',
+            'url': base + 'manifest.mpd',
+            'fragment_base_url': base,
+            'fragments': [{'path': f'seg-{n}'} for n in range(count)],
+            'filesize': count * fragment_size,
+        }
+
+    return {
+        'id': 'bench',
+        'title': 'bench',
+        'extractor': 'generic',
+        'extractor_key': 'Generic',
+        'webpage_url': f'http://127.0.0.1:{port}/',
+        'formats': [
+            dash_format('video', 'mp4', 'avc1', 'none', fragments),
+            # 音频流通常约为视频的四分之一
+            dash_format('audio', 'm4a', 'none', 'mp4a', max(1, fragments // 4)),
+        ],
+    }
+
+
+def fetch_sequential(ydl: yt_dlp.YoutubeDL, info: dict):
+    """Mirror of yt-dlp's own loop over requested_formats."""
+    selected = ydl.process_ie_result(dict(info), download=False)
+    stem = os.path.splitext(ydl.prepare_filename(selected))[0]
+    for fmt in selected['requested_formats']:
+        stream_info = {k: v for k, v in selected.items() if k != 'requested_formats'}
+        stream_info.update(fmt)
+        ydl.dl(f"{stem}.f{fmt['format_id']}.{fmt['ext']}", stream_info)
+
+
+def run(mode: str, info: dict, fanout: int) -> tuple:
+    with tempfile.TemporaryDirectory() as out_dir:
+        opts = {
+            'quiet': True,
+            'no_warnings': True,
+            'noprogress': True,
+            'format': 'bestvideo+bestaudio',
+            'outtmpl': os.path.join(out_dir, 'bench.%(ext)s'),
+            'progress_hooks': [main.DownloadProgress()],
+        }
+        if mode == 'parallel':
+            opts['concurrent_fragment_downloads'] = fanout
+            opts['http_chunk_size'] = main.HTTP_CHUNK_SIZE
+        start = time.perf_counter()
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            if mode == 'parallel':
+                main.prefetch_streams(ydl, info)
+            else:
+                fetch_sequential(ydl, info)
+        elapsed = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(out_dir, name)) for name in os.listdir(out_dir))
+    return elapsed, size
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fragments', type=int, default=40, help='video fragments (audio gets a quarter)')
+    parser.add_argument('--fragment-kb', type=int, default=512)
+    parser.add_argument('--fanout', type=int, default=8)
+    parser.add_argument('--latency-ms', type=int, default=50)
+    parser.add_argument('--rate-kbps', type=int, default=2048, help='per-connection rate in KiB/s')
+    args = parser.parse_args()
+
+    FragmentHandler.latency = args.latency_ms / 1000
+    FragmentHandler.rate = args.rate_kbps * 1024
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FragmentHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    info = make_info(server.server_address[1], args.fragments, args.fragment_kb * 1024)
+
+    results = {}
+    for mode in ('standard', 'parallel'):
+        elapsed, size = run(mode, info, args.fanout)
+        results[mode] = elapsed
+        print(f"{mode:<9} {elapsed:7.2f} s  {size / elapsed / 1024 / 1024:7.2f} MiB/s  ({size / 1024 / 1024:.1f} MiB)")
+    print(f"\nspeedup: {results['standard'] / results['parallel']:.1f}x with fan-out {args.fanout}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,393 @@
+"""Load test: offline end-to-end run of POST /download and GET /progress.
+
+Runs the real app in-process through ``httpx.ASGITransport``. The only
+stubbed piece is yt-dlp's network extraction. ``YoutubeDL.extract_info``
+returns a recorded info dict after ``--extract-ms`` of simulated latency,
+and yt-dlp processes it as usual. Every format URL points at a local HTTP
+server, so format selection, the scheduler, the real yt-dlp HTTP
+download, the progress hook and the bandwidth governor all run
+unchanged.
+
+Recorded info dicts come from ``--infos`` files, which are ``yt-dlp -J``
+dumps (one JSON object per file, or a list). Without ``--infos`` a built-in
+set shaped like YouTube responses is used. Formats that need merging or
+transcoding require ffmpeg on PATH. The built-in set and the default mp4
+request do not. Each job gets its own video ID, so the metadata cache and
+the download store never short-circuit a job.
+
+``--concurrency`` clients each submit a job and then poll its progress
+until the job finishes. The JSON report contains:
+
+* throughput in completed jobs per minute,
+* p50/p90/p99/max latency of each endpoint,
+* event-loop lag, meaning how late a periodic ``asyncio.sleep`` wakes up,
+* a timeline of ``download_progress`` size (records and approximate
+  bytes) and process RSS.
+
+``--compare`` checks the report against an earlier one. It exits with
+status 1 when throughput drops, or a p99 latency or the event-loop lag
+grows, by more than ``--tolerance``.
+
+Usage (from the backend directory, requires httpx):
+
+    python benchmarks/bench_load.py --jobs 200 --concurrency 20 --output load.json
+    python benchmarks/bench_load.py --infos dumps/*.json --compare load.json
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import shutil
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+# 下载库与任务日志放在临时目录，不影响本机的真实数据，多次运行之间也不会命中下载库
+from isolated_env import WORKDIR  # noqa: E402
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+
+PAYLOAD = os.urandom(1024 * 1024)
+HEIGHTS = [144, 240, 360, 480, 720, 1080]
+RECORD_FIELDS = [f for f in main.ProgressRecord.__slots__ if f != 'lock']
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """Serves /media/<video_id>/<format_id> as ``size`` bytes, with single ranges."""
+
+    size = 512 * 1024
+    rate = 0  # bytes/s per connection, 0 = unlimited
+
+    def do_GET(self, body=True):
+        start, end = 0, self.size - 1
+        header = self.headers.get('Range', '')
+        if header.startswith('bytes='):
+            first, _, last = header[6:].partition('-')
+            start = int(first or 0)
+            end = min(int(last), end) if last else end
+        self.send_response(206 if header else 200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        if header:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{self.size}')
+        self.end_headers()
+        if not body:
+            return
+        sent, length, started = 0, end - start + 1, time.monotonic()
+        try:
+            while sent < length:
+                chunk = PAYLOAD[:min(64 * 1024, length - sent)]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if self.rate:
+                    ahead = sent / self.rate - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_HEAD(self):
+        self.do_GET(body=False)
+
+    def log_message(self, *args):
+        pass
+
+
+def builtin_infos() -> list:
+    """Info dicts shaped like yt-dlp's YouTube output, without fragmented formats."""
+    infos = []
+    for n, duration in enumerate((212, 61, 1830)):
+        formats = [
+            {'format_id': f'a{abr}', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': abr, 'tbr': abr}
+            for abr in (48, 129)
+        ]
+        for height in HEIGHTS:
+            # 音视频混合的 mp4，以及只有视频的 webm（默认的 mp4 请求无需合并）
+            formats.append({'format_id': f'm{height}', 'ext': 'mp4', 'vcodec': 'avc1.4d401e', 'acodec': 'mp4a.40.2',
+                            'height': height, 'width': height * 16 // 9, 'tbr': height * 2.5, 'fps': 30})
+            formats.append({'format_id': f'w{height}', 'ext': 'webm', 'vcodec': 'vp9', 'acodec': 'none',
+                            'height': height, 'width': height * 16 // 9, 'tbr': height * 2.0, 'fps': 30})
+        infos.append({
+            'id': f'recorded{n}', 'title': f'Load test video {n}', 'uploader': 'bench', 'duration': duration,
+            'view_count': 1000 * (n + 1), 'thumbnail': '', 'formats': formats,
+        })
+    return infos
+
+
+def load_infos(patterns: list) -> list:
+    infos = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            infos.extend(data if isinstance(data, list) else [data])
+    if not infos:
+        sys.exit(f"no info dicts found in {patterns}")
+    return infos
+
+
+def localize(template: dict, video_id: str, port: int, size: int) -> dict:
+    """Copy a recorded info dict so that every format downloads from the local server."""
+    info = {k: v for k, v in template.items() if k not in ('requested_formats', 'requested_downloads', 'formats')}
+    info.update({
+        'id': video_id,
+        'webpage_url': f'https://www.youtube.com/watch?v={video_id}',
+        'extractor': 'youtube',
+        'extractor_key': 'Youtube',
+        'expire': None,
+    })
+    info['formats'] = []
+    for f in template.get('formats') or []:
+        if f.get('ext') == 'mhtml':
+            continue
+        f = {k: v for k, v in f.items() if k not in ('fragments', 'fragment_base_url', 'manifest_url', 'http_headers')}
+        f.update({
+            'url': f"http://127.0.0.1:{port}/media/{video_id}/{f['format_id']}",
+            'protocol': 'http',
+            'filesize': size,
+        })
+        f.pop('filesize_approx', None)
+        info['formats'].append(f)
+    return info
+
+
+def install_recorded_extraction(infos: list, port: int, size: int, delay: float):
+    """Replace yt-dlp's network extraction with recorded info dicts."""
+    def extract_info(self, url, download=True, *args, **kwargs):
+        video_id = main.extract_video_id(url)
+        # 模拟网络往返，随后由 yt-dlp 照常处理格式列表
+        time.sleep(delay)
+        template = infos[int(video_id[-6:]) % len(infos)]
+        return self.process_ie_result(localize(template, video_id, port, size), download=download)
+
+    main.yt_dlp.YoutubeDL.extract_info = extract_info
+    # yt-dlp 的控制台进度条会混进 stdout 上的 JSON 报告
+    main.ydl_pool.base_options['noprogress'] = True
+
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def pick(pct):
+        return round(ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))], 3)
+    return {'count': len(ordered), 'p50': pick(50), 'p90': pick(90), 'p99': pick(99), 'max': round(ordered[-1], 3)}
+
+
+def registry_bytes() -> int:
+    """Approximate memory held by ``download_progress``: the job table, records and their values."""
+    total = 0
+    seen = set()
+    with main.download_progress._lock:
+        items = list(main.download_progress._records.items())
+    total += sys.getsizeof(main.download_progress._records)
+    for job_id, record in items:
+        total += sys.getsizeof(job_id)
+        if id(record) in seen:
+            continue
+        seen.add(id(record))
+        total += sys.getsizeof(record)
+        for field in RECORD_FIELDS:
+            value = getattr(record, field)
+            if value is not None and not isinstance(value, (bool, int)):
+                total += sys.getsizeof(value)
+    return total
+
+
+def current_rss() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        # 没有 /proc 时退而使用峰值 RSS（macOS 单位为字节，Linux 为 KiB）
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+async def measure_loop_lag(samples: list, interval: float, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append((time.perf_counter() - start - interval) * 1000)
+
+
+async def sample_memory(timeline: list, started: float, interval: float, stop: asyncio.Event):
+    while True:
+        stats = main.download_progress.stats()
+        timeline.append({
+            't': round(time.perf_counter() - started, 2),
+            'records': stats['jobs'],
+            'terminal_records': stats['terminal_records'],
+            'registry_bytes': registry_bytes(),
+            'rss_bytes': current_rss(),
+        })
+        if stop.is_set():
+            return
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_client(client: httpx.AsyncClient, next_job, args, save_path: str, latencies: dict, outcomes: list):
+    while True:
+        n = next_job()
+        if n is None:
+            return
+        payload = {'url': f'https://www.youtube.com/watch?v=bench{n:06d}', 'format': args.format,
+                   'quality': args.quality, 'save_path': save_path}
+        started = time.perf_counter()
+        response = await client.post('/download', json=payload, headers={'X-Client-Id': f'client{n % args.concurrency}'})
+        latencies['download'].append((time.perf_counter() - started) * 1000)
+        if response.status_code != 202:
+            outcomes.append(('rejected', time.perf_counter() - started))
+            continue
+        job_id = response.json()['job_id']
+        while True:
+            await asyncio.sleep(args.poll_ms / 1000)
+            poll_started = time.perf_counter()
+            response = await client.get(f'/progress/{job_id}')
+            latencies['progress'].append((time.perf_counter() - poll_started) * 1000)
+            status = response.json().get('download_status') if response.status_code == 200 else 'missing'
+            if status in main.TERMINAL_STATUSES or status == 'missing':
+                outcomes.append((status, time.perf_counter() - started))
+                break
+
+
+async def run(args, save_path: str) -> dict:
+    jobs = iter(range(args.jobs))
+    latencies = {'download': [], 'progress': []}
+    outcomes, lag, timeline = [], [], []
+    stop = asyncio.Event()
+    started = time.perf_counter()
+    probes = [
+        asyncio.create_task(measure_loop_lag(lag, args.lag_interval_ms / 1000, stop)),
+        asyncio.create_task(sample_memory(timeline, started, args.sample_interval, stop)),
+    ]
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+        await asyncio.gather(*(
+            run_client(client, lambda: next(jobs, None), args, save_path, latencies, outcomes)
+            for _ in range(args.concurrency)
+        ))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*probes)
+
+    completed = [duration for status, duration in outcomes if status == 'completed']
+    counts = {}
+    for status, _ in outcomes:
+        counts[status] = counts.get(status, 0) + 1
+    first, last = timeline[0], timeline[-1]
+    return {
+        'elapsed_s': round(elapsed, 3),
+        'jobs': counts,
+        'throughput_jobs_per_min': round(len(completed) / elapsed * 60, 2),
+        'job_seconds': percentiles(completed),
+        'latency_ms': {endpoint: percentiles(samples) for endpoint, samples in latencies.items()},
+        'event_loop_lag_ms': percentiles(lag),
+        'download_progress': {
+            'records_growth': last['records'] - first['records'],
+            'registry_bytes_growth': last['registry_bytes'] - first['registry_bytes'],
+            'rss_bytes_growth': last['rss_bytes'] - first['rss_bytes'],
+            'timeline': timeline,
+        },
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Metrics that regressed by more than ``tolerance`` (a fraction) against ``baseline``."""
+    checks = [(('throughput_jobs_per_min',), False), (('event_loop_lag_ms', 'p99'), True)]
+    checks += [(('latency_ms', endpoint, 'p99'), True) for endpoint in report['results']['latency_ms']]
+    regressions = []
+    for path, lower_is_better in checks:
+        old, new = baseline['results'], report['results']
+        for key in path:
+            old, new = (old or {}).get(key), (new or {}).get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if (change > tolerance) if lower_is_better else (change < -tolerance):
+            regressions.append({'metric': '.'.join(path), 'baseline': old, 'current': new, 'change': round(change, 3)})
+    return regressions
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=10, help='clients submitting and polling at once')
+    parser.add_argument('--infos', nargs='*', help='recorded info dicts (yt-dlp -J output), globs allowed')
+    parser.add_argument('--format', default='mp4')
+    parser.add_argument('--quality', default='720p')
+    parser.add_argument('--extract-ms', type=int, default=200, help='simulated extraction latency')
+    parser.add_argument('--media-kb', type=int, default=512, help='size of every served format')
+    parser.add_argument('--rate-kbps', type=int, default=0, help='per-connection media rate in KiB/s, 0 = unlimited')
+    parser.add_argument('--workers', type=int, help='download workers (default: DOWNLOAD_WORKERS)')
+    parser.add_argument('--poll-ms', type=int, default=100, help='GET /progress interval per client')
+    parser.add_argument('--lag-interval-ms', type=int, default=10)
+    parser.add_argument('--sample-interval', type=float, default=1.0, help='seconds between memory samples')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--compare', help='earlier JSON report to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression')
+    args = parser.parse_args()
+
+    infos = load_infos(args.infos) if args.infos else builtin_infos()
+    MediaHandler.size = args.media_kb * 1024
+    MediaHandler.rate = args.rate_kbps * 1024
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MediaHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    install_recorded_extraction(infos, server.server_address[1], MediaHandler.size, args.extract_ms / 1000)
+    if args.workers:
+        main.download_scheduler.set_workers(args.workers)
+
+    save_path = os.path.join(WORKDIR, 'downloads')
+    results = asyncio.run(run(args, save_path))
+    # 等待转码等后台线程结束后再删除临时目录
+    main.transcode_pool.shutdown(wait=True)
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+    server.shutdown()
+
+    report = {
+        'benchmark': 'load',
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'yt_dlp': main.yt_dlp.version.__version__,
+            'download_workers': main.download_scheduler.stats()['workers'],
+            'adaptive_concurrency': main.concurrency_controller.enabled,
+        },
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        'results': results,
+        'concurrency_decisions': list(main.concurrency_controller.decisions),
+    }
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            report['regressions'] = compare(report, json.load(f), args.tolerance)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if report.get('regressions'):
+        for item in report['regressions']:
+            print(f"regression: {item['metric']} {item['baseline']} -> {item['current']} ({item['change']:+.0%})",
+                  file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,127 @@
+"""Benchmark: CPU cost of the yt-dlp progress hook.
+
+Replays a stream of progress dicts (100k by default) through the original
+hook, which formatted speed/ETA strings and published every tick under a
+global lock, and through the current throttled DownloadProgress, which
+stores raw numbers and publishes only meaningful changes.
+
+The stream is synthesised to look like a fast link (ticks every ~2 ms);
+pass --input to replay a recording instead (one JSON progress dict per
+line, e.g. captured from a real yt-dlp run with a logging hook).
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_progress_hook.py --ticks 100000
+"""
+import argparse
+import json
+import threading
+import time
+
+# 下载库与任务日志放在临时目录，不影响本机的真实数据
+import isolated_env  # noqa: F401
+
+import main  # noqa: E402
+
+
+class LegacyDownloadProgress:
+    """Copy of the hook as it was before throttling, for comparison."""
+
+    def __init__(self, store: dict, lock: threading.Lock):
+        self.store = store
+        self.lock = lock
+        self.job_id = ""
+
+    def __call__(self, d):
+        if d['status'] == 'downloading':
+            total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
+            downloaded_bytes = d.get('downloaded_bytes', 0)
+            progress = round((downloaded_bytes / total_bytes) * 100, 2) if total_bytes > 0 else 0
+            speed_bytes = d.get('speed', 0)
+            if speed_bytes:
+                if speed_bytes > 1024 * 1024:
+                    speed = f"{(speed_bytes / (1024 * 1024)):.1f} MB/s"
+                else:
+                    speed = f"{(speed_bytes / 1024):.1f} KB/s"
+            else:
+                speed = "calculating..."
+            eta_seconds = d.get('eta')
+            if eta_seconds is not None and eta_seconds > 0:
+                eta = f"{int(eta_seconds // 60)}:{int(eta_seconds % 60):02d}"
+            else:
+                eta = "calculating..."
+            with self.lock:
+                self.store[self.job_id].update({
+                    "download_progress": progress,
+                    "download_speed": speed,
+                    "download_eta": eta,
+                    "download_status": "downloading"
+                })
+
+
+def synthesize(ticks: int, total_bytes: int = 500 * 1024 * 1024) -> list:
+    step = total_bytes // ticks
+    return [
+        {
+            'status': 'downloading',
+            'downloaded_bytes': i * step,
+            'total_bytes': total_bytes,
+            'speed': 8_000_000 + (i % 97) * 1000,
+            'eta': (ticks - i) * 0.002,
+            'elapsed': i * 0.002,
+        }
+        for i in range(ticks)
+    ]
+
+
+def load(path: str) -> list:
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay(hook, stream: list, tick_interval: float) -> float:
+    """Feed the stream through the hook; returns CPU seconds used."""
+    start = time.process_time()
+    if tick_interval:
+        # 按录制的时间间隔回放，让基于时间的节流生效
+        clock = [0.0]
+        original = main.time.monotonic
+        main.time.monotonic = lambda: clock[0]
+        try:
+            for d in stream:
+                clock[0] += tick_interval
+                hook(d)
+        finally:
+            main.time.monotonic = original
+    else:
+        for d in stream:
+            hook(d)
+    return time.process_time() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ticks", type=int, default=100_000)
+    parser.add_argument("--input", help="JSON-lines file of recorded progress dicts")
+    parser.add_argument("--tick-interval", type=float, default=0.002, help="simulated seconds between ticks")
+    args = parser.parse_args()
+
+    stream = load(args.input) if args.input else synthesize(args.ticks)
+
+    legacy_store = {"bench": {}}
+    legacy = LegacyDownloadProgress(legacy_store, threading.Lock())
+    legacy.job_id = "bench"
+    legacy_cpu = replay(legacy, stream, 0)
+
+    main.download_progress.create("bench")
+    published = [0]
+    record = main.download_progress.get("bench")
+    main.download_progress.add_listener(record, lambda: published.__setitem__(0, published[0] + 1))
+    hook = main.DownloadProgress()
+    hook.job_id = "bench"
+    current_cpu = replay(hook, stream, args.tick_interval)
+
+    print(f"ticks replayed: {len(stream)}")
+    print(f"before: {legacy_cpu * 1000:.1f} ms CPU, {len(stream)} publications")
+    print(f" after: {current_cpu * 1000:.1f} ms CPU, {published[0]} publications")
+    print(f"speedup: {legacy_cpu / current_cpu:.1f}x")
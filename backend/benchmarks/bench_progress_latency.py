@@ -0,0 +1,113 @@
+"""Load test: /progress latency while many slow extractions are in flight.
+
+Replaces yt-dlp extraction with a fake that sleeps, submits N jobs to
+POST /download and then polls GET /progress/{id} in a tight loop.  Because
+extraction runs in ``extract_pool`` the event loop stays free and the p99
+latency of /progress should stay flat compared with the idle baseline.
+The script exits non-zero if any submitted job does not complete.
+
+Usage (from the backend directory, requires httpx):
+
+    python benchmarks/bench_progress_latency.py --jobs 50 --delay 2.0
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+# 下载库和任务日志放在临时目录，不影响真实数据
+from isolated_env import WORKDIR  # noqa: E402
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+
+
+def make_slow_extractor(delay: float):
+    def fake_extract_video_info(url: str, format: str, quality: str) -> tuple:
+        main.record_extraction()
+        time.sleep(delay)
+        info = {'id': url[-11:], 'title': 'bench video', 'formats': []}
+        best = {'format_id': '18', 'height': 360, 'url': ''}
+        return info, best, best['format_id']
+    return fake_extract_video_info
+
+
+def fake_download(url: str, ydl_opts: dict, job_id: str, info: dict = None, store_key: str = None,
+                  postprocessors: list = None, target_path: str = None, parallel_streams: bool = False):
+    """Same signature as ``main.download_in_background``; completes immediately."""
+    try:
+        main.update_progress(job_id, {"download_status": "completed", "download_progress": 100})
+        return True
+    finally:
+        main.release_inflight(job_id)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def poll_progress(client, job_id: str, duration: float) -> list:
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.get(f"/progress/{job_id}")
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.text
+        await asyncio.sleep(0.005)
+    return latencies
+
+
+async def wait_for_jobs(client, job_ids: list, timeout: float) -> dict:
+    """Poll until every job is terminal; returns {job_id: status} of those not completed."""
+    deadline = time.perf_counter() + timeout
+    while True:
+        statuses = {}
+        for job_id in job_ids:
+            response = await client.get(f"/progress/{job_id}")
+            statuses[job_id] = response.json().get("download_status") if response.status_code == 200 else None
+        pending = [job_id for job_id, status in statuses.items() if status not in main.TERMINAL_STATUSES]
+        if not pending or time.perf_counter() >= deadline:
+            return {job_id: status for job_id, status in statuses.items() if status != "completed"}
+        await asyncio.sleep(0.1)
+
+
+async def run(jobs: int, delay: float, save_path: str) -> bool:
+    main.extract_video_info = make_slow_extractor(delay)
+    main.download_in_background = fake_download
+    main.extract_pool._max_workers = max(main.extract_pool._max_workers, jobs)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        payload = {'url': 'https://youtu.be/dQw4w9WgXcQ', 'format': 'mp4', 'quality': '360p', 'save_path': save_path}
+        probe = (await client.post("/download", json=payload)).json()["job_id"]
+        await asyncio.sleep(delay + 0.5)
+        idle = await poll_progress(client, probe, 1.0)
+
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(client.post("/download", json=payload) for _ in range(jobs)))
+        submit_ms = (time.perf_counter() - start) * 1000
+        assert all(r.status_code == 202 for r in responses)
+        loaded = await poll_progress(client, probe, delay * 0.8)
+        # 等待所有任务结束，避免解释器退出时线程池已关闭
+        failed = await wait_for_jobs(client, [probe] + [r.json()["job_id"] for r in responses], delay + 10)
+
+    print(f"submitted {jobs} jobs in {submit_ms:.1f} ms")
+    for name, samples in (("idle", idle), ("loaded", loaded)):
+        print(f"{name:>6}: n={len(samples)} p50={statistics.median(samples):.2f} ms p99={percentile(samples, 99):.2f} ms")
+    for job_id, status in failed.items():
+        print(f"job {job_id} did not complete: {status}", file=sys.stderr)
+    return not failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=2.0, help="fake extraction time in seconds")
+    parser.add_argument("--save-path", default=WORKDIR)
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args.jobs, args.delay, args.save_path)) else 1)
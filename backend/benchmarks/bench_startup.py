@@ -0,0 +1,94 @@
+"""Benchmark: cold-start import time and memory of the backend module.
+
+Imports ``main`` in fresh interpreters under ``python -X importtime`` with
+HEADLESS=1. For each run it records:
+
+* the cumulative import time of ``main`` taken from the importtime log,
+* the wall-clock time of the whole import,
+* peak RSS of the child process (``resource.getrusage``),
+* whether ``yt_dlp`` and ``tkinter`` were loaded as a side effect.
+
+The slowest top-level imports of the last run are listed so regressions
+are easy to attribute. ``--backend`` points at another checkout of the
+backend directory, so an old tree can be compared with the current one.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --backend /tmp/old/backend
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+# 子进程继承环境变量，导入 main 时不会写入本机的下载库与任务日志
+import isolated_env  # noqa: F401
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import resource, sys, time, json
+start = time.perf_counter()
+import main
+wall = time.perf_counter() - start
+print(json.dumps({
+    'wall': wall,
+    'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'yt_dlp': 'yt_dlp.YoutubeDL' in sys.modules,
+    'tkinter': 'tkinter' in sys.modules,
+}))
+"""
+
+# import time:       self [us] |  cumulative | imported package
+IMPORTTIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)')
+
+
+def run_once(backend: str) -> tuple:
+    env = dict(os.environ, HEADLESS='1', LOG_LEVEL='WARNING', PYTHONDONTWRITEBYTECODE='1')
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD],
+        cwd=backend, env=env, capture_output=True, text=True, check=True
+    )
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    imports = []
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append((name, len(indent) // 2, int(self_us), int(cumulative_us)))
+    result['main_us'] = next((cum for name, depth, _, cum in imports if name == 'main' and depth == 0), 0)
+    return result, imports
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='slowest imports to list')
+    parser.add_argument('--backend', default=BACKEND_DIR, help='backend directory to import main from')
+    args = parser.parse_args()
+
+    results = []
+    for _ in range(args.runs):
+        result, imports = run_once(args.backend)
+        results.append(result)
+
+    # main 直接导入的模块（缩进一级）按累计耗时排序
+    direct = sorted((item for item in imports if item[1] == 1), key=lambda item: item[3], reverse=True)
+    print(f"{'module':<32} {'cumulative ms':>14}")
+    for name, _, _, cumulative in direct[:args.top]:
+        print(f"{name:<32} {cumulative / 1000:>14.1f}")
+    print(f"{'main (self)':<32} {next(s for n, d, s, _ in imports if n == 'main' and d == 0) / 1000:>14.1f}")
+
+    print(f"\n{args.runs} cold starts of {args.backend}")
+    print(f"import main (importtime): median {statistics.median(r['main_us'] for r in results) / 1000:.1f} ms")
+    print(f"import main (wall):       median {statistics.median(r['wall'] for r in results) * 1000:.1f} ms")
+    print(f"peak RSS:                 median {statistics.median(r['rss_kb'] for r in results) / 1024:.1f} MiB")
+    print(f"yt_dlp loaded: {results[-1]['yt_dlp']}  tkinter loaded: {results[-1]['tkinter']}")
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,174 @@
+"""Benchmark: fresh YoutubeDL per call vs ``main.YoutubeDLPool``.
+
+Starts a local HTTPS server with a throwaway self-signed certificate
+generated by the ``openssl`` CLI. The server speaks HTTP/1.1 keep-alive
+and counts every TLS handshake it completes. ``--rtt-ms`` delays each
+handshake, which stands in for the round trips to a remote CDN. Each job
+then does what a backend job does. One YoutubeDL extracts a direct media
+URL, and a second one downloads it. Both run in one of two modes:
+
+* fresh: ``yt_dlp.YoutubeDL(opts)`` for every call, as before the pool.
+* pooled: ``main.YoutubeDLPool(...).ydl(opts)``, which copies the
+  extractor registry from a template and leases an idle request director.
+
+Reported per mode: the median time to construct a YoutubeDL, the median
+time per job, and TLS handshakes per job. Keep-alive reuse depends on the
+request handler. yt-dlp uses the ``requests`` handler when that package
+is installed (see requirements.txt). The urllib fallback opens a new
+connection for every request, so there the pool only saves setup time.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_ydl_pool.py --jobs 20 --rtt-ms 30
+"""
+import argparse
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 下载库与任务日志放在临时目录，不影响本机的真实数据
+import isolated_env  # noqa: F401
+
+import yt_dlp  # noqa: E402
+import yt_dlp.dependencies  # noqa: E402
+
+import main  # noqa: E402
+
+PAYLOAD = os.urandom(256 * 1024)
+BASE_OPTIONS = {'quiet': True, 'no_warnings': True, 'nocheckcertificate': True}
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """Serves /<name>.mp4 as PAYLOAD, honouring single byte ranges."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self, body=True):
+        start, end = 0, len(PAYLOAD) - 1
+        header = self.headers.get('Range', '')
+        if header.startswith('bytes='):
+            first, _, last = header[6:].partition('-')
+            start = int(first or 0)
+            end = min(int(last), end) if last else end
+        self.send_response(206 if header else 200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        if header:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(PAYLOAD)}')
+        self.end_headers()
+        if body:
+            self.wfile.write(PAYLOAD[start:end + 1])
+
+    def do_HEAD(self):
+        self.do_GET(body=False)
+
+    def log_message(self, *args):
+        pass
+
+
+class HandshakeCountingServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, context: ssl.SSLContext, rtt: float):
+        super().__init__(address, handler)
+        self.context = context
+        self.rtt = rtt
+        self.handshakes = 0
+        self._lock = threading.Lock()
+
+    def finish_request(self, request, client_address):
+        # 握手放在处理线程里完成，慢握手不会阻塞 accept
+        time.sleep(self.rtt)
+        try:
+            request = self.context.wrap_socket(request, server_side=True)
+        except (ssl.SSLError, OSError):
+            return
+        with self._lock:
+            self.handshakes += 1
+        super().finish_request(request, client_address)
+
+    def handle_error(self, request, client_address):
+        # 客户端关闭空闲的 keep-alive 连接属于正常情况
+        pass
+
+
+def make_context(workdir: str) -> ssl.SSLContext:
+    cert, key = os.path.join(workdir, 'cert.pem'), os.path.join(workdir, 'key.pem')
+    try:
+        subprocess.run(
+            ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+             '-subj', '/CN=127.0.0.1', '-keyout', key, '-out', cert],
+            check=True, capture_output=True
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        sys.exit(f"openssl is required to create the test certificate: {e}")
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+def run_job(mode: str, pool: main.YoutubeDLPool, url: str, out_dir: str, job: int, setups: list):
+    def open_ydl(opts: dict):
+        if mode == 'pooled':
+            return pool.ydl(opts)
+        return yt_dlp.YoutubeDL({**BASE_OPTIONS, **opts})
+
+    # 与 prepare_download / download_in_background 相同：先提取，再用新的实例下载
+    start = time.perf_counter()
+    with open_ydl({'extract_flat': False}) as ydl:
+        setups.append(time.perf_counter() - start)
+        info = ydl.extract_info(url, download=False)
+    start = time.perf_counter()
+    opts = {
+        'noprogress': True,
+        'outtmpl': os.path.join(out_dir, f'{mode}-{job}.%(ext)s'),
+        'http_chunk_size': 64 * 1024,
+    }
+    with open_ydl(opts) as ydl:
+        setups.append(time.perf_counter() - start)
+        ydl.process_ie_result(info, download=True)
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=20)
+    parser.add_argument('--rtt-ms', type=int, default=30, help='extra delay per TLS handshake')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        server = HandshakeCountingServer(('127.0.0.1', 0), MediaHandler, make_context(workdir), args.rtt_ms / 1000)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_address[1]
+
+        handler = 'requests' if yt_dlp.dependencies.requests else 'urllib'
+        print(f"request handler: {handler}, {args.jobs} jobs, {args.rtt_ms} ms per handshake\n")
+        print(f"{'mode':<8} {'setup ms':>9} {'job ms':>8} {'handshakes/job':>15}")
+
+        pool = main.YoutubeDLPool(BASE_OPTIONS)
+        # 预热：导入提取器模块、建好模板，两种模式都不计这部分
+        with pool.ydl({}):
+            pass
+        results = {}
+        for mode in ('fresh', 'pooled'):
+            server.handshakes = 0
+            setups, durations = [], []
+            for job in range(args.jobs):
+                start = time.perf_counter()
+                run_job(mode, pool, f'https://127.0.0.1:{port}/clip-{job}.mp4', workdir, job, setups)
+                durations.append(time.perf_counter() - start)
+            results[mode] = statistics.median(durations)
+            print(f"{mode:<8} {statistics.median(setups) * 1000:>9.1f} {results[mode] * 1000:>8.1f} "
+                  f"{server.handshakes / args.jobs:>15.1f}")
+        print(f"\nper-job speedup {results['fresh'] / results['pooled']:.2f}x, pool {pool.stats()}")
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main_()
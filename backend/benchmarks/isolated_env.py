@@ -0,0 +1,22 @@
+"""Keep benchmark runs away from the user's data.
+
+Import this before ``main``: the download store, job journal and metadata
+cache then live in a temporary ``WORKDIR`` (removed at exit) rather than in
+the download directory, and the backend directory is put on ``sys.path``.
+Environment variables are inherited by subprocesses that import ``main``.
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+WORKDIR = tempfile.mkdtemp(prefix='ytdl_bench_')
+os.environ.setdefault('HEADLESS', '1')
+os.environ.update({
+    'DOWNLOAD_STORE_DIR': os.path.join(WORKDIR, 'store'),
+    'JOB_JOURNAL_DB': os.path.join(WORKDIR, 'jobs.sqlite3'),
+    'METADATA_CACHE_DB': '',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+atexit.register(shutil.rmtree, WORKDIR, True)
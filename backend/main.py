@@ -1,29 +1,177 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, validator
-import yt_dlp
 import re
 import os
 from datetime import datetime
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional
+from collections import OrderedDict, deque
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 import threading
-import tkinter as tk
-from tkinter import filedialog
+import uuid
+import time
+import copy
+import json
+import sqlite3
+import hashlib
+import functools
+import bisect
+import logging
+import shutil
+import importlib
 import subprocess
+import sys
+import socket
+import contextlib
+import urllib.parse
+import random
+
+class LazyModule:
+    """Module proxy that performs the real import on first attribute access."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        module = self._module
+        if module is None:
+            # 多个提取线程可能同时首次访问
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+                module = self._module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+# yt-dlp 导入约需 100 ms 以上，推迟到第一次提取或下载时再加载
+yt_dlp = LazyModule('yt_dlp')
+
+# 无界面模式：不导入 tkinter，禁用目录选择对话框。未设置时，Linux 下无图形会话即视为无界面
+HEADLESS = os.environ.get('HEADLESS', '').lower() in ('1', 'true', 'yes') or (
+    'HEADLESS' not in os.environ and sys.platform.startswith('linux')
+    and not (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+)
 
 app = FastAPI()
 
-# Global dictionary to store download progress
-download_progress: Dict[str, dict] = {}
+# 下载任务表：job_id -> 任务状态与视频元数据
+jobs: Dict[str, dict] = {}
+
+# 正在进行的任务：(视频 ID, 格式, 清晰度, 保存路径) -> job_id，用于合并相同请求
+inflight_jobs: Dict[tuple, str] = {}
+coalesced_requests = 0
+
+# 处于转码阶段的任务：job_id -> 取消标志（下载阶段交接过来的同一个 Event）
+transcoding_jobs: Dict[str, threading.Event] = {}
+
+# 主任务被取消后由合并的请求接管下载：下载流水线使用的 job_id -> 接管的 job_id
+download_owners: Dict[str, str] = {}
+
+# 元数据提取线程池，与下载线程池分离，慢速提取不会阻塞事件循环
+extract_pool = ThreadPoolExecutor(max_workers=16)
+
+# Lock for thread-safe operations on jobs / inflight_jobs
+jobs_lock = threading.Lock()
+
+# 元数据提取计数器：每个下载任务只应触发一次 extract_info
+extraction_count = 0
+extraction_lock = threading.Lock()
+
+# 分级日志（LOG_LEVEL），消息采用 key=value 形式便于检索
+logging.basicConfig(
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s %(name)s %(message)s'
+)
+logger = logging.getLogger("youtube_download")
+
+class Counter:
+    """Monotonic Prometheus counter."""
 
-# Thread pool for handling downloads
-thread_pool = ThreadPoolExecutor(max_workers=4)
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = threading.Lock()
 
-# Lock for thread-safe operations
-progress_lock = threading.Lock()
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter", f"{self.name} {self.value}"]
+
+class Histogram:
+    """Prometheus histogram with fixed upper bounds."""
+
+    def __init__(self, name: str, help: str, buckets: tuple):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个为 +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def render(self) -> list:
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float('inf') else repr(float(bound))
+            lines.append(f'{self.name}_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+def render_metric(name: str, help: str, kind: str, samples) -> list:
+    """Exposition lines for a value read at scrape time.
+
+    ``samples`` is a single value or a list of (labels dict, value).
+    """
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    if not isinstance(samples, list):
+        samples = [({}, samples)]
+    for labels, value in samples:
+        label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return lines
+
+# 热路径计时指标，由 GET /metrics 导出
+SECONDS_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+METRICS = {
+    "extraction_seconds": Histogram(
+        "ytdl_extraction_seconds", "yt-dlp metadata extraction latency", SECONDS_BUCKETS),
+    "download_seconds": Histogram(
+        "ytdl_download_seconds", "Time spent in the download stage per job", SECONDS_BUCKETS),
+    "download_throughput": Histogram(
+        "ytdl_download_throughput_bytes_per_second", "Average download throughput per job",
+        tuple(2 ** n * 1024 for n in range(4, 18, 2))),  # 16 KiB/s .. 64 MiB/s
+    "postprocess_seconds": Histogram(
+        "ytdl_postprocess_seconds", "FFmpeg post-processing time per job", SECONDS_BUCKETS),
+    "progress_hook_calls": Counter(
+        "ytdl_progress_hook_calls_total", "yt-dlp progress hook invocations"),
+    "progress_hook_publishes": Counter(
+        "ytdl_progress_hook_publishes_total", "Progress hook ticks published to the registry"),
+    "jobs_completed": Counter("ytdl_jobs_completed_total", "Jobs that finished successfully"),
+    "jobs_failed": Counter("ytdl_jobs_failed_total", "Jobs that ended with an error"),
+    "jobs_cancelled": Counter("ytdl_jobs_cancelled_total", "Jobs cancelled by a client"),
+    "stream_bytes": Counter("ytdl_stream_bytes_total", "Bytes sent by /stream passthrough responses"),
+    "download_retries": Counter("ytdl_download_retries_total", "Download attempts retried after a transient error"),
+}
 
 # Configure CORS
 app.add_middleware(
@@ -54,24 +202,35 @@ def get_downloads_dir() -> Path:
 DOWNLOAD_DIR = get_downloads_dir()
 DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
+# 支持的 YouTube 链接格式：watch、/v/、youtu.be、embed、shorts（分组 1 为视频 ID）
+YOUTUBE_URL_PATTERNS = [
+    re.compile(r'^https?://(?:www\.)?youtube\.com/watch\?v=([\w-]+)'),
+    re.compile(r'^https?://(?:www\.)?youtube\.com/v/([\w-]+)'),
+    re.compile(r'^https?://youtu\.be/([\w-]+)'),
+    re.compile(r'^https?://(?:www\.)?youtube\.com/embed/([\w-]+)'),
+    re.compile(r'^https?://(?:www\.)?youtube\.com/shorts/([\w-]+)'),
+]
+
+def extract_video_id(url: str) -> Optional[str]:
+    """Return the canonical video ID for a supported YouTube URL."""
+    for pattern in YOUTUBE_URL_PATTERNS:
+        match = pattern.match(url)
+        if match:
+            return match.group(1)
+    return None
+
 class VideoURL(BaseModel):
     url: str
     format: str = "mp4"  # Default format
     quality: str = "1080p"  # Default quality
     save_path: str = ""  # 用户指定的保存路径，默认为空
+    rate_limit: Optional[int] = None  # 单任务限速（KiB/s），为空则只受全局带宽限制
+    download_mode: str = "standard"  # "parallel"：音视频流并行下载、分片并发、分块请求
+    fragment_concurrency: Optional[int] = None  # parallel 模式下的分片并发数，默认 FRAGMENT_CONCURRENCY
 
     @validator('url')
     def validate_youtube_url(cls, v):
-        # YouTube URL patterns
-        youtube_patterns = [
-            r'^https?://(?:www\.)?youtube\.com/watch\?v=[\w-]+',
-            r'^https?://(?:www\.)?youtube\.com/v/[\w-]+',
-            r'^https?://youtu\.be/[\w-]+',
-            r'^https?://(?:www\.)?youtube\.com/embed/[\w-]+',
-            r'^https?://(?:www\.)?youtube\.com/shorts/[\w-]+'
-        ]
-        
-        if not any(re.match(pattern, v) for pattern in youtube_patterns):
+        if extract_video_id(v) is None:
             raise ValueError('Invalid YouTube URL format')
         return v
 
@@ -107,6 +266,25 @@ class VideoURL(BaseModel):
                 raise ValueError(f'无效的保存路径: {str(e)}')
         return str(DOWNLOAD_DIR.absolute())  # 如果未提供，返回默认下载目录
 
+    @validator('rate_limit')
+    def validate_rate_limit(cls, v):
+        if v is not None and v <= 0:
+            raise ValueError('rate_limit must be a positive number of KiB/s')
+        return v
+
+    @validator('download_mode')
+    def validate_download_mode(cls, v):
+        allowed_modes = ['standard', 'parallel']
+        if v not in allowed_modes:
+            raise ValueError(f'download_mode must be one of {allowed_modes}')
+        return v
+
+    @validator('fragment_concurrency')
+    def validate_fragment_concurrency(cls, v):
+        if v is not None and not 1 <= v <= 32:
+            raise ValueError('fragment_concurrency must be between 1 and 32')
+        return v
+
 def get_safe_filename(title: str) -> str:
     """Convert title to safe filename."""
     # 移除或替换不安全的字符
@@ -118,435 +296,3840 @@ def get_safe_filename(title: str) -> str:
     # 限制长度并移除首尾空格
     return safe_chars[:100].strip()
 
-def update_progress(filename: str, progress_data: dict):
-    with progress_lock:
-        if filename in download_progress:
-            download_progress[filename].update(progress_data)
+def record_extraction():
+    """Count one yt-dlp metadata extraction."""
+    global extraction_count
+    with extraction_lock:
+        extraction_count += 1
 
-class DownloadProgress:
-    def __init__(self):
-        self.progress = 0
-        self.speed = ""
-        self.eta = "calculating..."
-        self.status = "starting"
-        self.filename = ""
+def get_extraction_count() -> int:
+    with extraction_lock:
+        return extraction_count
 
-    def __call__(self, d):
-        if d['status'] == 'downloading':
+# 当前这一秒内已分配的文件路径：文件要到开始下载后才出现，并发任务仅靠 exists() 会拿到同一个名字
+reserved_filepaths = set()
+reserved_timestamp = None
+filepath_lock = threading.Lock()
+
+def make_local_filepath(save_path: str, title: str, ext: str) -> tuple:
+    """Return (filename, filepath) for a new download, avoiding existing files."""
+    global reserved_timestamp
+    safe_title = get_safe_filename(title)
+    with filepath_lock:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # 文件名带秒级时间戳，不同秒分配的名字不会冲突
+        if timestamp != reserved_timestamp:
+            reserved_filepaths.clear()
+            reserved_timestamp = timestamp
+        filename = f"{safe_title}_{timestamp}.{ext}"
+        counter = 1
+        while (Path(save_path) / filename) in reserved_filepaths or (Path(save_path) / filename).exists():
+            filename = f"{safe_title}_{timestamp}_{counter}.{ext}"
+            counter += 1
+        reserved_filepaths.add(Path(save_path) / filename)
+    return filename, Path(save_path) / filename
+
+TERMINAL_STATUSES = ("completed", "error", "cancelled")
+
+def format_speed(status: str, speed: Optional[float]) -> str:
+    """Human readable download speed for a progress record."""
+    if status == "downloading":
+        if not speed:
+            return "calculating..."
+        if speed > 1024 * 1024:  # MB/s
+            return f"{(speed / (1024 * 1024)):.1f} MB/s"
+        return f"{(speed / 1024):.1f} KB/s"
+    if status in ("processing", "completed"):
+        return "完成"  # 使用中文更友好
+    if status == "error":
+        return "0 KB/s"
+    return "准备中..."
+
+def format_eta(status: str, eta: Optional[float]) -> str:
+    """Format remaining seconds as m:ss while downloading."""
+    if status != "downloading":
+        return "--:--"
+    if eta is None or eta <= 0:
+        return "calculating..."
+    minutes = int(eta // 60)
+    seconds = int(eta % 60)
+    return f"{minutes}:{seconds:02d}"
+
+class ProgressRecord:
+    """Progress of one download; coalesced jobs share the same record.
+
+    Only raw numbers are stored on the hot path; speed and ETA strings are
+    formatted when the record is read.
+    """
+
+    __slots__ = (
+        "download_progress", "download_status", "downloaded_bytes", "total_bytes",
+        "speed", "eta", "save_path", "local_filename", "error_message", "from_store",
+        "priority", "queue_position", "finished_at", "job_ids", "listeners", "lock"
+    )
+
+    FIELDS = (
+        "download_status", "downloaded_bytes", "total_bytes",
+        "save_path", "local_filename", "error_message", "from_store",
+        "priority", "queue_position"
+    )
+    # 通过共享任务存储在进程间同步的原始字段
+    STATE_FIELDS = FIELDS + ("download_progress", "speed", "eta")
+
+    def __init__(self, save_path: str = ""):
+        self.download_progress = 0
+        self.download_status = "preparing"
+        self.downloaded_bytes = None
+        self.total_bytes = None
+        self.speed = None
+        self.eta = None
+        self.save_path = save_path
+        self.local_filename = None
+        self.error_message = None
+        self.from_store = None
+        self.priority = None
+        self.queue_position = None
+        self.finished_at = None
+        self.job_ids = []
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            data = {
+                field: getattr(self, field) for field in self.FIELDS
+                if getattr(self, field) is not None
+            }
+            status, speed, eta = self.download_status, self.speed, self.eta
+            data["download_progress"] = round(self.download_progress, 2)
+        data["download_speed"] = format_speed(status, speed)
+        data["download_eta"] = format_eta(status, eta)
+        return data
+
+    def to_state(self) -> dict:
+        """Raw field values, suitable for ``ProgressRegistry.update`` elsewhere."""
+        with self.lock:
+            return {field: getattr(self, field) for field in self.STATE_FIELDS}
+
+class ProgressRegistry:
+    """Bounded store of ProgressRecords with per-job locking.
+
+    Progress updates look their record up without a lock and only lock the
+    record itself; the job table lock is taken only to add or remove jobs.
+    Finished or failed records are evicted after ``terminal_ttl`` seconds,
+    or sooner once more than ``max_terminal`` of them are kept. Reads treat
+    an expired record as already gone, and a background thread evicts
+    expired records every ``sweep_interval`` seconds even when no other
+    job finishes.
+    """
+
+    def __init__(self, max_terminal: int = 1000, terminal_ttl: float = 3600, on_evict=None, on_finish=None,
+                 sweep_interval: float = None):
+        self.max_terminal = max_terminal
+        self.terminal_ttl = terminal_ttl
+        self.on_evict = on_evict
+        self.on_finish = on_finish
+        self.sweep_interval = sweep_interval or min(60.0, max(terminal_ttl / 10, 1.0))
+        self._records: Dict[str, ProgressRecord] = {}
+        self._lock = threading.Lock()
+        self._terminal = deque()
+        self._terminal_lock = threading.Lock()
+        self._sweeper = None
+        self.evicted = 0
+
+    def create(self, job_id: str, save_path: str = "") -> ProgressRecord:
+        record = ProgressRecord(save_path)
+        self.attach(job_id, record)
+        return record
+
+    def attach(self, job_id: str, record: ProgressRecord):
+        """Register job_id against an existing record (used for coalescing)."""
+        with self._lock:
+            self._records[job_id] = record
+        with record.lock:
+            record.job_ids.append(job_id)
+
+    def detach(self, job_id: str):
+        """Remove job_id from its record without touching other attached jobs."""
+        with self._lock:
+            record = self._records.pop(job_id, None)
+        if record is not None:
+            with record.lock:
+                if job_id in record.job_ids:
+                    record.job_ids.remove(job_id)
+
+    def get(self, job_id: str) -> Optional[ProgressRecord]:
+        record = self._records.get(job_id)
+        # 已过期但尚未被清理的记录视为不存在；这里不直接淘汰，调用方可能持有 jobs_lock
+        if record is not None and record.finished_at is not None and (
+            record.finished_at < time.time() - self.terminal_ttl
+        ):
+            return None
+        return record
+
+    def __contains__(self, job_id: str) -> bool:
+        return self.get(job_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def update(self, job_id: str, progress_data: dict) -> bool:
+        """Apply progress_data; False if the job is unknown or the update was refused.
+
+        A job that was cancelled or failed never turns "completed" afterwards.
+        """
+        record = self.get(job_id)
+        if record is None:
+            return False
+        changed = False
+        with record.lock:
+            if progress_data.get("download_status") == "completed" and record.download_status in ("error", "cancelled"):
+                return False
+            for field, value in progress_data.items():
+                if getattr(record, field) != value:
+                    setattr(record, field, value)
+                    changed = True
+            newly_finished = record.finished_at is None and record.download_status in TERMINAL_STATUSES
+            if newly_finished:
+                record.finished_at = time.time()
+            listeners = list(record.listeners) if changed else ()
+        # 只在数据实际变化时通知流式订阅者（SSE / WebSocket）
+        for listener in listeners:
+            listener()
+        if newly_finished:
+            if self.on_finish is not None:
+                with record.lock:
+                    job_ids = list(record.job_ids)
+                for finished_id in job_ids:
+                    self.on_finish(finished_id, record.download_status)
+            with self._terminal_lock:
+                self._terminal.append(record)
+                if self._sweeper is None:
+                    self._sweeper = threading.Thread(target=self._sweep_loop, daemon=True)
+                    self._sweeper.start()
+            self.evict()
+        return True
+
+    def add_listener(self, record: ProgressRecord, listener):
+        with record.lock:
+            record.listeners.append(listener)
+
+    def remove_listener(self, record: ProgressRecord, listener):
+        with record.lock:
+            if listener in record.listeners:
+                record.listeners.remove(listener)
+
+    def snapshot(self, job_id: str) -> Optional[dict]:
+        record = self.get(job_id)
+        return record.to_dict() if record is not None else None
+
+    def evict(self):
+        """Drop terminal records that are too old or over the count limit."""
+        cutoff = time.time() - self.terminal_ttl
+        expired = []
+        with self._terminal_lock:
+            while self._terminal and (
+                len(self._terminal) > self.max_terminal or self._terminal[0].finished_at < cutoff
+            ):
+                expired.append(self._terminal.popleft())
+        for record in expired:
+            with record.lock:
+                job_ids = list(record.job_ids)
+            for job_id in job_ids:
+                with self._lock:
+                    self._records.pop(job_id, None)
+                if self.on_evict is not None:
+                    self.on_evict(job_id)
+            self.evicted += 1
+
+    def _sweep_loop(self):
+        # 没有新任务结束时也要按 TTL 淘汰，否则空闲后记录会一直保留
+        while True:
+            time.sleep(self.sweep_interval)
             try:
-                # Calculate progress
-                total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
-                downloaded_bytes = d.get('downloaded_bytes', 0)
-                
-                if total_bytes > 0:
-                    self.progress = round((downloaded_bytes / total_bytes) * 100, 2)
-                
-                # Format speed
-                speed_bytes = d.get('speed', 0)
-                if speed_bytes:
-                    if speed_bytes > 1024 * 1024:  # MB/s
-                        self.speed = f"{(speed_bytes / (1024 * 1024)):.1f} MB/s"
-                    else:  # KB/s
-                        self.speed = f"{(speed_bytes / 1024):.1f} KB/s"
-                else:
-                    self.speed = "calculating..."
-                
-                # Format ETA
-                eta_seconds = d.get('eta')
-                if eta_seconds is not None and eta_seconds > 0:
-                    minutes = int(eta_seconds // 60)
-                    seconds = int(eta_seconds % 60)
-                    self.eta = f"{minutes}:{seconds:02d}"
-                else:
-                    self.eta = "calculating..."
-                
-                self.status = "downloading"
-                
-                # Update global progress tracker
-                if self.filename:
-                    update_progress(self.filename, {
-                        "download_progress": self.progress,
-                        "download_speed": self.speed,
-                        "download_eta": self.eta,
-                        "download_status": self.status
-                    })
+                self.evict()
             except Exception as e:
-                print(f"Error updating progress: {str(e)}")
-                self.status = "error"
-                if self.filename:
-                    update_progress(self.filename, {
-                        "download_progress": 0,
-                        "download_speed": "0 KB/s",
-                        "download_eta": "--:--",
-                        "download_status": "error",
-                        "error_message": str(e)
-                    })
-        
-        elif d['status'] == 'finished':
-            self.progress = 100
-            self.status = "processing"  # 表示正在处理（如果需要后处理）
-            self.speed = "完成"  # 使用中文更友好
-            self.eta = "--:--"
-            
-            if self.filename:
-                update_progress(self.filename, {
-                    "download_progress": 100,
-                    "download_speed": "完成",
-                    "download_eta": "--:--",
-                    "download_status": "processing"
-                })
-        
-        elif d['status'] == 'error':
-            self.status = "error"
-            if self.filename:
-                update_progress(self.filename, {
-                    "download_progress": 0,
-                    "download_speed": "0 KB/s",
-                    "download_eta": "--:--",
-                    "download_status": "error"
-                })
+                logger.error("progress_sweep_failed error=%r", str(e))
 
-def extract_video_info(url: str, format: str, quality: str) -> tuple:
-    """Extract video information without downloading."""
-    # 基本选项
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': True,
-        'extract_flat': False,  # 获取完整信息
-    }
+    def stats(self) -> dict:
+        with self._terminal_lock:
+            terminal = len(self._terminal)
+        return {
+            "jobs": len(self),
+            "terminal_records": terminal,
+            "evicted_records": self.evicted,
+            "max_terminal": self.max_terminal,
+            "terminal_ttl": self.terminal_ttl,
+            "sweep_interval": self.sweep_interval
+        }
 
-    try:
-        # 首先获取基本视频信息
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+def download_handle(job_id: str) -> str:
+    """The job ID the download pipeline of ``job_id`` runs under; call with ``jobs_lock`` held."""
+    for handle, owner in download_owners.items():
+        if owner == job_id:
+            return handle
+    return job_id
+
+def forget_job(job_id: str):
+    with jobs_lock:
+        jobs.pop(job_id, None)
+        handle = download_handle(job_id)
+        download_owners.pop(handle, None)
+    bandwidth_governor.release(handle)
+
+class JobJournal:
+    """Durable record of unfinished jobs in SQLite (WAL mode).
+
+    Writes are buffered per job and flushed by a background thread in one
+    transaction every ``flush_interval`` seconds, so many job updates per
+    second cost a handful of commits. On startup ``pending_jobs`` returns
+    what has to be resumed.
+    """
+
+    def __init__(self, db_path: str, flush_interval: float = 0.5):
+        self.flush_interval = flush_interval
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, request TEXT, filepath TEXT, "
+            "state TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        self._buffer: Dict[str, Optional[dict]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.records = 0
+        self.flushes = 0
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def record(self, job_id: str, state: str, request: dict = None, filepath: str = None):
+        """Queue an upsert; fields left as None keep their journaled value."""
+        with self._lock:
+            if job_id in self._buffer and self._buffer[job_id] is None:
+                return  # 已结束的任务不再写回
+            entry = self._buffer.get(job_id) or {}
+            entry["state"] = state
+            if request is not None:
+                entry["request"] = json.dumps(request)
+            if filepath is not None:
+                entry["filepath"] = filepath
+            self._buffer[job_id] = entry
+            self.records += 1
+
+    def finish(self, job_id: str):
+        """Queue removal of a job that reached a terminal state."""
+        with self._lock:
+            self._buffer[job_id] = None
+            self.records += 1
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, {}
+            if not batch:
+                return
+            now = time.time()
+            upserts = [
+                (job_id, entry.get("request"), entry.get("filepath"), entry["state"], now)
+                for job_id, entry in batch.items() if entry is not None
+            ]
+            deletes = [(job_id,) for job_id, entry in batch.items() if entry is None]
+            with self._db:
+                self._db.executemany(
+                    "INSERT INTO jobs (job_id, request, filepath, state, updated_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(job_id) DO UPDATE SET "
+                    "request = COALESCE(excluded.request, jobs.request), "
+                    "filepath = COALESCE(excluded.filepath, jobs.filepath), "
+                    "state = excluded.state, updated_at = excluded.updated_at",
+                    upserts
+                )
+                self._db.executemany("DELETE FROM jobs WHERE job_id = ?", deletes)
+            self.flushes += 1
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
             try:
-                info = ydl.extract_info(url, download=False)
-                if not info:
-                    raise ValueError("Could not extract video information")
-            except yt_dlp.utils.DownloadError as e:
-                print(f"Download error in extract_info: {str(e)}")
-                raise ValueError(f"Failed to extract video info: {str(e)}")
+                self.flush()
             except Exception as e:
-                print(f"Unexpected error in extract_info: {str(e)}")
-                raise ValueError(f"Error extracting video info: {str(e)}")
+                logger.error("job_journal_flush_failed error=%r", str(e))
 
-        # 获取所有可用的格式
-        formats = info.get('formats', [])
-        if not formats:
-            raise ValueError("No available formats found")
+    def pending_jobs(self) -> list:
+        """[(job_id, request, filepath)] for jobs that never finished."""
+        self.flush()
+        with self._flush_lock:
+            rows = self._db.execute(
+                "SELECT job_id, request, filepath FROM jobs WHERE request IS NOT NULL ORDER BY updated_at"
+            ).fetchall()
+        return [(job_id, json.loads(request), filepath) for job_id, request, filepath in rows]
 
-        # 将质量字符串转换为数字（用于比较）
-        target_height = 0
-        if quality != 'best':
-            target_height = int(quality[:-1])  # 去掉'p'后转换为整数
+    def stats(self) -> dict:
+        with self._lock:
+            buffered = len(self._buffer)
+        return {"records": self.records, "flushes": self.flushes, "buffered": buffered}
 
-        # 按照分辨率和格式过滤和排序视频
-        suitable_formats = []
-        for f in formats:
-            # 检查格式是否匹配
-            if format == 'mp3':
-                if f.get('acodec') != 'none' and f.get('vcodec') == 'none':
-                    suitable_formats.append(f)
-            else:
-                # 视频格式必须匹配且包含视频流
-                if f.get('ext') == format and f.get('vcodec') != 'none':
-                    height = f.get('height', 0)
-                    # 对于特定质量，只选择小于等于目标高度的视频
-                    if quality == 'best' or (height and height <= target_height):
-                        suitable_formats.append(f)
-
-        if not suitable_formats:
-            print(f"No suitable formats found for {format} and {quality}, falling back to best available")
-            # 如果没有完全匹配的格式，尝试找到最接近的
-            for f in formats:
-                if format == 'mp3':
-                    if f.get('acodec') != 'none':
-                        suitable_formats.append(f)
-                elif f.get('vcodec') != 'none':
-                    suitable_formats.append(f)
-
-        if not suitable_formats:
-            raise ValueError(f"No suitable format found for {format} {quality}")
+class SQLiteJobStore:
+    """Job store shared by API and worker processes on one host (SQLite, WAL).
 
-        # 选择最佳匹配
-        if format == 'mp3':
-            # 音频选择最高比特率
-            best_format = max(suitable_formats, key=lambda f: f.get('abr', 0) or 0)
-        else:
-            # 视频按分辨率排序
-            suitable_formats.sort(key=lambda f: (f.get('height', 0) or 0, f.get('tbr', 0) or 0), reverse=True)
-            
-            if quality == 'best':
-                best_format = suitable_formats[0]  # 最高质量
-            else:
-                # 找到不超过目标分辨率的最高质量
-                target_formats = [f for f in suitable_formats if f.get('height', 0) <= target_height]
-                best_format = target_formats[0] if target_formats else suitable_formats[-1]
+    ``jobs`` holds the latest job and progress state of every job; each
+    write takes the next value of a global sequence, so ``changes`` can
+    serve as the progress channel by returning rows newer than a cursor.
+    ``queue`` holds submitted jobs until a worker claims one.
+    """
 
-        # 设置下载格式规范
-        if format == 'mp3':
-            format_spec = 'bestaudio[ext=mp3]/bestaudio'
-        else:
-            if quality == 'best':
-                format_spec = f'best[ext={format}]/best'
-            else:
-                format_spec = f'bestvideo[height<={target_height}][ext={format}]+bestaudio[ext=m4a]/best[height<={target_height}][ext={format}]'
+    def __init__(self, db_path: str):
+        self._db = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._lock = threading.Lock()
+        with self._write() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, job TEXT, progress TEXT, status TEXT, request TEXT, "
+                "worker TEXT, cancel INTEGER NOT NULL DEFAULT 0, seq INTEGER NOT NULL, updated_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_seq ON jobs (seq)")
+            db.execute("CREATE TABLE IF NOT EXISTS queue (seq INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT UNIQUE)")
+            db.execute("CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, info TEXT, seen_at REAL)")
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('seq', 0)")
 
-        # 更新ydl选项
-        ydl_opts['format'] = format_spec
-        
-        print(f"Selected format: {best_format.get('format_id')} - {best_format.get('height')}p")
-        return info, best_format
+    @contextlib.contextmanager
+    def _write(self):
+        # BEGIN IMMEDIATE 先取得写锁，多个进程并发领取任务时不会读到同一行后再冲突
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
 
-    except Exception as e:
-        print(f"Error in extract_video_info: {str(e)}")
-        raise ValueError(f"Failed to process video: {str(e)}")
+    def _put(self, db, job_id: str, job: Optional[dict], progress: Optional[dict], request: dict = None):
+        seq = db.execute("UPDATE meta SET value = value + 1 WHERE key = 'seq' RETURNING value").fetchone()[0]
+        db.execute(
+            "INSERT INTO jobs (job_id, job, progress, status, request, seq, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(job_id) DO UPDATE SET "
+            "job = COALESCE(excluded.job, jobs.job), "
+            "progress = COALESCE(excluded.progress, jobs.progress), "
+            "status = COALESCE(excluded.status, jobs.status), "
+            "request = COALESCE(excluded.request, jobs.request), "
+            "seq = excluded.seq, updated_at = excluded.updated_at",
+            (
+                job_id,
+                json.dumps(job) if job is not None else None,
+                json.dumps(progress) if progress is not None else None,
+                progress.get("download_status") if progress is not None else None,
+                json.dumps(request) if request is not None else None,
+                seq,
+                time.time()
+            )
+        )
 
-def download_in_background(url: str, ydl_opts: dict, filename: str):
-    try:
-        # 记录初始状态
-        print(f"Starting download for {filename}")
-        print(f"Download options: {ydl_opts}")
-        
-        update_progress(filename, {
-            "download_status": "preparing",
-            "download_progress": 0,
-            "download_speed": "准备中...",
-            "download_eta": "--:--"
-        })
+    def enqueue(self, job_id: str, request: dict, job: dict, progress: dict):
+        with self._write() as db:
+            self._put(db, job_id, job, progress, request)
+            db.execute("INSERT OR IGNORE INTO queue (job_id) VALUES (?)", (job_id,))
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            try:
-                # 确保 URL 不为空
-                if not url:
-                    raise ValueError("URL is empty")
-                
-                # 先尝试获取视频信息
-                print(f"Extracting info for URL: {url}")
-                info = ydl.extract_info(url, download=False)
-                if not info:
-                    raise ValueError("Failed to extract video info")
-                
-                # 检查格式信息
-                formats = info.get('formats')
-                if not formats:
-                    print("Warning: No formats found in video info")
-                
-                # 开始下载
-                print(f"Starting actual download for {url}")
-                ydl.download([url])
-                
-                # 更新最终状态
-                update_progress(filename, {
-                    "download_status": "completed",
-                    "download_progress": 100,
-                    "download_speed": "完成",  # 使用中文更友好
-                    "download_eta": "--:--"
-                })
+    def put_many(self, entries: list):
+        """Publish [(job_id, job, progress)]; None keeps the stored value."""
+        with self._write() as db:
+            for job_id, job, progress in entries:
+                self._put(db, job_id, job, progress)
+
+    def claim(self, worker_id: str, timeout: float) -> Optional[tuple]:
+        """Take the oldest queued job as (job_id, request), or None after ``timeout``."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._write() as db:
+                row = db.execute(
+                    "SELECT queue.seq, jobs.job_id, jobs.request FROM queue JOIN jobs USING (job_id) "
+                    "ORDER BY queue.seq LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    db.execute("DELETE FROM queue WHERE seq = ?", (row[0],))
+                    db.execute("UPDATE jobs SET worker = ? WHERE job_id = ?", (worker_id, row[1]))
+                    return row[1], json.loads(row[2])
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.2)
+
+    def get(self, job_id: str) -> Optional[tuple]:
+        """(job, progress) as last published, or None for an unknown job."""
+        with self._lock:
+            row = self._db.execute("SELECT job, progress FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]) if row[0] else None, json.loads(row[1]) if row[1] else None
+
+    def cancel(self, job_id: str) -> bool:
+        """True if the job was still queued; otherwise flag it for its worker."""
+        with self._write() as db:
+            if db.execute("DELETE FROM queue WHERE job_id = ?", (job_id,)).rowcount:
                 return True
-                
-            except yt_dlp.utils.DownloadError as e:
-                print(f"Download error: {str(e)}")
-                error_message = str(e)
-                if "Video unavailable" in error_message:
-                    error_message = "视频不可用，可能是私有或已删除"
-                elif "This video is only available for registered users" in error_message:
-                    error_message = "此视频需要登录才能观看，请尝试其他视频"
-                update_progress(filename, {
-                    "download_status": "error",
-                    "download_progress": 0,
-                    "download_speed": "0 KB/s",
-                    "download_eta": "--:--",
-                    "error_message": error_message
-                })
-                return False
-            
-    except Exception as e:
-        print(f"Unexpected error in download: {str(e)}")
-        print(f"Error type: {type(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
-        
-        update_progress(filename, {
-            "download_status": "error",
-            "download_progress": 0,
-            "download_speed": "0 KB/s",
-            "download_eta": "--:--",
-            "error_message": f"下载失败: {str(e)}"
-        })
-        return False
+            db.execute("UPDATE jobs SET cancel = 1 WHERE job_id = ?", (job_id,))
+            return False
 
-@app.get("/")
-def read_root():
-    return {"message": "YouTube Downloader API"}
+    def cancelled(self, job_ids: list) -> list:
+        if not job_ids:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT job_id FROM jobs WHERE cancel = 1 AND job_id IN ({','.join('?' * len(job_ids))})",
+                list(job_ids)
+            ).fetchall()
+        return [row[0] for row in rows]
 
-@app.post("/download")
-async def download_video(video_url: VideoURL):
-    try:
-        # Extract video information first
-        try:
-            info, best_video = extract_video_info(video_url.url, video_url.format, video_url.quality)
-        except ValueError as ve:
-            raise HTTPException(status_code=400, detail=str(ve))
+    def release(self, job_id: str):
+        """The claiming worker has published the job's final state."""
+        with self._write() as db:
+            db.execute("UPDATE jobs SET worker = NULL, cancel = 0 WHERE job_id = ?", (job_id,))
 
-        # Generate safe filename
-        safe_title = get_safe_filename(info.get('title', 'video'))
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{safe_title}_{timestamp}.{video_url.format}"
-        
-        # 使用用户指定的保存路径或默认路径
-        filepath = Path(video_url.save_path) / filename
+    def changes(self, cursor: Optional[int], timeout: float) -> tuple:
+        """(cursor, [(job_id, job, progress)]) written after ``cursor``."""
+        cursor = cursor or 0
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT job_id, job, progress, seq FROM jobs WHERE seq > ? ORDER BY seq LIMIT 1000", (cursor,)
+                ).fetchall()
+            if rows or time.monotonic() >= deadline:
+                break
+            time.sleep(0.1)
+        if rows:
+            cursor = rows[-1][3]
+        return cursor, [
+            (job_id, json.loads(job) if job else None, json.loads(progress) if progress else None)
+            for job_id, job, progress, _ in rows
+        ]
 
-        # Initialize progress tracker
-        download_progress[filename] = {
-            "download_progress": 0,
-            "download_speed": "准备中...",
-            "download_eta": "--:--",
-            "download_status": "preparing",
-            "save_path": str(filepath)  # 添加保存路径信息
-        }
+    def heartbeat(self, worker_id: str, info: dict):
+        with self._write() as db:
+            db.execute(
+                "INSERT INTO workers (worker_id, info, seen_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET info = excluded.info, seen_at = excluded.seen_at",
+                (worker_id, json.dumps(info), time.time())
+            )
 
-        # Prepare video information response
-        video_info = {
-            "title": info.get('title', 'Unknown Title'),
-            "author": info.get('uploader', 'Unknown Author'),
-            "length": info.get('duration', 0),
-            "views": info.get('view_count', 0),
-            "thumbnail_url": info.get('thumbnail', ''),
-            "download_url": best_video.get('url', ''),
-            "is_short": '/shorts/' in video_url.url,
-            "resolution": f"{best_video.get('height', 'Unknown')}p",  # 修正分辨率显示
-            "filesize": best_video.get('filesize', 0),
-            "ext": video_url.format,
-            "download_progress": 0,
-            "download_speed": "准备中...",
-            "download_eta": "--:--",
-            "download_status": "preparing",
-            "local_filename": filename,
-            "save_path": str(filepath)
+    def requeue_stale(self, dead_after: float) -> list:
+        """Put jobs claimed by workers silent for ``dead_after`` seconds back in the queue."""
+        cutoff = time.time() - dead_after
+        with self._write() as db:
+            rows = db.execute(
+                "SELECT job_id, request, progress FROM jobs WHERE worker IS NOT NULL AND worker NOT IN "
+                "(SELECT worker_id FROM workers WHERE seen_at >= ?)",
+                (cutoff,)
+            ).fetchall()
+            requeued = []
+            for job_id, request, progress in rows:
+                db.execute("UPDATE jobs SET worker = NULL WHERE job_id = ?", (job_id,))
+                progress = json.loads(progress) if progress else {}
+                if progress.get("download_status") in TERMINAL_STATUSES:
+                    continue
+                # 沿用已确定的文件路径，新的工作进程可以续传 .part 文件
+                request = {**json.loads(request), "resume_path": progress.get("save_path") or None}
+                db.execute("UPDATE jobs SET request = ? WHERE job_id = ?", (json.dumps(request), job_id))
+                db.execute("INSERT OR IGNORE INTO queue (job_id) VALUES (?)", (job_id,))
+                requeued.append(job_id)
+            db.execute("DELETE FROM workers WHERE seen_at < ?", (cutoff,))
+        return requeued
+
+    def prune(self, finished_before: float) -> int:
+        with self._write() as db:
+            return db.execute(
+                f"DELETE FROM jobs WHERE updated_at < ? AND status IN ({','.join('?' * len(TERMINAL_STATUSES))})",
+                (finished_before, *TERMINAL_STATUSES)
+            ).rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            queued = self._db.execute("SELECT COUNT(*) FROM queue").fetchone()[0]
+            claimed = self._db.execute("SELECT COUNT(*) FROM jobs WHERE worker IS NOT NULL").fetchone()[0]
+            workers = self._db.execute("SELECT worker_id, info, seen_at FROM workers").fetchall()
+        return {
+            "backend": "sqlite",
+            "queued": queued,
+            "claimed": claimed,
+            "workers": {
+                worker_id: {**json.loads(info), "seen_seconds_ago": round(time.time() - seen_at, 1)}
+                for worker_id, info, seen_at in workers
+            }
         }
 
-        # Configure download options
-        progress_tracker = DownloadProgress()
-        progress_tracker.filename = filename
+class RedisJobStore:
+    """Job store shared across hosts through Redis.
 
-        # 设置下载格式规范
-        target_height = int(video_url.quality[:-1]) if video_url.quality != 'best' else 0
-        if video_url.format == 'mp3':
-            format_spec = 'bestaudio[ext=mp3]/bestaudio'
-        else:
-            if video_url.quality == 'best':
-                format_spec = f'best[ext={video_url.format}]/best'
-            else:
-                format_spec = f'bestvideo[height<={target_height}][ext={video_url.format}]+bestaudio[ext=m4a]/best[height<={target_height}][ext={video_url.format}]'
-
-        # 设置后处理器
-        postprocessors = []
-        if video_url.format == 'mp3':
-            postprocessors.append({
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192'
-            })
-        elif video_url.format in ['webm', '3gp']:
-            postprocessors.append({
-                'key': 'FFmpegVideoConvertor',
-                'preferedformat': video_url.format
-            })
+    Works with any client exposing the redis-py API with
+    ``decode_responses=True`` (for tests, ``fakeredis.FakeRedis``). Job
+    state lives in one hash per job, the queue is a list, and every write is
+    also appended to a capped stream that serves as the progress channel.
+    """
 
-        ydl_opts = {
-            'format': format_spec,
-            'progress_hooks': [progress_tracker],
-            'quiet': True,
-            'no_warnings': True,
-            'outtmpl': str(filepath),
-            'postprocessors': postprocessors,
-        }
+    def __init__(self, client, prefix: str = "ytdl:", finished_ttl: float = 3600, stream_length: int = 100000):
+        self.redis = client
+        self.prefix = prefix
+        self.finished_ttl = int(finished_ttl)
+        self.stream_length = stream_length
+        self.queue_key = prefix + "queue"
+        self.claims_key = prefix + "claims"
+        self.cancel_key = prefix + "cancel"
+        self.workers_key = prefix + "workers"
+        self.changes_key = prefix + "changes"
 
-        print(f"Using format specification: {format_spec}")
-        print(f"Selected video height: {best_video.get('height')}p")
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.prefix}job:{job_id}"
 
-        # Start download in background thread
-        loop = asyncio.get_event_loop()
-        loop.run_in_executor(
-            thread_pool,
-            download_in_background,
-            video_url.url,
-            ydl_opts,
-            filename
+    def _put(self, pipe, job_id: str, job: Optional[dict], progress: Optional[dict], request: dict = None):
+        fields = {}
+        if job is not None:
+            fields["job"] = json.dumps(job)
+        if progress is not None:
+            fields["progress"] = json.dumps(progress)
+        if request is not None:
+            fields["request"] = json.dumps(request)
+        if not fields:
+            return
+        pipe.hset(self._job_key(job_id), mapping=fields)
+        if progress is not None and progress.get("download_status") in TERMINAL_STATUSES:
+            pipe.expire(self._job_key(job_id), self.finished_ttl)
+        pipe.xadd(
+            self.changes_key,
+            {"job_id": job_id, "job": fields.get("job", ""), "progress": fields.get("progress", "")},
+            maxlen=self.stream_length,
+            approximate=True
         )
 
-        return video_info
+    def enqueue(self, job_id: str, request: dict, job: dict, progress: dict):
+        pipe = self.redis.pipeline()
+        self._put(pipe, job_id, job, progress, request)
+        pipe.rpush(self.queue_key, job_id)
+        pipe.execute()
 
-    except yt_dlp.utils.DownloadError as e:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Download error: {str(e)}"
-        )
-    except ValueError as ve:
-        raise HTTPException(status_code=422, detail=str(ve))
-    except Exception as e:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Error processing video: {str(e)}"
-        )
+    def put_many(self, entries: list):
+        pipe = self.redis.pipeline()
+        for job_id, job, progress in entries:
+            self._put(pipe, job_id, job, progress)
+        pipe.execute()
 
-@app.get("/formats")
-def get_available_formats():
-    return {
-        "formats": ["mp4", "webm", "mp3", "3gp"],
-        "qualities": ["360p", "480p", "720p", "1080p", "best"]
-    }
+    def claim(self, worker_id: str, timeout: float) -> Optional[tuple]:
+        popped = self.redis.blpop([self.queue_key], timeout=max(1, int(timeout)))
+        if popped is None:
+            return None
+        job_id = popped[1]
+        self.redis.hset(self.claims_key, job_id, worker_id)
+        request = self.redis.hget(self._job_key(job_id), "request")
+        return job_id, json.loads(request) if request else {}
 
-@app.get("/progress/{filename}")
-async def get_progress(filename: str):
-    try:
-        # 解码文件名
-        decoded_filename = filename
-        if filename not in download_progress:
-            # 尝试 URL 解码
-            from urllib.parse import unquote
-            decoded_filename = unquote(filename)
-        
-        if decoded_filename not in download_progress:
-            raise HTTPException(status_code=404, detail="Download not found")
-        
-        return download_progress[decoded_filename]
-    except Exception as e:
-        raise HTTPException(
-            status_code=404,
-            detail=f"Failed to get progress: {str(e)}"
-        )
+    def get(self, job_id: str) -> Optional[tuple]:
+        job, progress = self.redis.hmget(self._job_key(job_id), ["job", "progress"])
+        if job is None and progress is None:
+            return None
+        return json.loads(job) if job else None, json.loads(progress) if progress else None
 
-@app.get("/select_directory")
-async def select_directory():
-    try:
-        if os.name == 'nt':  # Windows
-            # 使用 PowerShell 打开文件夹选择对话框
-            command = '''
-            Add-Type -AssemblyName System.Windows.Forms
-            $folderBrowser = New-Object System.Windows.Forms.FolderBrowserDialog
-            $folderBrowser.Description = "选择保存目录"
-            $folderBrowser.ShowNewFolderButton = $true
-            if ($folderBrowser.ShowDialog() -eq [System.Windows.Forms.DialogResult]::OK) {
-                $folderBrowser.SelectedPath
-            }
-            '''
-            result = subprocess.run(["powershell", "-Command", command], capture_output=True, text=True)
-            selected_path = result.stdout.strip()
-            
-            if selected_path:
-                return {"path": selected_path}
+    def cancel(self, job_id: str) -> bool:
+        if self.redis.lrem(self.queue_key, 1, job_id):
+            return True
+        self.redis.sadd(self.cancel_key, job_id)
+        return False
+
+    def cancelled(self, job_ids: list) -> list:
+        if not job_ids:
+            return []
+        pipe = self.redis.pipeline()
+        for job_id in job_ids:
+            pipe.sismember(self.cancel_key, job_id)
+        return [job_id for job_id, flagged in zip(job_ids, pipe.execute()) if flagged]
+
+    def release(self, job_id: str):
+        pipe = self.redis.pipeline()
+        pipe.hdel(self.claims_key, job_id)
+        pipe.srem(self.cancel_key, job_id)
+        pipe.execute()
+
+    def changes(self, cursor: Optional[str], timeout: float) -> tuple:
+        cursor = cursor or "0-0"
+        response = self.redis.xread({self.changes_key: cursor}, count=1000, block=int(timeout * 1000))
+        entries = []
+        for _, messages in response or ():
+            for message_id, fields in messages:
+                cursor = message_id
+                entries.append((
+                    fields["job_id"],
+                    json.loads(fields["job"]) if fields.get("job") else None,
+                    json.loads(fields["progress"]) if fields.get("progress") else None
+                ))
+        return cursor, entries
+
+    def heartbeat(self, worker_id: str, info: dict):
+        self.redis.hset(self.workers_key, worker_id, json.dumps({**info, "seen_at": time.time()}))
+
+    def requeue_stale(self, dead_after: float) -> list:
+        cutoff = time.time() - dead_after
+        alive = set()
+        for worker_id, info in self.redis.hgetall(self.workers_key).items():
+            if json.loads(info)["seen_at"] >= cutoff:
+                alive.add(worker_id)
             else:
-                return {"path": ""}
-        else:  # 其他系统使用 tkinter
-            root = tk.Tk()
-            root.withdraw()  # 隐藏主窗口
-            directory = filedialog.askdirectory()
-            root.destroy()
-            return {"path": directory if directory else ""}
+                self.redis.hdel(self.workers_key, worker_id)
+        requeued = []
+        for job_id, worker_id in self.redis.hgetall(self.claims_key).items():
+            # HDEL 只有一个进程能成功，避免同一任务被重复放回队列
+            if worker_id in alive or not self.redis.hdel(self.claims_key, job_id):
+                continue
+            request, progress = self.redis.hmget(self._job_key(job_id), ["request", "progress"])
+            progress = json.loads(progress) if progress else {}
+            if request is None or progress.get("download_status") in TERMINAL_STATUSES:
+                continue
+            request = {**json.loads(request), "resume_path": progress.get("save_path") or None}
+            pipe = self.redis.pipeline()
+            pipe.hset(self._job_key(job_id), "request", json.dumps(request))
+            pipe.rpush(self.queue_key, job_id)
+            pipe.execute()
+            requeued.append(job_id)
+        return requeued
+
+    def prune(self, finished_before: float) -> int:
+        return 0  # 已结束任务的键由 EXPIRE 自动过期
+
+    def stats(self) -> dict:
+        now = time.time()
+        workers = {}
+        for worker_id, info in self.redis.hgetall(self.workers_key).items():
+            info = json.loads(info)
+            seen_at = info.pop("seen_at")
+            workers[worker_id] = {**info, "seen_seconds_ago": round(now - seen_at, 1)}
+        return {
+            "backend": "redis",
+            "queued": self.redis.llen(self.queue_key),
+            "claimed": self.redis.hlen(self.claims_key),
+            "workers": workers
+        }
+
+def open_job_store(url: str):
+    """Job store for a JOB_STORE URL: sqlite:///path or redis://host:port/db."""
+    if url.startswith("sqlite:///"):
+        return SQLiteJobStore(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("JOB_STORE=redis:// requires the redis package (pip install redis)")
+        return RedisJobStore(
+            redis.Redis.from_url(url, decode_responses=True),
+            finished_ttl=float(os.environ.get('PROGRESS_FINISHED_TTL', '3600'))
+        )
+    raise ValueError(f"Unsupported JOB_STORE URL: {url}")
+
+# 共享任务存储：设置后 API 进程只负责接收请求和推送进度，下载由 `python main.py worker` 进程完成。
+# 未设置时所有状态保存在当前进程内
+JOB_STORE = os.environ.get('JOB_STORE', '')
+job_store = open_job_store(JOB_STORE) if JOB_STORE else None
+# 当前进程作为工作进程运行时的 StoreWorker
+store_worker = None
+
+def remote_workers() -> bool:
+    """True in an API process whose downloads run in separate worker processes."""
+    return job_store is not None and store_worker is None
+
+def job_state(job_id: str) -> Optional[dict]:
+    """JSON-safe copy of a job entry for the shared job store."""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return None
+        job = dict(job)
+    job.pop("coalesce_key", None)
+    return job
+
+def progress_state(job_id: str) -> Optional[dict]:
+    record = download_progress.get(job_id)
+    return record.to_state() if record is not None else None
+
+def publish_job(job_id: str):
+    """Write the local job and progress state to the shared job store."""
+    job_store.put_many([(job_id, job_state(job_id), progress_state(job_id))])
+
+# 任务日志：重启后恢复未完成的任务（JOB_JOURNAL_DB 为空时不启用；使用共享任务存储时由存储负责恢复）
+JOB_JOURNAL_DB = os.environ.get('JOB_JOURNAL_DB', str(DOWNLOAD_DIR / '.jobs.sqlite3'))
+job_journal = JobJournal(JOB_JOURNAL_DB) if JOB_JOURNAL_DB and not JOB_STORE else None
+
+def finish_job(job_id: str, status: str):
+    """Registry callback for a job reaching a terminal status."""
+    METRICS[f"jobs_{'failed' if status == 'error' else status}"].inc()
+    with jobs_lock:
+        handle = download_handle(job_id)
+    if job_journal is not None:
+        job_journal.finish(handle)
+    if store_worker is not None:
+        store_worker.finished(handle)
+
+# 下载进度注册表：完成/失败的任务按时间和数量淘汰，避免内存无限增长
+download_progress = ProgressRegistry(
+    max_terminal=int(os.environ.get('PROGRESS_MAX_FINISHED', '1000')),
+    terminal_ttl=float(os.environ.get('PROGRESS_FINISHED_TTL', '3600')),
+    on_evict=forget_job,
+    on_finish=finish_job
+)
+
+def update_progress(job_id: str, progress_data: dict) -> bool:
+    return download_progress.update(download_owners.get(job_id, job_id), progress_data)
+
+def job_cancelled(job_id: str) -> bool:
+    """Whether the job (or the job owning its download) has been cancelled."""
+    with jobs_lock:
+        return jobs.get(download_owners.get(job_id, job_id), {}).get("status") == "cancelled"
+
+def update_job(job_id: str, job_data: dict):
+    with jobs_lock:
+        job_id = download_owners.get(job_id, job_id)
+        if job_id in jobs:
+            jobs[job_id].update(job_data)
+    if store_worker is not None:
+        store_worker.mark(job_id)
+
+# 签名格式链接中的过期时间，如 ...&expire=1700000000&... 或 .../expire/1700000000/...
+SIGNED_URL_EXPIRE_RE = re.compile(r'[?&/]expire[=/](\d+)')
+# 在签名链接过期前提前这么多秒让缓存失效
+METADATA_CACHE_SAFETY_MARGIN = 300
+
+def get_info_expiry(info: dict, default_ttl: float) -> float:
+    """Return the time at which a cached info dict must be refetched.
+
+    The earliest ``expire`` parameter of the signed format URLs wins, minus a
+    safety margin so a download never starts on an about-to-expire URL.
+    """
+    now = time.time()
+    expires_at = now + default_ttl
+    for f in info.get('formats') or []:
+        match = SIGNED_URL_EXPIRE_RE.search(f.get('url') or '')
+        if match:
+            expires_at = min(expires_at, int(match.group(1)) - METADATA_CACHE_SAFETY_MARGIN)
+    return expires_at
+
+class MetadataCache:
+    """In-process LRU + TTL cache of yt-dlp info dicts keyed by video ID.
+
+    An optional SQLite file acts as a second tier so entries survive restarts.
+    """
+
+    def __init__(self, max_entries: int = 256, default_ttl: float = 3600, db_path: str = ""):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS metadata_cache ("
+                "video_id TEXT PRIMARY KEY, expires_at REAL NOT NULL, info TEXT NOT NULL)"
+            )
+            self._db.execute("DELETE FROM metadata_cache WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+
+    def get(self, video_id: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is not None:
+                expires_at, info = entry
+                if expires_at > now:
+                    self._entries.move_to_end(video_id)
+                    self.hits += 1
+                    return copy.deepcopy(info)
+                del self._entries[video_id]
+                self.expirations += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT expires_at, info FROM metadata_cache WHERE video_id = ?", (video_id,)
+                ).fetchone()
+                if row is not None:
+                    if row[0] > now:
+                        info = json.loads(row[1])
+                        self._store(video_id, row[0], info)
+                        self.disk_hits += 1
+                        return copy.deepcopy(info)
+                    self._db.execute("DELETE FROM metadata_cache WHERE video_id = ?", (video_id,))
+                    self._db.commit()
+                    self.expirations += 1
+
+            self.misses += 1
+            return None
+
+    def put(self, video_id: str, info: dict):
+        expires_at = get_info_expiry(info, self.default_ttl)
+        if expires_at <= time.time():
+            return
+        info = copy.deepcopy(info)
+        with self._lock:
+            self._store(video_id, expires_at, info)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO metadata_cache (video_id, expires_at, info) VALUES (?, ?, ?)",
+                    (video_id, expires_at, json.dumps(info, default=str))
+                )
+                self._db.commit()
+
+    def _store(self, video_id: str, expires_at: float, info: dict):
+        self._entries[video_id] = (expires_at, info)
+        self._entries.move_to_end(video_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "disk_tier": self._db is not None
+            }
+
+# 元数据缓存配置（METADATA_CACHE_DB 为空时不启用磁盘缓存）
+metadata_cache = MetadataCache(
+    max_entries=int(os.environ.get('METADATA_CACHE_SIZE', '256')),
+    default_ttl=float(os.environ.get('METADATA_CACHE_TTL', '3600')),
+    db_path=os.environ.get('METADATA_CACHE_DB', '')
+)
+
+# 快速哈希读取文件首尾各 64 KiB
+FAST_HASH_CHUNK = 64 * 1024
+
+def get_fast_hash(path: Path, size: int) -> str:
+    """Hash the size plus the first and last 64 KiB of a file."""
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(FAST_HASH_CHUNK))
+        if size > FAST_HASH_CHUNK:
+            f.seek(max(size - FAST_HASH_CHUNK, FAST_HASH_CHUNK))
+            digest.update(f.read(FAST_HASH_CHUNK))
+    return digest.hexdigest()
+
+class DownloadStore:
+    """Persistent index of finished downloads keyed by what produced them.
+
+    The key is (video ID, format_spec, postprocessors). Each finished file is
+    hardlinked into ``store_dir``, so the store keeps the bytes alive even if
+    the user deletes their copy. Entries are evicted least-recently-used once
+    the store exceeds ``budget_bytes``.
+    """
+
+    def __init__(self, store_dir: Path, budget_bytes: int):
+        self.store_dir = store_dir
+        self.budget_bytes = budget_bytes
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.copy_fallbacks = 0
+        self._db = sqlite3.connect(str(store_dir / 'index.sqlite3'), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS downloads ("
+            "key TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, "
+            "fast_hash TEXT NOT NULL, video_info TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def make_key(video_id: str, format_spec: str, postprocessors: list) -> str:
+        raw = json.dumps([video_id, format_spec, postprocessors], sort_keys=True)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def _get_valid(self, key: str) -> Optional[tuple]:
+        """Fetch an index row whose file still passes the integrity check."""
+        row = self._db.execute(
+            "SELECT path, size, fast_hash, video_info FROM downloads WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        path = Path(row[0])
+        # 大小和快速哈希都必须一致，避免返回过期或不完整的文件
+        try:
+            valid = path.stat().st_size == row[1] and get_fast_hash(path, row[1]) == row[2]
+        except OSError:
+            valid = False
+        if not valid:
+            self._remove(key, path)
+            self.invalidations += 1
+            return None
+        return row
+
+    def lookup(self, key: str) -> Optional[tuple]:
+        """Return (path, video_info) for a valid stored file, else None."""
+        with self._lock:
+            row = self._get_valid(key)
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE downloads SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self.hits += 1
+            return Path(row[0]), json.loads(row[3])
+
+    def contains(self, key: str) -> bool:
+        """Whether a valid file is stored for key, without counting a hit."""
+        with self._lock:
+            return self._get_valid(key) is not None
+
+    def add(self, key: str, source: Path, video_info: dict):
+        size = source.stat().st_size
+        target = self.store_dir / f"{key}{source.suffix}"
+        with self._lock:
+            if target.exists():
+                target.unlink()
+            try:
+                os.link(source, target)
+            except OSError as e:
+                # 跨设备等情况无法硬链接时不入库，避免额外的复制
+                logger.warning("download_store_skip source=%s error=%r", source, str(e))
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO downloads (key, path, size, fast_hash, video_info, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, str(target), size, get_fast_hash(target, size), json.dumps(video_info), time.time())
+            )
+            self._db.commit()
+            self._evict()
+
+    def link_out(self, stored_path: Path, target: Path):
+        """Hardlink a stored file to ``target``.
+
+        When that is impossible (e.g. save_path is on another filesystem)
+        the file is copied instead, logged and counted in ``copy_fallbacks``.
+        """
+        try:
+            os.link(stored_path, target)
+        except OSError as e:
+            logger.warning("download_store_copy_fallback source=%s target=%s error=%r", stored_path, target, str(e))
+            shutil.copyfile(stored_path, target)
+            with self._lock:
+                self.copy_fallbacks += 1
+
+    def _remove(self, key: str, path: Path):
+        self._db.execute("DELETE FROM downloads WHERE key = ?", (key,))
+        self._db.commit()
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM downloads").fetchone()[0]
+        if total <= self.budget_bytes:
+            return
+        for key, path, size in self._db.execute(
+            "SELECT key, path, size FROM downloads ORDER BY last_used"
+        ).fetchall():
+            if total <= self.budget_bytes:
+                break
+            self._remove(key, Path(path))
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM downloads"
+            ).fetchone()
+            return {
+                "entries": entries,
+                "total_bytes": total,
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "copy_fallbacks": self.copy_fallbacks
+            }
+
+# 已完成下载库配置
+download_store = DownloadStore(
+    store_dir=Path(os.environ.get('DOWNLOAD_STORE_DIR', str(DOWNLOAD_DIR / '.store'))),
+    budget_bytes=int(os.environ.get('DOWNLOAD_STORE_BUDGET_MB', '10240')) * 1024 * 1024
+)
+
+def get_downloaded_path(result: dict, fallback: str) -> Path:
+    """Path of the file yt-dlp actually wrote for a processed info dict."""
+    downloads = (result or {}).get('requested_downloads') or [{}]
+    return Path(downloads[0].get('filepath') or fallback)
+
+def add_to_store(store_key: str, job_id: str, final_path: Path):
+    """Register a finished download so identical requests become instant hits."""
+    try:
+        if not final_path.is_file():
+            return
+        with jobs_lock:
+            video_info = dict(jobs.get(job_id, {}).get("video_info") or {})
+        for field in ("job_id", "local_filename", "save_path", "is_short"):
+            video_info.pop(field, None)
+        download_store.add(store_key, final_path, video_info)
+    except Exception as e:
+        logger.warning("download_store_add_failed job_id=%s error=%r", job_id, str(e))
+
+class JobCancelled(Exception):
+    """Raised from the progress hook to abort a cancelled download.
+
+    yt-dlp re-raises exceptions from progress hooks unchanged, so this does
+    not need to derive from ``yt_dlp.utils.DownloadCancelled`` (which would
+    force the import at module load).
+    """
+
+# 进度钩子发布节流：至少间隔这么多秒，且进度变化达到阈值或超过心跳间隔才发布
+PROGRESS_HOOK_MIN_INTERVAL = float(os.environ.get('PROGRESS_HOOK_MIN_INTERVAL', '0.25'))
+PROGRESS_HOOK_MIN_DELTA = float(os.environ.get('PROGRESS_HOOK_MIN_DELTA', '0.5'))
+PROGRESS_HOOK_HEARTBEAT = 1.0
+
+# 带宽限制（KiB/s，0 表示不限制）
+BANDWIDTH_LIMIT_KBPS = int(os.environ.get('BANDWIDTH_LIMIT_KBPS', '0'))
+JOB_BANDWIDTH_LIMIT_KBPS = int(os.environ.get('JOB_BANDWIDTH_LIMIT_KBPS', '0'))
+BANDWIDTH_BURST_SECONDS = 0.25
+BANDWIDTH_MAX_SLEEP = 0.1
+
+class BandwidthBucket:
+    __slots__ = ("rate", "tokens", "stamp", "transferred")
+
+    def __init__(self):
+        self.rate = None  # bytes/s，None 表示不限速
+        self.tokens = 0.0
+        self.stamp = time.monotonic()
+        self.transferred = 0
+
+    def refill(self, now: float):
+        if self.rate is not None:
+            self.tokens = min(self.rate * BANDWIDTH_BURST_SECONDS, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+class BandwidthGovernor:
+    """Token buckets that split a global byte rate fairly between downloads.
+
+    A job becomes active on its first ``consume`` call. Every time the active
+    set or a limit changes, rates are recomputed by max-min fair sharing:
+    jobs capped below an equal share keep their cap and the remainder is
+    split between the others. ``consume`` runs in the yt-dlp progress hook and
+    sleeps the download thread until the job's bucket is out of debt, so the
+    speed yt-dlp reports is the throttled one.
+    """
+
+    def __init__(self, global_limit: Optional[int] = None, job_limit: Optional[int] = None):
+        self.global_limit = global_limit  # bytes/s
+        self.job_limit = job_limit  # bytes/s，没有单独限速的任务使用此值
+        self._caps: Dict[str, int] = {}
+        self._active: Dict[str, BandwidthBucket] = {}
+        self._lock = threading.Lock()
+        self.throttled_seconds = 0.0
+        self.limited = bool(global_limit or job_limit)  # 未设置任何限速时进度钩子跳过 consume
+
+    def _update_limited(self):
+        self.limited = bool(self.global_limit or self.job_limit or self._caps)
+
+    def set_limits(self, global_limit: Optional[int], job_limit: Optional[int]):
+        with self._lock:
+            self.global_limit = global_limit
+            self.job_limit = job_limit
+            self._update_limited()
+            self._rebalance()
+
+    def set_job_limit(self, job_id: str, limit: Optional[int]):
+        with self._lock:
+            if limit is None:
+                self._caps.pop(job_id, None)
+            else:
+                self._caps[job_id] = limit
+            self._update_limited()
+            if job_id in self._active:
+                self._rebalance()
+
+    def release(self, job_id: str):
+        with self._lock:
+            self._caps.pop(job_id, None)
+            self._update_limited()
+            if self._active.pop(job_id, None) is not None:
+                self._rebalance()
+
+    def _rebalance(self):
+        now = time.monotonic()
+        for bucket in self._active.values():
+            bucket.refill(now)
+        caps = sorted(
+            ((self._caps.get(job_id, self.job_limit), job_id) for job_id in self._active),
+            key=lambda item: float('inf') if item[0] is None else item[0]
+        )
+        remaining = self.global_limit
+        for index, (cap, job_id) in enumerate(caps):
+            if remaining is None:
+                rate = cap
+            else:
+                share = remaining / (len(caps) - index)
+                rate = share if cap is None or cap > share else cap
+                remaining -= rate
+            self._active[job_id].rate = rate
+
+    def consume(self, job_id: str, nbytes: int, cancel_event: threading.Event = None):
+        """Charge ``nbytes`` to the job and block while it is over its rate."""
+        if nbytes <= 0 or not self.limited:
+            return
+        with self._lock:
+            bucket = self._active.get(job_id)
+            if bucket is None:
+                bucket = self._active[job_id] = BandwidthBucket()
+                self._rebalance()
+            bucket.refill(time.monotonic())
+            bucket.transferred += nbytes
+            if bucket.rate is None:
+                return
+            bucket.tokens -= nbytes
+        # 分段休眠，限速调整或任务取消时能及时生效
+        while cancel_event is None or not cancel_event.is_set():
+            with self._lock:
+                now = time.monotonic()
+                bucket.refill(now)
+                if bucket.rate is None or bucket.tokens >= 0 or self._active.get(job_id) is not bucket:
+                    return
+                wait = min(-bucket.tokens / bucket.rate, BANDWIDTH_MAX_SLEEP)
+                self.throttled_seconds += wait
+            time.sleep(wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "global_limit_kbps": self.global_limit // 1024 if self.global_limit else None,
+                "job_limit_kbps": self.job_limit // 1024 if self.job_limit else None,
+                "throttled_seconds": round(self.throttled_seconds, 2),
+                "active": {
+                    job_id: {
+                        "rate_kbps": round(bucket.rate / 1024, 1) if bucket.rate is not None else None,
+                        "transferred_bytes": bucket.transferred
+                    }
+                    for job_id, bucket in self._active.items()
+                }
+            }
+
+bandwidth_governor = BandwidthGovernor(
+    global_limit=BANDWIDTH_LIMIT_KBPS * 1024 or None,
+    job_limit=JOB_BANDWIDTH_LIMIT_KBPS * 1024 or None
+)
+
+class DownloadProgress:
+    """yt-dlp progress hook that publishes raw numbers, throttled.
+
+    yt-dlp may call the hook hundreds of times per second; a ``downloading``
+    tick is only published when ``min_interval`` has passed and either the
+    percentage moved by ``min_delta`` or ``PROGRESS_HOOK_HEARTBEAT`` seconds
+    passed (so speed and ETA stay fresh). Status changes always publish.
+
+    Byte counts are tracked per file, so a job that downloads its video and
+    audio streams (possibly at the same time) reports combined progress,
+    speed and ETA.
+    """
+
+    def __init__(self, min_interval: float = PROGRESS_HOOK_MIN_INTERVAL, min_delta: float = PROGRESS_HOOK_MIN_DELTA):
+        self.min_interval = min_interval
+        self.min_delta = min_delta
+        self.progress = 0
+        self.status = "starting"
+        self.job_id = ""
+        self.cancel_event = None
+        self.last_publish = 0.0
+        self.streams: Dict[str, list] = {}  # filename -> [downloaded, total, speed]
+        self.pending_streams = set()  # 并行下载中尚未完成的文件
+        self.lock = threading.Lock()
+        self.calls = 0  # 钩子调用次数，发布时再汇总到全局指标，避免每次调用都加锁
+
+    def expect_streams(self, filenames: list):
+        """Register the files of a parallel download before any of them ticks.
+
+        The job only moves on to "processing" once all of them finished, even
+        if one completes before another has reported any progress.
+        """
+        with self.lock:
+            for name in filenames:
+                self.streams.setdefault(name, [0, 0, None])
+            self.pending_streams.update(filenames)
+
+    def __call__(self, d):
+        self.calls += 1
+        # 任务被取消时中断 yt-dlp 下载
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+
+        status = d['status']
+        if status == 'downloading':
+            try:
+                # 每个文件一条记录；热路径不加锁，只在新文件出现时加锁
+                name = d.get('filename') or ''
+                stream = self.streams.get(name)
+                if stream is None:
+                    with self.lock:
+                        stream = self.streams.setdefault(name, [0, 0, None])
+                # 并行下载分片时计数可能乱序到达，只取最大值
+                delta = (d.get('downloaded_bytes') or 0) - stream[0]
+                if delta > 0:
+                    stream[0] += delta
+                stream[1] = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+                stream[2] = d.get('speed')
+
+                # 按带宽配额限速
+                if self.job_id and bandwidth_governor.limited:
+                    bandwidth_governor.consume(self.job_id, delta, self.cancel_event)
+                    if self.cancel_event is not None and self.cancel_event.is_set():
+                        raise JobCancelled(f"Job {self.job_id} was cancelled")
+
+                now = time.monotonic()
+                if self.status == "downloading" and now - self.last_publish < self.min_interval:
+                    return
+
+                # Calculate progress（多个文件时合并计算）
+                if len(self.streams) == 1:
+                    downloaded_bytes, total_bytes, speed = stream
+                else:
+                    with self.lock:
+                        streams = list(self.streams.values())
+                    downloaded_bytes = sum(other[0] for other in streams)
+                    total_bytes = sum(other[1] for other in streams)
+                    speed = sum(other[2] for other in streams if other[2]) or None
+                progress = downloaded_bytes * 100 / total_bytes if total_bytes > 0 else self.progress
+
+                if self.status == "downloading" and (
+                    abs(progress - self.progress) < self.min_delta
+                    and now - self.last_publish < PROGRESS_HOOK_HEARTBEAT
+                ):
+                    return
+
+                eta = (total_bytes - downloaded_bytes) / speed if speed and total_bytes > downloaded_bytes else None
+                self.progress = progress
+                self.status = "downloading"
+                self.last_publish = now
+                calls, self.calls = self.calls, 0
+
+                # Update global progress tracker（速度、剩余时间在读取时再格式化）
+                METRICS["progress_hook_calls"].inc(calls)
+                METRICS["progress_hook_publishes"].inc()
+                if self.job_id:
+                    update_progress(self.job_id, {
+                        "download_progress": progress,
+                        "downloaded_bytes": downloaded_bytes,
+                        "total_bytes": total_bytes or None,
+                        "speed": speed,
+                        "eta": eta,
+                        "download_status": "downloading"
+                    })
+                    concurrency_controller.record_speed(self.job_id, speed)
+            except JobCancelled:
+                raise
+            except Exception as e:
+                logger.error("progress_update_failed job_id=%s error=%r", self.job_id, str(e))
+                self.status = "error"
+                if self.job_id:
+                    update_progress(self.job_id, {
+                        "download_progress": 0,
+                        "download_status": "error",
+                        "error_message": str(e)
+                    })
+        
+        elif status == 'finished':
+            with self.lock:
+                calls, self.calls = self.calls, 0
+            METRICS["progress_hook_calls"].inc(calls)
+            with self.lock:
+                name = d.get('filename') or ''
+                stream = self.streams.setdefault(name, [0, 0, None])
+                stream[1] = d.get('total_bytes') or stream[1] or stream[0]
+                stream[0] = stream[1]
+                stream[2] = None
+                self.pending_streams.discard(name)
+                # 并行下载时等所有流都完成才进入处理阶段
+                if self.pending_streams or any(other[0] < other[1] for other in self.streams.values()):
+                    return
+                self.progress = 100
+                self.status = "processing"  # 表示正在处理（如果需要后处理）
+                total_bytes = sum(other[1] for other in self.streams.values())
+
+            if self.job_id:
+                concurrency_controller.job_finished(self.job_id)
+                # 最终字节数与节流期间最后一次发布的值可能不同；速度和剩余时间已无意义
+                update_progress(self.job_id, {
+                    "download_progress": 100,
+                    "downloaded_bytes": total_bytes,
+                    "total_bytes": total_bytes or None,
+                    "speed": None,
+                    "eta": None,
+                    "download_status": "processing"
+                })
+        
+        elif status == 'error':
+            self.status = "error"
+            if self.job_id:
+                update_progress(self.job_id, {
+                    "download_progress": 0,
+                    "download_status": "error"
+                })
+
+class FormatSelector:
+    """A (format, quality) request compiled once for fast format selection.
+
+    The request becomes a fixed predicate (container, height bound) and a
+    ranking key (height then bitrate for video, bitrate for audio). ``select``
+    applies them with inlined comparisons in a single pass over
+    ``info['formats']``, keeping the best exact match, the best fallback
+    (used only when nothing matches exactly) and, for video, the best
+    audio-only stream to merge with a video-only pick (webm audio for a
+    webm target, since WebM cannot hold AAC; m4a otherwise). ``spec`` is the
+    equivalent yt-dlp selector string; it identifies the request in the
+    download store, while downloads use the chosen format IDs.
+    """
+
+    __slots__ = ("format", "target_height", "audio_ext", "spec")
+
+    def __init__(self, format: str, quality: str):
+        self.format = format
+        # 将质量字符串转换为数字（用于比较），0 表示不限制
+        self.target_height = target_height = int(quality[:-1]) if quality != 'best' else 0
+        # 合并用音频的容器：WebM 只能容纳 Opus/Vorbis，其余目标使用 m4a (AAC)
+        self.audio_ext = 'webm' if format == 'webm' else 'm4a'
+        if format == 'mp3':
+            self.spec = 'bestaudio[ext=mp3]/bestaudio'
+        elif quality == 'best':
+            self.spec = f'best[ext={format}]/best'
+        else:
+            self.spec = (f'bestvideo[height<={target_height}][ext={format}]+bestaudio[ext={self.audio_ext}]'
+                         f'/best[height<={target_height}][ext={format}]')
+
+    def select(self, formats: list) -> tuple:
+        """(best format, audio stream to merge or None, exact match?) in one pass."""
+        if self.format == 'mp3':
+            return self._select_audio(formats)
+        return self._select_video(formats)
+
+    @staticmethod
+    def _select_audio(formats: list) -> tuple:
+        # 音频选择最高比特率；没有纯音频流时退而选择任何含音频的格式
+        best = backup = None
+        best_abr = backup_abr = -1
+        for f in formats:
+            acodec = f.get('acodec')
+            if acodec == 'none':
+                continue
+            abr = f.get('abr') or 0
+            if f.get('vcodec') == 'none':
+                if abr > best_abr:
+                    best, best_abr = f, abr
+            elif best is None and abr > backup_abr:
+                backup, backup_abr = f, abr
+        if best is not None:
+            return best, None, True
+        return backup, None, False
+
+    def _select_video(self, formats: list) -> tuple:
+        # 先按容器分流，多数格式只需读取一两个字段
+        ext, target, audio_ext = self.format, self.target_height, self.audio_ext
+        best = backup = merge_audio = other_audio = None
+        best_key = backup_key = merge_abr = other_abr = None
+        for f in formats:
+            f_ext = f.get('ext')
+            vcodec = None
+            if f_ext == ext:
+                vcodec = f.get('vcodec')
+                if vcodec != 'none':
+                    height = f.get('height') or 0
+                    if not target or 0 < height <= target:
+                        # 视频按分辨率、码率排序
+                        key = (height, f.get('tbr') or 0)
+                        if best_key is None or key > best_key:
+                            best, best_key = f, key
+                        continue
+            if f_ext == audio_ext:
+                # 合并用的音频优先与目标容器兼容的格式，其次比特率
+                if vcodec is None:
+                    vcodec = f.get('vcodec')
+                if vcodec == 'none' and f.get('acodec') not in (None, 'none'):
+                    abr = f.get('abr') or 0
+                    if merge_abr is None or abr > merge_abr:
+                        merge_audio, merge_abr = f, abr
+                    continue
+            if best is None or merge_audio is None:
+                if vcodec is None:
+                    vcodec = f.get('vcodec')
+                if vcodec == 'none':
+                    if merge_audio is None and f.get('acodec') not in (None, 'none'):
+                        abr = f.get('abr') or 0
+                        if other_abr is None or abr > other_abr:
+                            other_audio, other_abr = f, abr
+                elif best is None:
+                    # 没有精确匹配时：优先不超过目标分辨率的最高质量，否则取超出最少的
+                    height, tbr = f.get('height') or 0, f.get('tbr') or 0
+                    key = (1, height, tbr) if not target or height <= target else (0, -height, -tbr)
+                    if backup_key is None or key > backup_key:
+                        backup, backup_key = f, key
+        audio = merge_audio or other_audio
+        if best is not None:
+            return best, audio, True
+        return backup, audio, False
+
+    def download_spec(self, best: dict, audio: dict = None) -> str:
+        """yt-dlp ``format`` option naming the chosen streams by ID."""
+        # 仅含视频的流需要与音频合并
+        if self.format != 'mp3' and audio is not None and best.get('acodec') in (None, 'none'):
+            return f"{best['format_id']}+{audio['format_id']}"
+        return best['format_id']
+
+@functools.lru_cache(maxsize=None)
+def compile_format_selector(format: str, quality: str) -> FormatSelector:
+    return FormatSelector(format, quality)
+
+class YoutubeDLPool:
+    """Warm state shared by the short-lived YoutubeDL instances of each job.
+
+    Constructing a YoutubeDL registers ~1,700 extractor classes (about
+    100 ms). Each instance also builds its own request director: HTTP
+    handlers, SSL context and keep-alive connection pools. Creating one
+    per call therefore repeats the extractor setup and the TLS handshakes
+    to youtube.com / googlevideo.com for every job.
+
+    The pool copies the extractor registry from a single template
+    instance. It also keeps up to ``max_idle`` request directors, with
+    their cookie jars, that finished jobs handed back. Each job still gets
+    a fresh YoutubeDL built from its own options, so hooks, the format
+    selector and download counters never carry over. The job leases one
+    director exclusively, and the director's cookies are cleared when it
+    is returned.
+
+    This relies on YoutubeDL internals (``_ies`` and the
+    ``_request_director`` / ``cookiejar`` cached properties). ``supported``
+    checks the installed yt-dlp once. Versions older than
+    ``MIN_YT_DLP_VERSION``, or builds whose internals look different, get a
+    plain ``YoutubeDL`` per call instead.
+    """
+
+    # 池化依赖的内部实现已在该版本及之后的版本上验证
+    MIN_YT_DLP_VERSION = (2025, 2, 19)
+
+    # 涉及网络配置的选项会改变请求处理器本身，这类任务不走池化
+    NETWORK_OPTIONS = frozenset((
+        'proxy', 'geo_verification_proxy', 'source_address', 'socket_timeout', 'nocheckcertificate',
+        'legacyserverconnect', 'http_headers', 'cookiefile', 'cookiesfrombrowser', 'impersonate',
+        'client_certificate', 'client_certificate_key', 'client_certificate_password', 'compat_opts',
+        'debug_printtraffic', 'enable_file_urls'
+    ))
+
+    def __init__(self, base_options: dict = None, max_idle: int = 8, idle_timeout: float = 60.0, max_uses: int = 200):
+        self.base_options = dict(base_options or {})
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.max_uses = max_uses
+        self._template = None
+        self._lock = threading.Lock()
+        self._idle = deque()  # (director, cookiejar, uses, returned_at)
+        self._supported = None
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def supported(self) -> bool:
+        """Whether the installed yt-dlp has the internals the pool relies on (checked once)."""
+        if self._supported is None:
+            version = yt_dlp.version.__version__
+            try:
+                parsed = tuple(int(part) for part in version.split('.')[:3])
+            except ValueError:
+                parsed = ()
+            reason = None
+            if parsed < self.MIN_YT_DLP_VERSION:
+                reason = "version older than %s" % '.'.join(map(str, self.MIN_YT_DLP_VERSION))
+            elif not all(
+                isinstance(yt_dlp.YoutubeDL.__dict__.get(name), functools.cached_property)
+                for name in ('_request_director', 'cookiejar')
+            ) or not isinstance(getattr(yt_dlp.YoutubeDL({}, auto_init=False), '_ies', None), dict):
+                reason = "unexpected YoutubeDL internals"
+            if reason is not None:
+                logger.warning("ydl_pool_disabled yt_dlp=%s reason=%s", version, reason)
+            self._supported = reason is None
+        return self._supported
+
+    def _extractors(self) -> dict:
+        if self._template is None:
+            with self._lock:
+                if self._template is None:
+                    self._template = yt_dlp.YoutubeDL({**self.base_options, 'quiet': True})
+        return self._template._ies
+
+    def _acquire(self) -> Optional[tuple]:
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            while self._idle:
+                director, cookiejar, uses, returned_at = self._idle.pop()
+                if now - returned_at <= self.idle_timeout:
+                    self.reused += 1
+                    break
+                expired.append(director)
+            else:
+                director = None
+                self.created += 1
+            self.discarded += len(expired)
+        for stale in expired:
+            stale.close()
+        return (director, cookiejar, uses) if director is not None else None
+
+    @staticmethod
+    def _bind_logger(director, ydl):
+        # 请求处理器共用构建时的 _YDLLogger；租借时指向当前任务，归还时解绑，
+        # 空闲的连接池不会让上一个任务的 YoutubeDL（参数、进度钩子）一直存活
+        logger = getattr(director, 'logger', None)
+        if hasattr(logger, '_ydl'):
+            logger._ydl = ydl
+
+    def _release(self, director, cookiejar, uses: int, healthy: bool):
+        self._bind_logger(director, None)
+        if healthy and uses < self.max_uses:
+            # 清空 Cookie，上一个任务的会话状态不会带入下一个任务
+            cookiejar.clear()
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append((director, cookiejar, uses, time.monotonic()))
+                    return
+        with self._lock:
+            self.discarded += 1
+        director.close()
+
+    @contextlib.contextmanager
+    def ydl(self, options: dict):
+        """Context manager yielding a YoutubeDL for ``options``, backed by pooled state."""
+        if self.max_idle <= 0 or self.NETWORK_OPTIONS & options.keys() or not self.supported():
+            with yt_dlp.YoutubeDL({**self.base_options, **options}) as ydl:
+                yield ydl
+            return
+
+        extractors = self._extractors()
+        ydl = yt_dlp.YoutubeDL({**self.base_options, **options}, auto_init=False)
+        ydl._ies.update(extractors)
+        for ie in extractors.values():
+            # 提取器类可以直接共享；实例（如兜底的 UnsupportedURLIE）绑定了所属的 YoutubeDL，需要新建
+            if not isinstance(ie, type):
+                ydl.add_info_extractor(type(ie)())
+        lease = self._acquire()
+        uses = 0
+        if lease is not None:
+            director, cookiejar, uses = lease
+            self._bind_logger(director, ydl)
+            # 两者都是 functools.cached_property，预先写入实例字典即可替换
+            ydl.__dict__['_request_director'] = director
+            ydl.__dict__['cookiejar'] = cookiejar
+        healthy = False
+        try:
+            yield ydl
+            healthy = True
+        finally:
+            # 取走连接池后再关闭 YoutubeDL，close() 不会关闭共享的请求处理器
+            director = ydl.__dict__.pop('_request_director', None)
+            cookiejar = ydl.__dict__.pop('cookiejar', None)
+            ydl.close()
+            if director is not None and cookiejar is not None:
+                self._release(director, cookiejar, uses + 1, healthy)
+            elif director is not None:
+                director.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "idle": len(self._idle),
+                "max_idle": self.max_idle,
+                "created": self.created,
+                "reused": self.reused,
+                "discarded": self.discarded,
+                "warm": self._template is not None,
+                "supported": self._supported
+            }
+
+# YoutubeDL 复用池（YDL_POOL_SIZE 为空闲连接池上限，0 表示每次新建）
+ydl_pool = YoutubeDLPool(
+    {'quiet': True, 'no_warnings': True},
+    max_idle=int(os.environ.get('YDL_POOL_SIZE', '8'))
+)
+
+def extract_video_info(url: str, format: str, quality: str) -> tuple:
+    """Extract video information without downloading.
+
+    Returns ``(info, best_format, download_spec)``.
+    """
+    # 基本选项
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': False,  # 获取完整信息
+    }
+
+    try:
+        # 同一视频（不同格式/清晰度）优先使用缓存的元数据
+        video_id = extract_video_id(url)
+        info = metadata_cache.get(video_id) if video_id else None
+
+        # 缓存未命中时获取基本视频信息
+        if info is None:
+            with ydl_pool.ydl(ydl_opts) as ydl:
+                try:
+                    record_extraction()
+                    extract_started = time.monotonic()
+                    info = ydl.extract_info(url, download=False)
+                    METRICS["extraction_seconds"].observe(time.monotonic() - extract_started)
+                    if not info:
+                        raise ValueError("Could not extract video information")
+                except yt_dlp.utils.DownloadError as e:
+                    logger.warning("extract_failed url=%s error=%r", url, str(e))
+                    raise ValueError(f"Failed to extract video info: {str(e)}")
+                except Exception as e:
+                    logger.exception("extract_error url=%s", url)
+                    raise ValueError(f"Error extracting video info: {str(e)}")
+            if video_id:
+                metadata_cache.put(video_id, info)
+
+        # 获取所有可用的格式
+        formats = info.get('formats', [])
+        if not formats:
+            raise ValueError("No available formats found")
+
+        # 单次遍历选出最佳格式，直接把格式 ID 交给 yt-dlp
+        selector = compile_format_selector(format, quality)
+        best_format, audio_format, exact = selector.select(formats)
+        if best_format is None:
+            raise ValueError(f"No suitable format found for {format} {quality}")
+        if not exact:
+            logger.info("format_fallback format=%s quality=%s", format, quality)
+
+        logger.debug("format_selected format_id=%s height=%s", best_format.get('format_id'), best_format.get('height'))
+        return info, best_format, selector.download_spec(best_format, audio_format)
+
+    except Exception as e:
+        logger.warning("extract_video_info_failed url=%s error=%r", url, str(e))
+        raise ValueError(f"Failed to process video: {str(e)}")
+
+# parallel 下载模式：分片并发数与单文件分块请求大小
+FRAGMENT_CONCURRENCY = int(os.environ.get('FRAGMENT_CONCURRENCY', '8'))
+HTTP_CHUNK_SIZE = int(os.environ.get('HTTP_CHUNK_SIZE_MB', '10')) * 1024 * 1024
+
+def prefetch_streams(ydl: 'yt_dlp.YoutubeDL', info: dict) -> int:
+    """Download the streams of a merged format (video+audio) concurrently.
+
+    yt-dlp fetches ``requested_formats`` one after another. Each stream is
+    written to the name process_info would use (``<name>.f<format_id>.<ext>``),
+    so the following ``process_ie_result`` finds the files complete and only
+    merges them. Returns the number of streams fetched.
+    """
+    selected = ydl.process_ie_result(dict(info), download=False)
+    requested = selected.get('requested_formats') or []
+    if len(requested) < 2:
+        return 0
+
+    # 与 process_info 中 correct_ext 的命名规则保持一致
+    filename = ydl.prepare_filename(selected)
+    stem, ext = os.path.splitext(filename)
+    if ext[1:] != selected['ext']:
+        stem = filename
+
+    filenames = [f"{stem}.f{fmt['format_id']}.{fmt['ext']}" for fmt in requested]
+    # 先登记所有流，避免一个流在另一个流开始前完成时任务提前进入处理阶段
+    for hook in ydl.params.get('progress_hooks') or ():
+        if isinstance(hook, DownloadProgress):
+            hook.expect_streams(filenames)
+
+    def fetch(fmt: dict, filename: str):
+        stream_info = {k: v for k, v in selected.items() if k != 'requested_formats'}
+        stream_info.update(fmt)
+        success, _ = ydl.dl(filename, stream_info)
+        if not success:
+            raise yt_dlp.utils.DownloadError(f"Failed to download format {fmt['format_id']}")
+
+    with ThreadPoolExecutor(len(requested)) as pool:
+        for future in [pool.submit(fetch, fmt, filename) for fmt, filename in zip(requested, filenames)]:
+            future.result()
+    return len(requested)
+
+def record_download_metrics(job_id: str, path: Path, elapsed: float):
+    """Observe download-stage duration and average throughput for one job."""
+    METRICS["download_seconds"].observe(elapsed)
+    try:
+        size = path.stat().st_size
+    except OSError:
+        return
+    if elapsed > 0:
+        METRICS["download_throughput"].observe(size / elapsed)
+    logger.info("download_finished job_id=%s bytes=%d seconds=%.2f", job_id, size, elapsed)
+
+# 限流、5xx 与网络错误时的重试次数；退避时间为指数上限内的全抖动随机值
+DOWNLOAD_RETRIES = int(os.environ.get('DOWNLOAD_RETRIES', '3'))
+RETRY_BACKOFF_BASE = 2.0
+RETRY_BACKOFF_MAX = 60.0
+TRANSIENT_ERROR_PATTERN = re.compile(
+    r'HTTP Error (429|5\d\d)|timed out|Connection (?:reset|refused|aborted)|Remote end closed|IncompleteRead'
+    r'|Temporary failure in name resolution',
+    re.IGNORECASE
+)
+
+def error_cause(error: Exception) -> Exception:
+    """The exception yt-dlp wrapped into a DownloadError, or the error itself."""
+    exc_info = getattr(error, 'exc_info', None)
+    return exc_info[1] if exc_info and exc_info[1] is not None else error
+
+def classify_transient_error(error: Exception) -> Optional[str]:
+    """"throttled", "server" or "network" for failures worth retrying, otherwise None."""
+    cause = error_cause(error)
+    exceptions = yt_dlp.networking.exceptions
+    if isinstance(cause, exceptions.HTTPError):
+        if cause.status == 429:
+            return "throttled"
+        return "server" if cause.status >= 500 else None
+    if isinstance(cause, exceptions.TransportError):
+        return "network"
+    # 其他路径只留下了错误文本
+    match = TRANSIENT_ERROR_PATTERN.search(str(error))
+    if match is None:
+        return None
+    if match.group(1):
+        return "throttled" if match.group(1) == "429" else "server"
+    return "network"
+
+def retry_delay(attempt: int, error: Exception) -> float:
+    """Full-jitter exponential backoff, no shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt))
+    response = getattr(error_cause(error), 'response', None)
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.strip().isdigit():
+        delay = max(delay, min(float(retry_after), RETRY_BACKOFF_MAX))
+    return delay
+
+def download_in_background(url: str, ydl_opts: dict, job_id: str, info: dict = None, store_key: str = None,
+                           postprocessors: list = None, target_path: str = None, parallel_streams: bool = False):
+    handed_off = False
+    try:
+        # 记录初始状态
+        logger.info("download_started job_id=%s url=%s", job_id, url)
+        logger.debug("download_options job_id=%s opts=%s", job_id, ydl_opts)
+        started = time.monotonic()
+
+        update_progress(job_id, {
+            "download_status": "preparing",
+            "download_progress": 0
+        })
+
+        with ydl_pool.ydl(ydl_opts) as ydl:
+            try:
+                # 确保 URL 不为空
+                if not url:
+                    raise ValueError("URL is empty")
+                
+                # 复用 /download 中已提取的视频信息，避免重复请求元数据
+                if info is None:
+                    logger.info("extract_started job_id=%s url=%s", job_id, url)
+                    record_extraction()
+                    extract_started = time.monotonic()
+                    info = ydl.extract_info(url, download=False)
+                    METRICS["extraction_seconds"].observe(time.monotonic() - extract_started)
+                    if not info:
+                        raise ValueError("Failed to extract video info")
+                
+                # 检查格式信息
+                formats = info.get('formats')
+                if not formats:
+                    logger.warning("no_formats job_id=%s", job_id)
+                
+                cancel_event = next((
+                    hook.cancel_event for hook in ydl_opts.get('progress_hooks', ())
+                    if isinstance(hook, DownloadProgress)
+                ), None)
+                attempt = 0
+                while True:
+                    try:
+                        # parallel 模式下先并行拉取音视频流，随后 yt-dlp 只负责合并
+                        if parallel_streams and prefetch_streams(ydl, info):
+                            logger.debug("streams_prefetched job_id=%s", job_id)
+
+                        # 开始下载（直接从已有的 info 字典下载，不再重新提取）
+                        result = ydl.process_ie_result(info, download=True)
+                        concurrency_controller.record_attempt()
+                        break
+                    except yt_dlp.utils.DownloadError as e:
+                        failure = classify_transient_error(e)
+                        concurrency_controller.record_attempt(failure)
+                        if failure is None or attempt >= DOWNLOAD_RETRIES:
+                            raise
+                        # 暂时性错误：退避后重试，continuedl 会从 .part 文件续传
+                        delay = retry_delay(attempt, e)
+                        attempt += 1
+                        METRICS["download_retries"].inc()
+                        logger.warning("download_retry job_id=%s attempt=%d reason=%s delay=%.1f error=%r",
+                                       job_id, attempt, failure, delay, str(e))
+                        update_progress(job_id, {
+                            "download_status": "retrying",
+                            "error_message": f"第 {attempt} 次重试（{failure}）: {str(e)}"
+                        })
+                        if cancel_event is not None and cancel_event.wait(delay):
+                            raise JobCancelled(f"Job {job_id} was cancelled")
+                        elif cancel_event is None:
+                            time.sleep(delay)
+                        update_progress(job_id, {"download_status": "downloading", "error_message": None})
+                downloaded_path = get_downloaded_path(result, ydl_opts['outtmpl'])
+                record_download_metrics(job_id, downloaded_path, time.monotonic() - started)
+
+                # 需要转码的任务交给转码线程池，立即释放下载槽位
+                if postprocessors:
+                    update_progress(job_id, {"download_status": "queued_for_transcode"})
+                    # 取消标志随任务交给转码阶段，离开下载调度器后 DELETE /jobs/{id} 仍然有效
+                    cancel_event = cancel_event or threading.Event()
+                    with jobs_lock:
+                        transcoding_jobs[job_id] = cancel_event
+                    transcode_pool.submit(
+                        transcode_in_background, job_id, downloaded_path, Path(target_path), postprocessors, store_key,
+                        cancel_event
+                    )
+                    handed_off = True
+                    return True
+
+                # 将完成的文件登记到下载库，后续相同请求可直接命中
+                if store_key:
+                    add_to_store(store_key, job_id, downloaded_path)
+                
+                # 更新最终状态
+                update_progress(job_id, {
+                    "download_status": "completed",
+                    "download_progress": 100
+                })
+                return True
+                
+            except JobCancelled:
+                logger.info("download_cancelled job_id=%s", job_id)
+                update_progress(job_id, {"download_status": "cancelled"})
+                update_job(job_id, {"status": "cancelled"})
+                return False
+
+            except yt_dlp.utils.DownloadError as e:
+                logger.warning("download_failed job_id=%s error=%r", job_id, str(e))
+                error_message = str(e)
+                if "Video unavailable" in error_message:
+                    error_message = "视频不可用，可能是私有或已删除"
+                elif "This video is only available for registered users" in error_message:
+                    error_message = "此视频需要登录才能观看，请尝试其他视频"
+                elif classify_transient_error(e) == "throttled":
+                    error_message = "请求过于频繁，YouTube 暂时限制了下载（HTTP 429），请稍后再试"
+                update_progress(job_id, {
+                    "download_status": "error",
+                    "download_progress": 0,
+                    "error_message": error_message
+                })
+                return False
+            
+    except Exception as e:
+        logger.exception("download_error job_id=%s", job_id)
+
+        update_progress(job_id, {
+            "download_status": "error",
+            "download_progress": 0,
+            "error_message": f"下载失败: {str(e)}"
+        })
+        return False
+    finally:
+        bandwidth_governor.release(job_id)
+        concurrency_controller.job_finished(job_id)
+        if not handed_off:
+            release_inflight(job_id)
+
+def run_postprocessors(source_path: Path, postprocessors: list) -> Path:
+    """Run yt-dlp FFmpeg postprocessors on a downloaded file; returns the output path."""
+    information = {'filepath': str(source_path), 'ext': source_path.suffix[1:]}
+    with ydl_pool.ydl({'quiet': True, 'no_warnings': True}) as ydl:
+        for pp_def in postprocessors:
+            options = {k: v for k, v in pp_def.items() if k != 'key'}
+            pp = yt_dlp.postprocessor.get_postprocessor(pp_def['key'])(ydl, **options)
+            files_to_delete, information = pp.run(information)
+            for path in files_to_delete:
+                if path != information['filepath'] and os.path.exists(path):
+                    os.remove(path)
+    return Path(information['filepath'])
+
+def transcode_in_background(job_id: str, source_path: Path, target_path: Path, postprocessors: list, store_key: str = None,
+                            cancel_event: threading.Event = None):
+    """Second pipeline stage: CPU-bound FFmpeg work, off the download workers.
+
+    ``cancel_event`` is the job's cancel flag, handed over from the download
+    stage. It is checked before FFmpeg starts and again after it finishes;
+    a job cancelled in between discards the output and is never added to
+    the download store.
+    """
+    cancel_event = cancel_event or threading.Event()
+    try:
+        if cancel_event.is_set():
+            raise JobCancelled(f"Job {job_id} was cancelled")
+        update_progress(job_id, {"download_status": "transcoding"})
+        logger.info("transcode_started job_id=%s source=%s", job_id, source_path)
+        started = time.monotonic()
+        output_path = run_postprocessors(source_path, postprocessors)
+        METRICS["postprocess_seconds"].observe(time.monotonic() - started)
+        if cancel_event.is_set():
+            # FFmpeg 运行期间被取消：丢弃转码结果和中间文件
+            for path in {output_path, source_path}:
+                if path.exists():
+                    path.unlink()
+            raise JobCancelled(f"Job {job_id} was cancelled")
+        if output_path != target_path:
+            os.replace(output_path, target_path)
+
+        if store_key and not cancel_event.is_set():
+            add_to_store(store_key, job_id, target_path)
+
+        update_progress(job_id, {
+            "download_status": "completed",
+            "download_progress": 100
+        })
+        return True
+    except JobCancelled:
+        logger.info("transcode_cancelled job_id=%s", job_id)
+        update_progress(job_id, {"download_status": "cancelled"})
+        update_job(job_id, {"status": "cancelled"})
+        return False
+    except Exception as e:
+        logger.warning("transcode_failed job_id=%s error=%r", job_id, str(e))
+        update_progress(job_id, {
+            "download_status": "error",
+            "download_progress": 0,
+            "error_message": f"转码失败: {str(e)}"
+        })
+        return False
+    finally:
+        with jobs_lock:
+            transcoding_jobs.pop(job_id, None)
+        release_inflight(job_id)
+
+# 转码线程池：FFmpeg 在子进程中完成 CPU 密集的工作，池大小默认等于 CPU 核数
+transcode_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('TRANSCODE_WORKERS', str(os.cpu_count() or 2))))
+
+# 任务优先级：数值越小越先调度
+PRIORITY_CLASSES = ("short", "normal", "long")
+SHORT_VIDEO_SECONDS = 60
+LONG_VIDEO_SECONDS = 20 * 60
+
+def classify_priority(video_url: VideoURL, info: dict) -> str:
+    """Audio and short clips jump ahead of long video downloads."""
+    duration = info.get('duration') or 0
+    if video_url.format == 'mp3' or '/shorts/' in video_url.url or (duration and duration <= SHORT_VIDEO_SECONDS):
+        return "short"
+    if duration > LONG_VIDEO_SECONDS:
+        return "long"
+    return "normal"
+
+class SchedulerTask:
+    __slots__ = ("job_id", "client", "priority", "fn", "args", "cancel_event")
+
+    def __init__(self, job_id: str, client: str, priority: str, fn, args: tuple, cancel_event: threading.Event):
+        self.job_id = job_id
+        self.client = client
+        self.priority = priority
+        self.fn = fn
+        self.args = args
+        self.cancel_event = cancel_event
+
+class DownloadScheduler:
+    """Priority queue of download jobs served by a resizable worker set.
+
+    Each priority class keeps one FIFO per client; workers always serve the
+    highest non-empty class and rotate between its clients, so one client
+    submitting many jobs cannot starve others. Waiting jobs get their
+    ``queue_position`` published into the progress registry when it changes.
+    """
+
+    def __init__(self, workers: int):
+        self._cond = threading.Condition()
+        self._queues = [OrderedDict() for _ in PRIORITY_CLASSES]
+        self._queued: Dict[str, SchedulerTask] = {}
+        self._running: Dict[str, SchedulerTask] = {}
+        # 上次发布的排队位置，只推送发生变化的任务
+        self._positions: Dict[str, int] = {}
+        self._publish_lock = threading.Lock()
+        self._target_workers = 0
+        self._workers = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.set_workers(workers)
+
+    def submit(self, job_id: str, fn, args: tuple, priority: str = "normal", client: str = "",
+               cancel_event: threading.Event = None) -> SchedulerTask:
+        task = SchedulerTask(job_id, client, priority, fn, args, cancel_event or threading.Event())
+        with self._cond:
+            queue = self._queues[PRIORITY_CLASSES.index(priority)]
+            queue.setdefault(client, deque()).append(task)
+            self._queued[job_id] = task
+            self._cond.notify()
+        self._publish_positions()
+        return task
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """Cancel a job; returns "queued", "running" or None if unknown."""
+        with self._cond:
+            task = self._queued.pop(job_id, None)
+            if task is not None:
+                queue = self._queues[PRIORITY_CLASSES.index(task.priority)]
+                queue[task.client].remove(task)
+                if not queue[task.client]:
+                    del queue[task.client]
+                self.cancelled += 1
+                state = "queued"
+            else:
+                task = self._running.get(job_id)
+                if task is None:
+                    return None
+                # 正在下载的任务由进度钩子检测取消标志并中断
+                task.cancel_event.set()
+                self.cancelled += 1
+                state = "running"
+        task.cancel_event.set()
+        if state == "queued":
+            self._publish_positions()
+        return state
+
+    def set_workers(self, workers: int):
+        """Grow or shrink the worker set; extra workers exit when idle."""
+        with self._cond:
+            self._target_workers = workers
+            spawn = max(0, workers - self._workers)
+            self._workers += spawn
+            self._cond.notify_all()
+        for _ in range(spawn):
+            threading.Thread(target=self._worker_loop, daemon=True).start()
+
+    def _next_task(self) -> Optional[SchedulerTask]:
+        for queue in self._queues:
+            if queue:
+                client, tasks = next(iter(queue.items()))
+                task = tasks.popleft()
+                if tasks:
+                    queue.move_to_end(client)
+                else:
+                    del queue[client]
+                del self._queued[task.job_id]
+                return task
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._queued and self._workers <= self._target_workers:
+                    self._cond.wait()
+                if self._workers > self._target_workers:
+                    self._workers -= 1
+                    return
+                task = self._next_task()
+                self._running[task.job_id] = task
+            update_progress(task.job_id, {"queue_position": None})
+            self._publish_positions()
+            try:
+                task.fn(*task.args)
+            except Exception:
+                logger.exception("scheduled_job_failed job_id=%s", task.job_id)
+            finally:
+                with self._cond:
+                    self._running.pop(task.job_id, None)
+                    self.completed += 1
+
+    def _queue_order(self) -> list:
+        """Job IDs in the order workers will pick them up."""
+        order = []
+        for queue in self._queues:
+            # 按客户端轮转：取出队首客户端的一个任务，未取完的客户端排到末尾
+            pending = deque(iter(tasks) for tasks in queue.values())
+            while pending:
+                tasks = pending.popleft()
+                task = next(tasks, None)
+                if task is not None:
+                    order.append(task.job_id)
+                    pending.append(tasks)
+        return order
+
+    def _publish_positions(self):
+        with self._publish_lock:
+            with self._cond:
+                order = self._queue_order()
+            positions = {job_id: position for position, job_id in enumerate(order, start=1)}
+            for job_id, position in positions.items():
+                if self._positions.get(job_id) != position:
+                    update_progress(job_id, {"queue_position": position})
+            self._positions = positions
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "workers": self._target_workers,
+                "active": len(self._running),
+                "queued": len(self._queued),
+                "queued_by_priority": {
+                    name: sum(len(tasks) for tasks in queue.values())
+                    for name, queue in zip(PRIORITY_CLASSES, self._queues)
+                },
+                "completed": self.completed,
+                "cancelled": self.cancelled
+            }
+
+# 下载调度器，替代固定 4 线程的线程池；工作线程数可通过 PUT /scheduler 调整
+download_scheduler = DownloadScheduler(workers=int(os.environ.get('DOWNLOAD_WORKERS', '4')))
+
+# 速度样本超过这么多秒未更新（任务卡住或已结束）即不计入总吞吐量
+SPEED_SAMPLE_MAX_AGE = 5.0
+
+class ConcurrencyController:
+    """AIMD control of the number of download workers.
+
+    The controller watches two signals over a window of ``interval``
+    seconds. The first is aggregate throughput: the sum of the latest speed
+    each running job reported through DownloadProgress, sampled every
+    ``sample_interval``. The second is the download attempts that failed
+    with a transient error (HTTP 429, 5xx, network).
+
+    Throttling (429), or a transient error rate above ``max_error_rate``,
+    multiplies the worker count by ``decrease_factor``. Throttling is acted
+    on at the next sample instead of waiting for the window to end. When
+    neither happens and jobs are waiting for a worker, one worker is
+    added. The next window checks that the increase raised throughput by at
+    least ``min_gain``. If it did not, the link or CDN is saturated, so the
+    worker is taken back and growth pauses for ``hold`` seconds. Decisions
+    are applied with ``DownloadScheduler.set_workers``, and the most recent
+    ones are kept for /stats.
+    """
+
+    def __init__(self, scheduler: DownloadScheduler, min_workers: int = 1, max_workers: int = 16,
+                 interval: float = 10.0, sample_interval: float = 1.0, decrease_factor: float = 0.5,
+                 max_error_rate: float = 0.1, min_gain: float = 0.05, hold: float = 60.0):
+        self.scheduler = scheduler
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.interval = interval
+        self.sample_interval = sample_interval
+        self.decrease_factor = decrease_factor
+        self.max_error_rate = max_error_rate
+        self.min_gain = min_gain
+        self.hold = hold
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._speeds: Dict[str, tuple] = {}  # job_id -> (bytes/s, 采样时间)
+        self._samples = []  # 当前窗口内的总吞吐量样本
+        self._attempts = 0
+        self._failures: Dict[str, int] = {}  # 原因 -> 当前窗口内的失败次数
+        self._throttled = False
+        self._window_started = time.monotonic()
+        self._baseline = None  # 上一次加线程前的 (线程数, 吞吐量)
+        self._hold_until = 0.0
+        self._thread = None
+        self.last_window = None
+        self.decisions = deque(maxlen=20)
+
+    def start(self):
+        with self._lock:
+            self.enabled = True
+            self._reset_window(time.monotonic())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Leave the worker count where it is; used when it is set by hand."""
+        with self._lock:
+            self.enabled = False
+            self._baseline = None
+
+    def set_workers(self, workers: int) -> int:
+        """Apply a worker count chosen by hand while adaptive control stays on.
+
+        The count is clamped to [min_workers, max_workers] and a pending
+        increase check is dropped, so the next window is measured from it.
+        """
+        target = max(self.min_workers, min(self.max_workers, workers))
+        with self._lock:
+            self._baseline = None
+            self._reset_window(time.monotonic())
+        self.scheduler.set_workers(target)
+        return target
+
+    def record_speed(self, job_id: str, speed: Optional[float]):
+        with self._lock:
+            self._speeds[job_id] = (speed or 0.0, time.monotonic())
+
+    def job_finished(self, job_id: str):
+        with self._lock:
+            self._speeds.pop(job_id, None)
+
+    def record_attempt(self, failure: Optional[str] = None):
+        """Count one download attempt; ``failure`` is the transient error class, if any."""
+        with self._lock:
+            self._attempts += 1
+            if failure is not None:
+                self._failures[failure] = self._failures.get(failure, 0) + 1
+                if failure == "throttled":
+                    self._throttled = True
+
+    def throughput(self) -> float:
+        now = time.monotonic()
+        with self._lock:
+            return sum(speed for speed, sampled in self._speeds.values() if now - sampled <= SPEED_SAMPLE_MAX_AGE)
+
+    def _reset_window(self, now: float):
+        self._samples = []
+        self._attempts = 0
+        self._failures = {}
+        self._throttled = False
+        self._window_started = now
+
+    def _run(self):
+        while True:
+            time.sleep(self.sample_interval)
+            if not self.enabled:
+                continue
+            sample = self.throughput()
+            with self._lock:
+                self._samples.append(sample)
+                due = self._throttled or time.monotonic() - self._window_started >= self.interval
+            if due:
+                try:
+                    self.evaluate()
+                except Exception:
+                    logger.exception("concurrency_evaluate_failed")
+
+    def evaluate(self) -> Optional[dict]:
+        """Close the current window and adjust the worker count; returns the decision, if any."""
+        now = time.monotonic()
+        with self._lock:
+            samples, attempts, failures = self._samples, self._attempts, self._failures
+            self._reset_window(now)
+        throughput = sum(samples) / len(samples) if samples else self.throughput()
+        errors = sum(failures.values())
+        error_rate = errors / attempts if attempts else 0.0
+        scheduler = self.scheduler.stats()
+        workers = scheduler["workers"]
+        self.last_window = {
+            "throughput_kbps": round(throughput / 1024, 1),
+            "attempts": attempts,
+            "failures": failures,
+            "error_rate": round(error_rate, 3),
+            "queued": scheduler["queued"]
+        }
+
+        target, reason = workers, None
+        if failures.get("throttled") or (errors and error_rate > self.max_error_rate):
+            # 乘性减：被限流或错误率过高时立即减半
+            target = max(self.min_workers, int(workers * self.decrease_factor))
+            reason = "throttled" if failures.get("throttled") else "errors"
+            self._baseline = None
+            self._hold_until = now + self.hold
+        elif self._baseline is not None:
+            base_workers, base_throughput = self._baseline
+            self._baseline = None
+            if throughput < base_throughput * (1 + self.min_gain):
+                # 上次加的线程没有带来吞吐量提升：撤回并暂停增长
+                target = max(self.min_workers, min(workers, base_workers))
+                reason = "no_gain"
+                self._hold_until = now + self.hold
+        if reason is None and scheduler["queued"] and now >= self._hold_until and workers < self.max_workers:
+            # 加性增：仍有任务排队时每个窗口加一个线程
+            target = workers + 1
+            reason = "increase"
+            self._baseline = (workers, throughput)
+        if reason is None:
+            return None
+
+        if target != workers:
+            self.scheduler.set_workers(target)
+        decision = {
+            "time": time.time(),
+            "action": reason,
+            "workers_from": workers,
+            "workers_to": target,
+            **self.last_window
+        }
+        self.decisions.append(decision)
+        logger.info("concurrency_adjusted workers=%d->%d reason=%s throughput_kbps=%.1f error_rate=%.3f",
+                    workers, target, reason, throughput / 1024, error_rate)
+        return decision
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "workers": self.scheduler.stats()["workers"],
+            "min_workers": self.min_workers,
+            "max_workers": self.max_workers,
+            "interval": self.interval,
+            "throughput_kbps": round(self.throughput() / 1024, 1),
+            "holding": max(0.0, round(self._hold_until - time.monotonic(), 1)),
+            "last_window": self.last_window,
+            "decisions": list(self.decisions)
+        }
+
+# 自适应并发（ADAPTIVE_CONCURRENCY=1 开启，默认关闭）：DOWNLOAD_WORKERS 为初始值，按吞吐量与错误率在上下限之间调整。
+# 仅用于单进程模式：使用共享任务存储时并发由工作进程的 WORKER_CAPACITY 决定，调整本进程的调度器没有作用
+concurrency_controller = ConcurrencyController(
+    download_scheduler,
+    min_workers=int(os.environ.get('ADAPTIVE_MIN_WORKERS', '1')),
+    max_workers=int(os.environ.get('ADAPTIVE_MAX_WORKERS', '16'))
+)
+if os.environ.get('ADAPTIVE_CONCURRENCY', '0').lower() in ('1', 'true', 'yes'):
+    if job_store is None:
+        concurrency_controller.start()
+    else:
+        logger.warning("adaptive_concurrency_ignored reason=job_store")
+
+@app.get("/")
+def read_root():
+    return {"message": "YouTube Downloader API"}
+
+def build_postprocessors(format: str) -> list:
+    # 设置后处理器
+    postprocessors = []
+    if format == 'mp3':
+        postprocessors.append({
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'mp3',
+            'preferredquality': '192'
+        })
+    elif format in ['webm', '3gp']:
+        postprocessors.append({
+            'key': 'FFmpegVideoConvertor',
+            'preferedformat': format
+        })
+    return postprocessors
+
+def complete_from_store(job_id: str, video_url: VideoURL, stored_path: Path, stored_info: dict) -> bool:
+    """Finish a job instantly by linking an already downloaded file into save_path.
+
+    Returns False, without touching save_path, if the job was cancelled meanwhile.
+    """
+    if job_cancelled(job_id):
+        return False
+    filename, filepath = make_local_filepath(video_url.save_path, stored_info.get('title', 'video'), video_url.format)
+    download_store.link_out(stored_path, filepath)
+
+    video_info = {
+        **stored_info,
+        "job_id": job_id,
+        "is_short": '/shorts/' in video_url.url,
+        "local_filename": filename,
+        "save_path": str(filepath)
+    }
+    logger.info("served_from_store job_id=%s path=%s", job_id, stored_path)
+    if not update_progress(job_id, {
+        "download_status": "completed",
+        "download_progress": 100,
+        "local_filename": filename,
+        "save_path": str(filepath),
+        "from_store": True
+    }):
+        # 链接期间被取消：进度记录拒绝从终态转为 completed
+        return False
+    update_job(job_id, {"status": "ready", "video_info": video_info})
+    return True
+
+def prepare_download(job_id: str, video_url: VideoURL, client: str = "", resume_path: str = None):
+    """Extract metadata for a submitted job, then hand it to the download pool."""
+    try:
+        # 排队等待提取期间已被取消
+        if job_cancelled(job_id):
+            release_inflight(job_id)
+            return False
+
+        postprocessors = build_postprocessors(video_url.format)
+
+        # 已下载过相同视频/格式/后处理的文件时直接链接，不访问网络
+        store_key = DownloadStore.make_key(
+            extract_video_id(video_url.url),
+            compile_format_selector(video_url.format, video_url.quality).spec,
+            postprocessors
+        )
+        stored = download_store.lookup(store_key)
+        if stored is not None:
+            completed = complete_from_store(job_id, video_url, *stored)
+            release_inflight(job_id)
+            return completed
+
+        # Extract video information first
+        info, best_video, format_spec = extract_video_info(video_url.url, video_url.format, video_url.quality)
+
+        if resume_path:
+            # 恢复重启前的任务时沿用原文件名，以便续传 .part 文件
+            filepath = Path(resume_path)
+            filename = filepath.name
+        else:
+            # Generate safe filename（使用用户指定的保存路径或默认路径）
+            filename, filepath = make_local_filepath(video_url.save_path, info.get('title', 'video'), video_url.format)
+        if job_journal is not None:
+            # 提取期间被取消或已结束的任务已从日志移除，不能再写回；与取消请求在 jobs_lock 下互斥
+            with jobs_lock:
+                owner = download_owners.get(job_id, job_id)
+                record = download_progress.get(owner)
+                if jobs.get(owner, {}).get("status") != "cancelled" and (
+                    record is not None and record.download_status not in TERMINAL_STATUSES
+                ):
+                    job_journal.record(job_id, "ready", filepath=str(filepath))
+
+        # Prepare video information response
+        video_info = {
+            "job_id": job_id,
+            "title": info.get('title', 'Unknown Title'),
+            "author": info.get('uploader', 'Unknown Author'),
+            "length": info.get('duration', 0),
+            "views": info.get('view_count', 0),
+            "thumbnail_url": info.get('thumbnail', ''),
+            "download_url": best_video.get('url', ''),
+            "is_short": '/shorts/' in video_url.url,
+            "resolution": f"{best_video.get('height', 'Unknown')}p",  # 修正分辨率显示
+            "filesize": best_video.get('filesize', 0),
+            "ext": video_url.format,
+            "local_filename": filename,
+            "save_path": str(filepath)
+        }
+
+        # Configure download options
+        cancel_event = threading.Event()
+        progress_tracker = DownloadProgress()
+        progress_tracker.job_id = job_id
+        progress_tracker.cancel_event = cancel_event
+
+        # 需要转码时先下载为中间文件，由转码阶段生成最终文件
+        if postprocessors:
+            outtmpl = str(filepath.with_name(f"{filepath.stem}.source.%(ext)s"))
+        else:
+            outtmpl = str(filepath)
+
+        ydl_opts = {
+            'format': format_spec,
+            'progress_hooks': [progress_tracker],
+            'quiet': True,
+            'no_warnings': True,
+            'outtmpl': outtmpl,
+            'continuedl': True,  # 从已有的 .part 文件继续下载
+            # 固定读取块大小，限速时进度钩子按小块计费，速度更平滑
+            'buffersize': 64 * 1024,
+            'noresizebuffer': True,
+        }
+        parallel = video_url.download_mode == 'parallel'
+        if parallel:
+            ydl_opts['concurrent_fragment_downloads'] = video_url.fragment_concurrency or FRAGMENT_CONCURRENCY
+            ydl_opts['http_chunk_size'] = HTTP_CHUNK_SIZE
+
+        logger.info("job_ready job_id=%s format=%s height=%s", job_id, format_spec, best_video.get('height'))
+
+        # 提取期间已被取消则不再排队下载
+        if job_cancelled(job_id):
+            release_inflight(job_id)
+            return False
+
+        # 元数据已就绪，/jobs/{id} 可以返回视频信息
+        priority = classify_priority(video_url, info)
+        update_progress(job_id, {
+            "local_filename": filename,
+            "save_path": str(filepath),
+            "download_status": "queued",
+            "priority": priority
+        })
+        update_job(job_id, {"status": "ready", "video_info": video_info})
+
+        if video_url.rate_limit:
+            bandwidth_governor.set_job_limit(job_id, video_url.rate_limit * 1024)
+
+        # 交给调度器按优先级和客户端公平排队下载
+        download_scheduler.submit(
+            job_id,
+            download_in_background,
+            (video_url.url, ydl_opts, job_id, info, store_key, postprocessors, str(filepath), parallel),
+            priority=priority,
+            client=client,
+            cancel_event=cancel_event
+        )
+        return True
+
+    except Exception as e:
+        logger.warning("prepare_failed job_id=%s error=%r", job_id, str(e))
+        update_job(job_id, {"status": "error", "error_message": str(e)})
+        update_progress(job_id, {
+            "download_status": "error",
+            "download_progress": 0,
+            "error_message": str(e)
+        })
+        release_inflight(job_id)
+        return False
+
+def get_coalesce_key(video_url: VideoURL) -> tuple:
+    """Requests with the same key can share one extraction and download."""
+    return (extract_video_id(video_url.url), video_url.format, video_url.quality, video_url.save_path)
+
+def release_inflight(job_id: str):
+    """Stop attaching new requests to a job once it has finished or failed."""
+    with jobs_lock:
+        job_id = download_owners.get(job_id, job_id)
+        key = jobs.get(job_id, {}).get("coalesce_key")
+        if key is not None and inflight_jobs.get(key) == job_id:
+            del inflight_jobs[key]
+
+def get_client_id(request: Request) -> str:
+    """Identify the submitting client for fair scheduling."""
+    return request.headers.get("X-Client-Id") or (request.client.host if request.client else "")
+
+def submit_job(video_url: VideoURL, client: str = "", job_id: str = None, resume_path: str = None) -> dict:
+    """Register a download job and start its extraction stage.
+
+    Thread-safe, so it serves both POST /download and batch fan-out;
+    ``job_id`` and ``resume_path`` are given when resuming a journaled job.
+    """
+    global coalesced_requests
+    job_id = job_id or uuid.uuid4().hex
+    key = get_coalesce_key(video_url)
+
+    with jobs_lock:
+        primary_id = inflight_jobs.get(key)
+        primary_record = download_progress.get(primary_id) if primary_id is not None else None
+        if primary_record is None:
+            primary_id = None
+        jobs[job_id] = {
+            "job_id": job_id,
+            "status": "extracting",
+            "url": video_url.url,
+            "format": video_url.format,
+            "quality": video_url.quality,
+            "video_info": None,
+            "error_message": None,
+            "client": client,
+            "coalesced_with": primary_id
+        }
+        if primary_record is not None:
+            # 相同视频/格式/清晰度/路径的任务正在进行，直接共享其进度记录
+            download_progress.attach(job_id, primary_record)
+            coalesced_requests += 1
+        else:
+            jobs[job_id]["coalesce_key"] = key
+            inflight_jobs[key] = job_id
+            # Initialize progress tracker
+            download_progress.create(job_id, video_url.save_path)
+
+    if primary_id is None:
+        request = {
+            "url": video_url.url,
+            "format": video_url.format,
+            "quality": video_url.quality,
+            "save_path": video_url.save_path,
+            "rate_limit": video_url.rate_limit,
+            "download_mode": video_url.download_mode,
+            "fragment_concurrency": video_url.fragment_concurrency,
+            "client": client
+        }
+        if job_journal is not None:
+            job_journal.record(job_id, "pending", request=request)
+        if remote_workers():
+            # 交给共享存储，由任一工作进程领取
+            job_store.enqueue(job_id, {**request, "resume_path": resume_path}, job_state(job_id), progress_state(job_id))
+        else:
+            # 在独立线程池中提取元数据，不阻塞事件循环
+            extract_pool.submit(prepare_download, job_id, video_url, client, resume_path)
+    elif remote_workers():
+        publish_job(job_id)
+
+    return {
+        "job_id": job_id,
+        "status": "extracting",
+        "coalesced_with": primary_id,
+        "job_url": f"/jobs/{job_id}",
+        "progress_url": f"/progress/{job_id}"
+    }
+
+def video_url_from_request(request: dict) -> VideoURL:
+    """Rebuild a VideoURL from the request dict kept by the journal or job store."""
+    return VideoURL(
+        url=request["url"],
+        format=request["format"],
+        quality=request["quality"],
+        save_path=request["save_path"],
+        rate_limit=request.get("rate_limit"),
+        download_mode=request.get("download_mode", "standard"),
+        fragment_concurrency=request.get("fragment_concurrency")
+    )
+
+@app.on_event("startup")
+async def resume_journaled_jobs():
+    """Requeue jobs that were pending or downloading when the server stopped."""
+    if job_journal is None:
+        return
+    for job_id, request, filepath in job_journal.pending_jobs():
+        try:
+            video_url = video_url_from_request(request)
+        except Exception as e:
+            logger.warning("journal_drop job_id=%s error=%r", job_id, str(e))
+            job_journal.finish(job_id)
+            continue
+        logger.info("job_resumed job_id=%s", job_id)
+        submit_job(video_url, request.get("client", ""), job_id=job_id, resume_path=filepath)
+
+@app.on_event("shutdown")
+async def flush_job_journal():
+    if job_journal is not None:
+        job_journal.flush()
+
+@app.post("/download", status_code=202)
+async def download_video(video_url: VideoURL, request: Request):
+    client = get_client_id(request)
+    if remote_workers():
+        # 共享任务存储（SQLite / Redis）的读写是阻塞 I/O，放到线程池中执行，不阻塞事件循环
+        return await asyncio.get_running_loop().run_in_executor(None, submit_job, video_url, client)
+    return submit_job(video_url, client)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    await ensure_local_job(job_id)
+    with jobs_lock:
+        if job_id not in jobs:
+            raise HTTPException(status_code=404, detail="Job not found")
+        job = dict(jobs[job_id])
+        job.pop("coalesce_key", None)
+        primary = jobs.get(job["coalesced_with"]) if job["coalesced_with"] else None
+        if primary is not None:
+            # 合并的请求沿用主任务的状态和视频信息
+            job["status"] = primary["status"]
+            job["error_message"] = primary["error_message"]
+            if primary["video_info"] is not None:
+                job["video_info"] = {**primary["video_info"], "job_id": job_id}
+        elif job["video_info"] is not None and job["video_info"].get("job_id") != job_id:
+            # 接管下载的请求：视频信息由原主任务的流水线写入
+            job["video_info"] = {**job["video_info"], "job_id": job_id}
+        job["progress"] = download_progress.snapshot(job_id) or {}
+    return job
+
+def promote_follower(job_id: str) -> Optional[str]:
+    """Hand the download owned by ``job_id`` to its oldest coalesced follower.
+
+    The pipeline keeps running under its original job ID and
+    ``download_owners`` routes its updates to the heir. Call with
+    ``jobs_lock`` held; returns None when no follower is waiting.
+    """
+    record = download_progress.get(job_id)
+    if record is None:
+        return None
+    with record.lock:
+        followers = [follower for follower in record.job_ids if follower != job_id and follower in jobs]
+    if not followers:
+        return None
+    heir = followers[0]
+    owner = jobs.pop(job_id)
+    jobs[heir].update({
+        "status": owner["status"],
+        "video_info": owner["video_info"],
+        "error_message": owner["error_message"],
+        "coalesced_with": None
+    })
+    for follower in followers[1:]:
+        jobs[follower]["coalesced_with"] = heir
+    key = owner.get("coalesce_key")
+    if key is not None:
+        jobs[heir]["coalesce_key"] = key
+        if inflight_jobs.get(key) == job_id:
+            inflight_jobs[key] = heir
+    download_owners[download_handle(job_id)] = heir
+    download_progress.detach(job_id)
+    return heir
+
+def cancel_local_job(job_id: str) -> dict:
+    """Cancel a job known to this process; raises HTTPException like the endpoint.
+
+    A job that shares its download with coalesced requests only detaches
+    itself; the download is stopped once nobody is left waiting for it.
+    """
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        # 终态以进度记录为准：下载失败后 jobs 中的 status 仍停留在 "ready"
+        progress = download_progress.snapshot(job_id) or {}
+        status = progress.get("download_status")
+        if status not in TERMINAL_STATUSES and job["status"] == "cancelled":
+            status = "cancelled"
+        if status in TERMINAL_STATUSES:
+            raise HTTPException(status_code=409, detail=f"Job already {status}")
+        if job["coalesced_with"] is not None:
+            # 合并的请求只退订共享的下载，不影响其他请求；取消后不再保留任务条目
+            download_progress.detach(job_id)
+            del jobs[job_id]
+            return {"job_id": job_id, "status": "cancelled"}
+        heir = promote_follower(job_id)
+        if heir is None:
+            job["status"] = "cancelled"
+            handle = download_handle(job_id)
+
+    if heir is not None:
+        # 仍有合并的请求在等待：下载交给其中最早的一个，只有调用方退出
+        logger.info("download_promoted job_id=%s heir=%s", job_id, heir)
+        if remote_workers():
+            publish_job(heir)
+        return {"job_id": job_id, "status": "cancelled", "promoted_to": heir}
+
+    if remote_workers():
+        # 仍在共享队列中的任务直接移除，已被领取的由工作进程中断
+        state = "queued" if job_store.cancel(handle) else "running"
+    else:
+        state = download_scheduler.cancel(handle)
+        if state is None:
+            with jobs_lock:
+                transcode_event = transcoding_jobs.get(handle)
+            if transcode_event is not None:
+                # 已离开下载调度器、正在转码：转码线程在 FFmpeg 前后检查该标志
+                transcode_event.set()
+                state = "transcoding"
+    if state != "running":
+        # 排队中、仍在提取元数据或正在转码的任务直接标记为已取消
+        update_progress(job_id, {"download_status": "cancelled", "queue_position": None})
+        release_inflight(job_id)
+        if remote_workers():
+            publish_job(job_id)
+    return {"job_id": job_id, "status": "cancelled", "cancelled_while": state or "extracting"}
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    if remote_workers():
+        await ensure_local_job(job_id)
+        return await asyncio.get_running_loop().run_in_executor(None, cancel_local_job, job_id)
+    return cancel_local_job(job_id)
+
+# 工作进程向共享存储批量发布状态的间隔（秒）
+STORE_PUBLISH_INTERVAL = 0.2
+# 工作进程心跳间隔；超过 WORKER_DEAD_AFTER 秒无心跳的进程视为已退出，其任务重新排队
+WORKER_HEARTBEAT_INTERVAL = 2.0
+WORKER_DEAD_AFTER = float(os.environ.get('WORKER_DEAD_AFTER', '30'))
+
+class StoreWorker:
+    """Runs jobs claimed from the shared job store inside this process.
+
+    Claimed jobs go through the normal ``submit_job`` path, so extraction,
+    scheduling, the download store and bandwidth limits work as in a single
+    process. Job and progress changes are collected per job and published
+    to the store in one batch every ``STORE_PUBLISH_INTERVAL`` seconds. At
+    most ``capacity`` jobs are claimed at a time; the rest stay queued for
+    other workers.
+    """
+
+    def __init__(self, store, capacity: int, worker_id: str = None):
+        self.store = store
+        self.capacity = capacity
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._slots = threading.Semaphore(capacity)
+        self._lock = threading.Lock()
+        self._claimed = set()
+        self._dirty = set()
+        self._released = set()
+        self.claims = 0
+
+    def mark(self, job_id: str):
+        with self._lock:
+            if job_id in self._claimed:
+                self._dirty.add(job_id)
+
+    def finished(self, job_id: str):
+        """A claimed job reached a terminal status; free its slot."""
+        with self._lock:
+            if job_id not in self._claimed:
+                return
+            self._claimed.discard(job_id)
+            # 最终状态发布后才释放领取记录，进程在此之前退出时任务会被重新排队
+            self._dirty.add(job_id)
+            self._released.add(job_id)
+        self._slots.release()
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            released, self._released = self._released, set()
+        if dirty:
+            self.store.put_many([(job_id, job_state(job_id), progress_state(job_id)) for job_id in dirty])
+        for job_id in released:
+            self.store.release(job_id)
+
+    def _publish_loop(self):
+        while True:
+            time.sleep(STORE_PUBLISH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("job_store_publish_failed worker=%s error=%r", self.worker_id, str(e))
+
+    def heartbeat(self) -> list:
+        with self._lock:
+            claimed = list(self._claimed)
+        self.store.heartbeat(self.worker_id, {
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "capacity": self.capacity,
+            "active": len(claimed)
+        })
+        return claimed
+
+    def _control_loop(self):
+        last_requeue = 0.0
+        while True:
+            time.sleep(WORKER_HEARTBEAT_INTERVAL)
+            try:
+                claimed = self.heartbeat()
+                for job_id in self.store.cancelled(claimed):
+                    try:
+                        cancel_local_job(job_id)
+                    except HTTPException:
+                        pass
+                    if download_progress.get(job_id) is None:
+                        # 已退订的合并请求不会再有终态更新
+                        self.finished(job_id)
+                if time.monotonic() - last_requeue >= WORKER_DEAD_AFTER / 2:
+                    last_requeue = time.monotonic()
+                    for job_id in self.store.requeue_stale(WORKER_DEAD_AFTER):
+                        logger.warning("job_requeued job_id=%s worker=%s", job_id, self.worker_id)
+            except Exception as e:
+                logger.error("job_store_control_failed worker=%s error=%r", self.worker_id, str(e))
+
+    def _start(self, job_id: str, request: dict):
+        with self._lock:
+            self._claimed.add(job_id)
+            self.claims += 1
+        try:
+            video_url = video_url_from_request(request)
+        except Exception as e:
+            logger.warning("job_rejected job_id=%s error=%r", job_id, str(e))
+            with jobs_lock:
+                jobs[job_id] = {
+                    "job_id": job_id, "status": "error", "url": request.get("url"), "video_info": None,
+                    "error_message": str(e), "coalesced_with": None
+                }
+            download_progress.create(job_id)
+            update_progress(job_id, {"download_status": "error", "error_message": str(e)})
+            return
+        logger.info("job_claimed job_id=%s worker=%s", job_id, self.worker_id)
+        submit_job(video_url, request.get("client", ""), job_id=job_id, resume_path=request.get("resume_path"))
+        record = download_progress.get(job_id)
+        if record is not None:
+            download_progress.add_listener(record, functools.partial(self.mark, job_id))
+        self.mark(job_id)
+
+    def run(self):
+        # 领取任务前先登记心跳，其他工作进程不会把刚领取的任务当作无主任务
+        self.heartbeat()
+        threading.Thread(target=self._publish_loop, daemon=True).start()
+        threading.Thread(target=self._control_loop, daemon=True).start()
+        logger.info("worker_started worker=%s capacity=%d", self.worker_id, self.capacity)
+        while True:
+            self._slots.acquire()
+            try:
+                claimed = self.store.claim(self.worker_id, timeout=5)
+            except Exception as e:
+                logger.error("job_store_claim_failed worker=%s error=%r", self.worker_id, str(e))
+                claimed = None
+                time.sleep(1)
+            if claimed is None:
+                self._slots.release()
+                continue
+            self._start(*claimed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            active = len(self._claimed)
+        return {"worker_id": self.worker_id, "capacity": self.capacity, "active": active, "claims": self.claims}
+
+def run_worker():
+    """Entry point of ``python main.py worker``."""
+    global store_worker
+    if job_store is None:
+        raise SystemExit("worker mode requires JOB_STORE (sqlite:///path or redis://host:port/db)")
+    capacity = int(os.environ.get('WORKER_CAPACITY', os.environ.get('DOWNLOAD_WORKERS', '4')))
+    store_worker = StoreWorker(job_store, capacity)
+    store_worker.run()
+
+def apply_store_change(job_id: str, job: Optional[dict], progress: Optional[dict]):
+    """Mirror a job published by a worker into this API process."""
+    with jobs_lock:
+        owner = download_owners.get(job_id)
+        if owner is not None:
+            # 下载已由合并的请求接管：工作进程上报的状态转给接管者
+            if job is not None and owner in jobs:
+                jobs[owner].update({field: job[field] for field in ("status", "video_info", "error_message") if field in job})
+            job_id, job = owner, None
+        if job is not None:
+            local = jobs.get(job_id)
+            jobs[job_id] = {**local, **job} if local is not None else job
+        if download_progress.get(job_id) is None:
+            primary_id = (job or {}).get("coalesced_with")
+            primary_record = download_progress.get(primary_id) if primary_id else None
+            if primary_record is not None:
+                download_progress.attach(job_id, primary_record)
+            else:
+                download_progress.create(job_id)
+    if progress is not None:
+        # 经本地注册表转发，SSE / WebSocket 订阅者照常收到推送
+        download_progress.update(job_id, progress)
+        if progress.get("download_status") in TERMINAL_STATUSES:
+            release_inflight(job_id)
+
+def mirror_from_store(job_id: str) -> bool:
+    """Copy a job from the shared store into this process; False if the store does not know it."""
+    entry = job_store.get(job_id)
+    if entry is None:
+        return False
+    apply_store_change(job_id, *entry)
+    return True
+
+async def ensure_local_job(job_id: str):
+    """Fetch a job this API process has not seen yet straight from the job store.
+
+    The change feed reaches an API process only after a poll interval, so
+    a request right after POST /download that lands on another process
+    would otherwise get a 404.
+    """
+    if not remote_workers():
+        return
+    with jobs_lock:
+        known = job_id in jobs and download_progress.get(job_id) is not None
+    if not known:
+        await asyncio.get_running_loop().run_in_executor(None, mirror_from_store, job_id)
+
+def reject_in_remote_mode(setting: str):
+    """Runtime settings only reach this process; with worker processes they are set per worker."""
+    if remote_workers():
+        raise HTTPException(
+            status_code=409,
+            detail=f"Downloads run in worker processes; configure {setting} on the workers with environment variables"
+        )
+
+def follow_job_store():
+    """Apply the store's change feed to this process until it exits."""
+    cursor = None
+    last_prune = time.monotonic()
+    while True:
+        try:
+            cursor, changes = job_store.changes(cursor, timeout=1.0)
+            for job_id, job, progress in changes:
+                apply_store_change(job_id, job, progress)
+            if time.monotonic() - last_prune >= 60:
+                last_prune = time.monotonic()
+                job_store.prune(time.time() - download_progress.terminal_ttl)
+        except Exception as e:
+            logger.error("job_store_follow_failed error=%r", str(e))
+            time.sleep(1)
+
+@app.on_event("startup")
+async def start_job_store_follower():
+    if remote_workers():
+        # 从头回放变更流，重启后的 API 进程也能查询到尚未过期的任务
+        threading.Thread(target=follow_job_store, daemon=True).start()
+
+class SchedulerConfig(BaseModel):
+    workers: Optional[int] = None
+    adaptive: Optional[bool] = None  # 为空时：指定 workers 即固定线程数并关闭自适应并发
+
+    @validator('workers')
+    def validate_workers(cls, v):
+        if v is not None and not 1 <= v <= 64:
+            raise ValueError('workers must be between 1 and 64')
+        return v
+
+class BandwidthConfig(BaseModel):
+    global_limit_kbps: Optional[int] = None  # 为空表示不限制
+    job_limit_kbps: Optional[int] = None
+
+    @validator('global_limit_kbps', 'job_limit_kbps')
+    def validate_limit(cls, v):
+        if v is not None and v <= 0:
+            raise ValueError('limits must be positive KiB/s values or null')
+        return v
+
+class JobBandwidthConfig(BaseModel):
+    limit_kbps: Optional[int] = None
+
+    @validator('limit_kbps')
+    def validate_limit(cls, v):
+        if v is not None and v <= 0:
+            raise ValueError('limit_kbps must be a positive KiB/s value or null')
+        return v
+
+@app.get("/bandwidth")
+async def get_bandwidth():
+    return bandwidth_governor.stats()
+
+@app.put("/bandwidth")
+async def update_bandwidth(config: BandwidthConfig):
+    reject_in_remote_mode("BANDWIDTH_LIMIT_KBPS / JOB_BANDWIDTH_LIMIT_KBPS")
+    bandwidth_governor.set_limits(
+        config.global_limit_kbps * 1024 if config.global_limit_kbps else None,
+        config.job_limit_kbps * 1024 if config.job_limit_kbps else None
+    )
+    return bandwidth_governor.stats()
+
+@app.put("/jobs/{job_id}/bandwidth")
+async def update_job_bandwidth(job_id: str, config: JobBandwidthConfig):
+    reject_in_remote_mode("JOB_BANDWIDTH_LIMIT_KBPS")
+    if download_progress.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    bandwidth_governor.set_job_limit(job_id, config.limit_kbps * 1024 if config.limit_kbps else None)
+    return {"job_id": job_id, "limit_kbps": config.limit_kbps}
+
+@app.get("/scheduler")
+async def get_scheduler():
+    return {**download_scheduler.stats(), "adaptive": concurrency_controller.enabled}
+
+@app.put("/scheduler")
+async def update_scheduler(config: SchedulerConfig):
+    if config.workers is None and config.adaptive is None:
+        raise HTTPException(status_code=422, detail="Provide workers and/or adaptive")
+    reject_in_remote_mode("WORKER_CAPACITY / ADAPTIVE_CONCURRENCY")
+    adaptive = config.adaptive if config.adaptive is not None else False
+    if not adaptive:
+        concurrency_controller.stop()
+    if config.workers is not None:
+        if adaptive:
+            # 自适应并发保持开启：新线程数限制在上下限之内，并作为下一个窗口的起点
+            concurrency_controller.set_workers(config.workers)
+        else:
+            download_scheduler.set_workers(config.workers)
+    if adaptive:
+        # 重新开启时以当前（或新指定的）线程数为起点
+        concurrency_controller.start()
+    return {**download_scheduler.stats(), "adaptive": concurrency_controller.enabled}
+
+# 播放列表 / 频道链接
+YOUTUBE_PLAYLIST_PATTERNS = [
+    re.compile(r'^https?://(?:www\.)?youtube\.com/playlist\?list=([\w-]+)'),
+    re.compile(r'^https?://(?:www\.)?youtube\.com/watch\?.*?\blist=([\w-]+)'),
+]
+YOUTUBE_CHANNEL_PATTERN = re.compile(
+    r'^https?://(?:www\.)?youtube\.com/(@[\w.-]+|channel/[\w-]+|c/[\w-]+|user/[\w-]+)(?:/(videos|shorts|streams))?/?$'
+)
+
+def normalize_batch_url(url: str) -> Optional[str]:
+    """Canonical playlist / channel-tab URL, or None if url is neither."""
+    for pattern in YOUTUBE_PLAYLIST_PATTERNS:
+        match = pattern.match(url)
+        if match:
+            return f"https://www.youtube.com/playlist?list={match.group(1)}"
+    match = YOUTUBE_CHANNEL_PATTERN.match(url)
+    if match:
+        # 频道首页默认展开为“视频”标签页
+        return f"https://www.youtube.com/{match.group(1)}/{match.group(2) or 'videos'}"
+    return None
+
+class BatchURL(VideoURL):
+    concurrency: int = 4  # 同一批次同时进行的下载数
+    max_items: int = 0  # 最多下载的条目数，0 表示不限制
+    skip_existing: bool = True  # 跳过下载库中已存在的视频
+
+    @validator('url')
+    def validate_youtube_url(cls, v):
+        normalized = normalize_batch_url(v)
+        if normalized is None:
+            raise ValueError('Invalid YouTube playlist or channel URL')
+        return normalized
+
+    @validator('concurrency')
+    def validate_concurrency(cls, v):
+        if not 1 <= v <= 16:
+            raise ValueError('concurrency must be between 1 and 16')
+        return v
+
+    @validator('max_items')
+    def validate_max_items(cls, v):
+        if v < 0:
+            raise ValueError('max_items must not be negative')
+        return v
+
+def list_batch_entries(url: str, max_items: int = 0) -> list:
+    """List playlist/channel videos with a cheap flat extraction."""
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',  # 只获取条目列表，不解析每个视频
+    }
+    if max_items:
+        ydl_opts['playlistend'] = max_items
+
+    with ydl_pool.ydl(ydl_opts) as ydl:
+        record_extraction()
+        info = ydl.extract_info(url, download=False)
+    if not info:
+        raise ValueError("Could not extract playlist information")
+
+    entries = []
+    seen = set()
+    for entry in info.get('entries') or []:
+        video_id = (entry or {}).get('id')
+        # 跳过嵌套的播放列表 / 标签页以及重复条目
+        if not video_id or video_id in seen or entry.get('ie_key') not in (None, 'Youtube'):
+            continue
+        seen.add(video_id)
+        entries.append({
+            "video_id": video_id,
+            "title": entry.get('title') or video_id,
+            "url": f"https://www.youtube.com/watch?v={video_id}"
+        })
+    return entries
+
+class DownloadBatch:
+    """A playlist/channel download fanned out into individual jobs.
+
+    ``run`` lists the entries, skips videos already in the download store
+    and submits the rest through ``submit_job`` while keeping at most
+    ``concurrency`` of them unfinished at any time.
+    """
+
+    def __init__(self, batch_id: str, request: BatchURL, client: str):
+        self.batch_id = batch_id
+        self.request = request
+        self.client = client
+        self.status = "listing"
+        self.error_message = None
+        self.title = None
+        self.items = []
+        self._cond = threading.Condition()
+
+    def _notify(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _item_status(self, item: dict) -> str:
+        if item["job_id"] is None:
+            return item["status"]
+        progress = download_progress.snapshot(item["job_id"])
+        if progress is not None:
+            item["status"] = progress.get("download_status", item["status"])
+            item["download_progress"] = progress.get("download_progress", 0)
+        return item["status"]
+
+    def _active_count(self) -> int:
+        return sum(
+            1 for item in self.items
+            if item["job_id"] is not None and self._item_status(item) not in TERMINAL_STATUSES
+        )
+
+    def run(self):
+        request = self.request
+        try:
+            entries = list_batch_entries(request.url, request.max_items)
+        except Exception as e:
+            logger.warning("batch_list_failed batch_id=%s error=%r", self.batch_id, str(e))
+            self.status = "error"
+            self.error_message = str(e)
+            return
+
+        format_spec = compile_format_selector(request.format, request.quality).spec
+        postprocessors = build_postprocessors(request.format)
+        for entry in entries:
+            skipped = request.skip_existing and download_store.contains(
+                DownloadStore.make_key(entry["video_id"], format_spec, postprocessors)
+            )
+            self.items.append({
+                **entry,
+                "status": "skipped" if skipped else "pending",
+                "download_progress": 100 if skipped else 0,
+                "job_id": None
+            })
+        self.status = "running"
+
+        for item in self.items:
+            if item["status"] != "pending":
+                continue
+            # 控制同一批次同时进行的任务数
+            with self._cond:
+                while self._active_count() >= request.concurrency:
+                    self._cond.wait(timeout=5)
+            video_url = VideoURL(
+                url=item["url"],
+                format=request.format,
+                quality=request.quality,
+                save_path=request.save_path,
+                rate_limit=request.rate_limit,
+                download_mode=request.download_mode,
+                fragment_concurrency=request.fragment_concurrency
+            )
+            item["job_id"] = submit_job(video_url, self.client)["job_id"]
+            item["status"] = "submitted"
+            record = download_progress.get(item["job_id"])
+            if record is not None:
+                download_progress.add_listener(record, self._notify)
+
+    def to_dict(self) -> dict:
+        counts: Dict[str, int] = {}
+        total_progress = 0.0
+        items = []
+        for item in self.items:
+            status = self._item_status(item)
+            counts[status] = counts.get(status, 0) + 1
+            total_progress += item["download_progress"] if status not in ("error", "cancelled") else 100
+            items.append({k: item[k] for k in ("video_id", "title", "status", "download_progress", "job_id")})
+
+        status = self.status
+        if status == "running" and all(
+            item["status"] in TERMINAL_STATUSES or item["status"] == "skipped" for item in self.items
+        ):
+            status = "completed"
+        return {
+            "batch_id": self.batch_id,
+            "url": self.request.url,
+            "status": status,
+            "error_message": self.error_message,
+            "total": len(self.items),
+            "counts": counts,
+            "batch_progress": round(total_progress / len(self.items), 2) if self.items else 0,
+            "items": items
+        }
+
+# 最近的批量任务（超过上限时丢弃最早的批次）
+MAX_BATCHES = 100
+batches: "OrderedDict[str, DownloadBatch]" = OrderedDict()
+
+@app.post("/batch", status_code=202)
+async def create_batch(batch_url: BatchURL, request: Request):
+    batch_id = uuid.uuid4().hex
+    batch = DownloadBatch(batch_id, batch_url, get_client_id(request))
+    with jobs_lock:
+        batches[batch_id] = batch
+        while len(batches) > MAX_BATCHES:
+            batches.popitem(last=False)
+    # 批次在独立线程中逐步提交，避免长时间占用提取线程池
+    threading.Thread(target=batch.run, daemon=True).start()
+    return {
+        "batch_id": batch_id,
+        "status": batch.status,
+        "batch_url": f"/batch/{batch_id}"
+    }
+
+@app.get("/batch/{batch_id}")
+async def get_batch(batch_id: str):
+    with jobs_lock:
+        batch = batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch.to_dict()
+
+# 直通流：每次读取的块大小决定了每个流占用的内存上限
+STREAM_READ_SIZE = 64 * 1024
+STREAM_MEDIA_TYPES = {'mp4': 'video/mp4', 'webm': 'video/webm', 'm4a': 'audio/mp4', 'mp3': 'audio/mpeg'}
+STREAM_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+# 正在进行的直通流数量
+active_streams = 0
+active_streams_lock = threading.Lock()
+
+class RangeNotSatisfiable(Exception):
+    def __init__(self, size: Optional[int]):
+        self.size = size
+
+def parse_range(header: Optional[str]) -> Optional[tuple]:
+    """(start, end) from a single-range ``Range`` header; start is None for a suffix range.
+
+    Anything else (missing, malformed, multiple ranges) yields None and the
+    whole file is served, which RFC 9110 allows.
+    """
+    match = STREAM_RANGE_RE.match(header.strip()) if header else None
+    if match is None or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        return None, int(end)
+    if end and int(end) < int(start):
+        return None
+    return int(start), int(end) if end else None
+
+def stream_chunks(job_id: str, read, close):
+    """Yield up to STREAM_READ_SIZE bytes at a time from ``read``, charged to the bandwidth governor.
+
+    StreamingResponse only pulls the next chunk after the previous one was
+    sent, so a slow client stalls the upstream read instead of buffering.
+    """
+    global active_streams
+    with active_streams_lock:
+        active_streams += 1
+    try:
+        while True:
+            chunk = read(STREAM_READ_SIZE)
+            if not chunk:
+                break
+            bandwidth_governor.consume(job_id, len(chunk))
+            METRICS["stream_bytes"].inc(len(chunk))
+            yield chunk
+    finally:
+        close()
+        bandwidth_governor.release(job_id)
+        with active_streams_lock:
+            active_streams -= 1
+
+def open_passthrough(job_id: str, fmt: dict, byte_range: Optional[tuple]) -> tuple:
+    """Proxy a single-file format with ranged upstream requests.
+
+    Upstream is read in ``HTTP_CHUNK_SIZE`` ranges (as yt-dlp does for
+    throttled hosts) and the client's ``Range`` is mapped onto them.
+    Returns ``(status, headers, iterator)``.
+    """
+    resources = contextlib.ExitStack()
+    ydl = resources.enter_context(ydl_pool.ydl({'quiet': True, 'no_warnings': True}))
+    http_headers = dict(fmt.get('http_headers') or {})
+
+    def request(first, last):
+        spec = f"bytes=-{last}" if first is None else f"bytes={first}-{'' if last is None else last}"
+        return ydl.urlopen(yt_dlp.networking.Request(fmt['url'], headers={**http_headers, 'Range': spec}))
+
+    start, end = byte_range or (0, None)
+    if start is not None:
+        first_end = start + HTTP_CHUNK_SIZE - 1
+        response_end = min(end, first_end) if end is not None else first_end
+    else:
+        response_end = end  # 后缀范围原样转发，由上游换算为绝对位置
+    try:
+        response = request(start, response_end)
+    except Exception as e:
+        resources.close()
+        if not isinstance(e, yt_dlp.networking.exceptions.HTTPError):
+            raise
+        if e.status == 416:
+            size = re.match(r'bytes \*/(\d+)', e.response.headers.get('Content-Range', ''))
+            raise RangeNotSatisfiable(int(size.group(1)) if size else fmt.get('filesize'))
+        raise
+
+    content_range = CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+    if response.status != 206 or content_range is None:
+        # 上游忽略了 Range，按完整文件返回 200
+        headers = {'Accept-Ranges': 'bytes'}
+        if response.headers.get('Content-Length'):
+            headers['Content-Length'] = response.headers['Content-Length']
+        return 200, headers, stream_chunks(job_id, response.read, lambda: (response.close(), resources.close()))
+
+    first, size = int(content_range.group(1)), content_range.group(3)
+    size = int(size) if size != '*' else fmt.get('filesize')
+    last = end if end is not None and start is not None else (size - 1 if size else None)
+    if size and last is not None:
+        last = min(last, size - 1)
+    state = {'response': response, 'position': first}
+
+    def read(amount: int) -> bytes:
+        while True:
+            chunk = state['response'].read(amount)
+            if chunk:
+                state['position'] += len(chunk)
+                return chunk
+            state['response'].close()
+            if last is None or state['position'] > last:
+                return b''
+            # 当前分块读完，继续请求下一段
+            position = state['position']
+            state['response'] = request(position, min(last, position + HTTP_CHUNK_SIZE - 1))
+
+    headers = {'Accept-Ranges': 'bytes'}
+    if last is not None:
+        headers['Content-Length'] = str(last - first + 1)
+    status = 200
+    if byte_range is not None:
+        status = 206
+        headers['Content-Range'] = f"bytes {first}-{last}/{size or '*'}"
+    return status, headers, stream_chunks(job_id, read, lambda: (state['response'].close(), resources.close()))
+
+# WebM 只能容纳这些音频编码，其他音频（如 AAC）需要转码为 Opus
+WEBM_AUDIO_CODECS = ('opus', 'vorbis')
+# 保留 FFmpeg stderr 的最后这么多行，用于错误信息和日志
+FFMPEG_STDERR_LINES = 20
+
+def open_ffmpeg_stream(job_id: str, inputs: list, format: str) -> tuple:
+    """Remux (or transcode to mp3) the selected formats through FFmpeg to a pipe.
+
+    The output is fragmented so it can be written without seeking; its
+    length is unknown up front, so ranges are not supported. The first
+    chunk is read before returning, so an FFmpeg that exits without output
+    (bad input, unsupported codec) raises here and becomes a 502 instead
+    of an empty 200.
+    """
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise RuntimeError("FFmpeg is required to stream this format")
+    command = [ffmpeg, '-nostdin', '-loglevel', 'error']
+    for fmt in inputs:
+        http_headers = ''.join(f"{key}: {value}\r\n" for key, value in (fmt.get('http_headers') or {}).items())
+        if http_headers:
+            command += ['-headers', http_headers]
+        command += ['-i', fmt['url']]
+    if format == 'mp3':
+        command += ['-vn', '-c:a', 'libmp3lame', '-b:a', '192k', '-f', 'mp3']
+    else:
+        if len(inputs) > 1:
+            command += ['-map', '0:v:0', '-map', '1:a:0']
+        command += ['-c', 'copy']
+        audio_codec = (inputs[-1].get('acodec') or '').split('.')[0]
+        if format == 'webm' and audio_codec not in WEBM_AUDIO_CODECS:
+            command += ['-c:a', 'libopus', '-b:a', '160k']
+        command += ['-f', format]
+        if format == 'mp4':
+            command += ['-movflags', 'frag_keyframe+empty_moov+default_base_moof']
+    command.append('pipe:1')
+    # 管道缓冲区写满时 FFmpeg 自然阻塞，客户端读多快就转多快
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # 单独的线程读取 stderr，避免管道写满阻塞 FFmpeg
+    stderr = deque(maxlen=FFMPEG_STDERR_LINES)
+    stderr_reader = threading.Thread(
+        target=lambda: stderr.extend(line.decode(errors='replace').rstrip() for line in process.stderr), daemon=True
+    )
+    stderr_reader.start()
+
+    def error_output() -> str:
+        stderr_reader.join(timeout=1)
+        return ' | '.join(stderr)
+
+    first = process.stdout.read(STREAM_READ_SIZE)
+    if not first:
+        process.stdout.close()
+        returncode = process.wait()
+        raise RuntimeError(f"FFmpeg exited with code {returncode} before producing output: {error_output()}")
+    state = {'pending': first, 'eof': False}
+
+    def read(amount: int) -> bytes:
+        chunk, state['pending'] = state['pending'] or process.stdout.read(amount), None
+        state['eof'] = not chunk
+        return chunk
+
+    def close():
+        process.stdout.close()
+        if not state['eof'] and process.poll() is None:
+            # 客户端提前断开，FFmpeg 仍在运行
+            process.kill()
+            process.wait()
+            return
+        returncode = process.wait()
+        if returncode != 0:
+            # 响应头已经发出，只能记录日志；客户端收到的是截断的文件
+            logger.warning("stream_ffmpeg_failed stream_id=%s returncode=%d stderr=%r", job_id, returncode, error_output())
+
+    return 200, {'Accept-Ranges': 'none'}, stream_chunks(job_id, read, close)
+
+def open_stream(job_id: str, video_url: VideoURL, range_header: Optional[str]) -> tuple:
+    """Pick passthrough or FFmpeg for a request; returns (status, headers, iterator, media type)."""
+    info, best, spec = extract_video_info(video_url.url, video_url.format, video_url.quality)
+    formats = {f.get('format_id'): f for f in info.get('formats', [])}
+    inputs = [formats.get(format_id, best) for format_id in spec.split('+')]
+    title = get_safe_filename(info.get('title', 'video')) or 'video'
+    muxed = len(inputs) == 1 and best.get('vcodec') != 'none' and best.get('acodec') != 'none'
+    if video_url.format != 'mp3' and muxed and best.get('protocol', 'https') in ('http', 'https'):
+        ext = best.get('ext') or video_url.format
+        status, headers, chunks = open_passthrough(job_id, best, parse_range(range_header))
+    else:
+        ext = video_url.format
+        status, headers, chunks = open_ffmpeg_stream(job_id, inputs, video_url.format)
+    headers['Content-Disposition'] = f"inline; filename*=UTF-8''{urllib.parse.quote(f'{title}.{ext}')}"
+    logger.info("stream_started stream_id=%s format=%s status=%d", job_id, spec, status)
+    return status, headers, chunks, STREAM_MEDIA_TYPES.get(ext, 'application/octet-stream')
+
+@app.get("/stream/{video_id}")
+async def stream_video(video_id: str, request: Request, format: str = "mp4", quality: str = "1080p"):
+    """Send the selected format straight to the client without writing it to disk."""
+    try:
+        video_url = VideoURL(url=f"https://www.youtube.com/watch?v={video_id}", format=format, quality=quality)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if video_url.format == '3gp':
+        raise HTTPException(status_code=400, detail="3gp needs transcoding and cannot be streamed; use /download")
+
+    # 直通流与下载任务一样受全局带宽限制
+    stream_id = f"stream-{uuid.uuid4().hex}"
+    loop = asyncio.get_running_loop()
+    try:
+        status, headers, chunks, media_type = await loop.run_in_executor(
+            extract_pool, open_stream, stream_id, video_url, request.headers.get('range')
+        )
+    except RangeNotSatisfiable as e:
+        return Response(status_code=416, headers={'Content-Range': f"bytes */{e.size or '*'}"})
+    except Exception as e:
+        logger.warning("stream_failed video_id=%s error=%r", video_id, str(e))
+        raise HTTPException(status_code=502, detail=f"Failed to open stream: {str(e)}")
+    return StreamingResponse(chunks, status_code=status, headers=headers, media_type=media_type)
+
+@app.get("/formats")
+def get_available_formats():
+    return {
+        "formats": ["mp4", "webm", "mp3", "3gp"],
+        "qualities": ["360p", "480p", "720p", "1080p", "best"]
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text exposition of hot-path timings and runtime state."""
+    scheduler = download_scheduler.stats()
+    cache = metadata_cache.stats()
+    # 下载库统计需查询 SQLite 索引，放到线程池执行
+    store = await asyncio.get_running_loop().run_in_executor(None, download_store.stats)
+    lines = []
+    for metric in METRICS.values():
+        lines.extend(metric.render())
+    lines += render_metric("ytdl_extractions_total", "yt-dlp metadata extractions", "counter", get_extraction_count())
+    lines += render_metric("ytdl_coalesced_requests_total", "Requests attached to an in-flight job", "counter",
+                           coalesced_requests)
+    lines += render_metric("ytdl_scheduler_workers", "Configured download workers", "gauge", scheduler["workers"])
+    lines += render_metric("ytdl_scheduler_active_workers", "Download workers running a job", "gauge",
+                           scheduler["active"])
+    lines += render_metric("ytdl_scheduler_queue_depth", "Jobs waiting for a download worker", "gauge", [
+        ({"priority": priority}, count) for priority, count in scheduler["queued_by_priority"].items()
+    ])
+    lines += render_metric("ytdl_metadata_cache_requests_total", "Metadata cache lookups", "counter", [
+        ({"result": "hit"}, cache["hits"]),
+        ({"result": "disk_hit"}, cache["disk_hits"]),
+        ({"result": "miss"}, cache["misses"]),
+    ])
+    lines += render_metric("ytdl_metadata_cache_hit_ratio", "Metadata cache hit ratio", "gauge", cache["hit_ratio"])
+    lines += render_metric("ytdl_metadata_cache_entries", "Metadata cache entries in memory", "gauge", cache["entries"])
+    lines += render_metric("ytdl_download_store_requests_total", "Download store lookups", "counter", [
+        ({"result": "hit"}, store["hits"]),
+        ({"result": "miss"}, store["misses"]),
+    ])
+    store_lookups = store["hits"] + store["misses"]
+    lines += render_metric("ytdl_download_store_hit_ratio", "Download store hit ratio", "gauge",
+                           round(store["hits"] / store_lookups, 4) if store_lookups else 0.0)
+    lines += render_metric("ytdl_download_store_bytes", "Bytes held in the download store", "gauge",
+                           store["total_bytes"])
+    lines += render_metric("ytdl_download_store_copy_fallbacks_total",
+                           "Store hits copied because hardlinking was impossible", "counter", store["copy_fallbacks"])
+    lines += render_metric("ytdl_progress_records", "Progress records held in memory", "gauge",
+                           download_progress.stats()["jobs"])
+    lines += render_metric("ytdl_active_streams", "Open /stream responses", "gauge", active_streams)
+    lines += render_metric("ytdl_bandwidth_throttled_seconds_total", "Time downloads slept for bandwidth limits",
+                           "counter", bandwidth_governor.stats()["throttled_seconds"])
+    return "\n".join(lines) + "\n"
+
+@app.get("/stats")
+async def get_stats():
+    loop = asyncio.get_running_loop()
+    store = None
+    if job_store is not None:
+        store = await loop.run_in_executor(None, job_store.stats)
+    download_store_stats = await loop.run_in_executor(None, download_store.stats)
+    return {
+        "extractions": get_extraction_count(),
+        "coalesced_requests": coalesced_requests,
+        "metadata_cache": metadata_cache.stats(),
+        "download_store": download_store_stats,
+        "progress_registry": download_progress.stats(),
+        "scheduler": download_scheduler.stats(),
+        "concurrency": concurrency_controller.stats(),
+        "job_journal": job_journal.stats() if job_journal is not None else None,
+        "bandwidth": bandwidth_governor.stats(),
+        "job_store": store,
+        "ydl_pool": ydl_pool.stats()
+    }
+
+# 推送进度的最大频率（每秒次数），多次变化会合并为一次推送
+PROGRESS_STREAM_MAX_RATE = float(os.environ.get('PROGRESS_STREAM_MAX_RATE', '4'))
+# SSE 无变化时发送心跳的间隔（秒）
+PROGRESS_STREAM_KEEPALIVE = 15
+
+class ProgressSubscription:
+    """Set of jobs watched by one streaming client.
+
+    Worker threads wake the subscription through ``loop.call_soon_threadsafe``
+    whenever a watched record changes; ``next_deltas`` then reports only the
+    fields that differ from what this client was last sent, at most
+    ``max_rate`` times per second.
+    """
+
+    def __init__(self, max_rate: float = PROGRESS_STREAM_MAX_RATE):
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+        self.min_interval = 1 / max_rate if max_rate > 0 else 0
+        self.records: Dict[str, ProgressRecord] = {}
+        self.sent: Dict[str, dict] = {}
+        self.last_push = 0.0
+
+    def _notify(self):
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:
+            # 事件循环已关闭（客户端断开后）
+            pass
+
+    def subscribe(self, job_id: str) -> bool:
+        record = download_progress.get(job_id)
+        if record is None:
+            return False
+        if job_id not in self.records:
+            self.records[job_id] = record
+            self.sent[job_id] = {}
+            download_progress.add_listener(record, self._notify)
+        # 订阅后立即推送一次完整状态
+        self.event.set()
+        return True
+
+    def unsubscribe(self, job_id: str):
+        record = self.records.pop(job_id, None)
+        self.sent.pop(job_id, None)
+        if record is not None:
+            download_progress.remove_listener(record, self._notify)
+
+    def close(self):
+        for job_id in list(self.records):
+            self.unsubscribe(job_id)
+
+    async def next_deltas(self, timeout: float = None) -> list:
+        """Wait for changes and return [(job_id, delta)]; [] on timeout."""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        # 按最大频率合并变化
+        delay = self.last_push + self.min_interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.event.clear()
+        self.last_push = time.monotonic()
+
+        deltas = []
+        for job_id, record in list(self.records.items()):
+            current = record.to_dict()
+            previous = self.sent[job_id]
+            delta = {k: v for k, v in current.items() if previous.get(k) != v}
+            if delta:
+                self.sent[job_id] = current
+                deltas.append((job_id, delta))
+            if current.get("download_status") in TERMINAL_STATUSES:
+                self.unsubscribe(job_id)
+        return deltas
+
+@app.get("/progress/{job_id}/stream")
+async def stream_progress(job_id: str, request: Request):
+    await ensure_local_job(job_id)
+    subscription = ProgressSubscription()
+    if not subscription.subscribe(job_id):
+        raise HTTPException(status_code=404, detail="Download not found")
+
+    async def event_stream():
+        try:
+            while subscription.records:
+                if await request.is_disconnected():
+                    break
+                deltas = await subscription.next_deltas(timeout=PROGRESS_STREAM_KEEPALIVE)
+                if not deltas:
+                    yield ": keep-alive\n\n"
+                for _, delta in deltas:
+                    yield f"event: progress\ndata: {json.dumps(delta, ensure_ascii=False)}\n\n"
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/ws/progress")
+async def progress_websocket(websocket: WebSocket):
+    """Multiplexed progress feed.
+
+    Clients send {"subscribe": [job_id, ...]} or {"unsubscribe": [...]} and
+    receive {"job_id": ..., "delta": {...}} messages for every change.
+    """
+    await websocket.accept()
+    subscription = ProgressSubscription()
+
+    async def receive_commands():
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+            except ValueError:
+                message = None
+            # 格式不对的消息回复错误帧，连接保持不变
+            if not isinstance(message, dict) or not all(
+                isinstance(message.get(key, []), list) and all(isinstance(job_id, str) for job_id in message.get(key, []))
+                for key in ("subscribe", "unsubscribe")
+            ):
+                await websocket.send_json({"error": 'Expected {"subscribe": [job_id, ...]} or {"unsubscribe": [job_id, ...]}'})
+                continue
+            for job_id in message.get("subscribe", []):
+                await ensure_local_job(job_id)
+                if not subscription.subscribe(job_id):
+                    await websocket.send_json({"job_id": job_id, "error": "Download not found"})
+            for job_id in message.get("unsubscribe", []):
+                subscription.unsubscribe(job_id)
+
+    receiver = asyncio.create_task(receive_commands())
+    deltas_task = None
+    try:
+        while True:
+            # 同时等待客户端消息和进度变化，断开连接时立即结束，不必等到心跳超时
+            deltas_task = asyncio.create_task(subscription.next_deltas(timeout=PROGRESS_STREAM_KEEPALIVE))
+            done, _ = await asyncio.wait({receiver, deltas_task}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                receiver.result()  # 客户端断开时抛出 WebSocketDisconnect
+                break
+            for job_id, delta in deltas_task.result():
+                await websocket.send_json({"job_id": job_id, "delta": delta})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        if deltas_task is not None:
+            deltas_task.cancel()
+        subscription.close()
+
+@app.get("/progress/{job_id}")
+async def get_progress(job_id: str):
+    await ensure_local_job(job_id)
+    progress = download_progress.snapshot(job_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Download not found")
+    return progress
+
+def pick_directory() -> str:
+    """Show a native folder dialog and block until the user closes it."""
+    if os.name == 'nt':  # Windows
+        # 使用 PowerShell 打开文件夹选择对话框
+        command = '''
+        Add-Type -AssemblyName System.Windows.Forms
+        $folderBrowser = New-Object System.Windows.Forms.FolderBrowserDialog
+        $folderBrowser.Description = "选择保存目录"
+        $folderBrowser.ShowNewFolderButton = $true
+        if ($folderBrowser.ShowDialog() -eq [System.Windows.Forms.DialogResult]::OK) {
+            $folderBrowser.SelectedPath
+        }
+        '''
+        result = subprocess.run(["powershell", "-Command", command], capture_output=True, text=True)
+        return result.stdout.strip()
+    # 其他系统使用 tkinter，仅在此处导入
+    import tkinter as tk
+    from tkinter import filedialog
+    root = tk.Tk()
+    root.withdraw()  # 隐藏主窗口
+    try:
+        return filedialog.askdirectory() or ""
+    finally:
+        root.destroy()
+
+# 对话框同一时间只开一个；tkinter 要求在创建它的线程内使用，单线程池保证这一点
+directory_picker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="directory-picker")
+
+@app.get("/select_directory")
+async def select_directory():
+    if HEADLESS:
+        raise HTTPException(status_code=501, detail="Directory picker is disabled in headless mode")
+    try:
+        # 对话框会阻塞到用户关闭为止，放到独立线程，事件循环照常处理其他请求
+        loop = asyncio.get_running_loop()
+        directory = await loop.run_in_executor(directory_picker, pick_directory)
+        return {"path": directory}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to open directory picker: {str(e)}")
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    if sys.argv[1:2] == ["worker"]:
+        run_worker()
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""Shared fixtures: an isolated backend, a local media server and a stub extractor.
+
+The environment is set before ``main`` is imported, so the download store,
+job journal and downloads live in a temporary directory and never touch
+the user's real data.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+WORKDIR = tempfile.mkdtemp(prefix='ytdl_tests_')
+os.environ.update({
+    'HEADLESS': '1',
+    'LOG_LEVEL': 'WARNING',
+    'DOWNLOAD_STORE_DIR': os.path.join(WORKDIR, 'store'),
+    'JOB_JOURNAL_DB': os.path.join(WORKDIR, 'jobs.sqlite3'),
+    'METADATA_CACHE_DB': '',
+    'ADAPTIVE_CONCURRENCY': '0',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+MEDIA_SIZE = 256 * 1024
+PAYLOAD = os.urandom(MEDIA_SIZE)
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """Serves every path as PAYLOAD.
+
+    /forbidden/... answers 403 and /slow/... trickles the body out over
+    about two seconds.
+    """
+
+    def do_GET(self, body=True):
+        if self.path.startswith('/forbidden/'):
+            self.send_error(403)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(len(PAYLOAD)))
+        self.end_headers()
+        if not body:
+            return
+        if self.path.startswith('/slow/'):
+            chunk = len(PAYLOAD) // 20
+            for offset in range(0, len(PAYLOAD), chunk):
+                self.wfile.write(PAYLOAD[offset:offset + chunk])
+                self.wfile.flush()
+                time.sleep(0.1)
+        else:
+            self.wfile.write(PAYLOAD)
+
+    def do_HEAD(self):
+        self.do_GET(body=False)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='session')
+def media_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MediaHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+
+def make_info(video_id: str, media_url: str) -> dict:
+    return {
+        'id': video_id,
+        'title': f'test {video_id}',
+        'extractor': 'youtube',
+        'extractor_key': 'Youtube',
+        'webpage_url': f'https://www.youtube.com/watch?v={video_id}',
+        'duration': 30,
+        'formats': [{
+            'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2',
+            'height': 360, 'tbr': 500, 'protocol': 'http', 'url': f'{media_url}/{video_id}.mp4',
+        }],
+    }
+
+
+@pytest.fixture
+def extractor(monkeypatch, media_url):
+    """Replace yt-dlp's network extraction; ``extractor.calls`` lists the URLs extracted.
+
+    Set ``extractor.base_url`` to point the extracted formats elsewhere.
+    """
+    class Extractor:
+        calls = []
+        base_url = media_url
+
+    def extract_info(self, url, download=True, *args, **kwargs):
+        Extractor.calls.append(url)
+        info = make_info(main.extract_video_id(url), Extractor.base_url)
+        return self.process_ie_result(info, download=download)
+
+    monkeypatch.setattr(main.yt_dlp.YoutubeDL, 'extract_info', extract_info)
+    Extractor.calls = []
+    return Extractor
+
+
+@pytest.fixture
+def video_id():
+    """A video ID no other test uses, so caches and the download store start cold."""
+    return uuid.uuid4().hex[:11]
+
+
+def wait_for_status(job_id: str, statuses=main.TERMINAL_STATUSES, timeout: float = 20.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        progress = main.download_progress.snapshot(job_id) or {}
+        if progress.get('download_status') in statuses:
+            return progress
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not reach {statuses}: {main.download_progress.snapshot(job_id)}")
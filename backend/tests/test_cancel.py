@@ -0,0 +1,149 @@
+"""DELETE /jobs/{id} across the pipeline stages."""
+import threading
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+import main
+from conftest import wait_for_status
+
+client = TestClient(main.app)
+
+
+def submit(video_id: str, save_path, fmt: str = 'mp4') -> str:
+    response = client.post('/download', json={
+        'url': f'https://www.youtube.com/watch?v={video_id}',
+        'format': fmt,
+        'quality': 'best',
+        'save_path': str(save_path),
+    })
+    assert response.status_code == 202, response.text
+    return response.json()['job_id']
+
+
+def test_cancel_while_transcoding(extractor, video_id, tmp_path, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def slow_postprocessors(source_path: Path, postprocessors: list) -> Path:
+        started.set()
+        release.wait(10)
+        output = source_path.with_suffix('.mp3')
+        output.write_bytes(b'audio')
+        return output
+
+    monkeypatch.setattr(main, 'run_postprocessors', slow_postprocessors)
+    job_id = submit(video_id, tmp_path, fmt='mp3')
+    assert started.wait(10)
+
+    response = client.delete(f'/jobs/{job_id}')
+    assert response.status_code == 200, response.text
+    assert response.json()['cancelled_while'] == 'transcoding'
+    release.set()
+
+    assert wait_for_status(job_id)['download_status'] == 'cancelled'
+    main.transcode_pool.submit(lambda: None).result(10)
+    assert main.download_progress.snapshot(job_id)['download_status'] == 'cancelled'
+    assert list(tmp_path.iterdir()) == []
+    with main.jobs_lock:
+        assert job_id not in main.transcoding_jobs
+
+    # 被取消的转码结果不会进入下载库，下一次请求重新下载
+    again = submit(video_id, tmp_path / 'again', fmt='mp3')
+    progress = wait_for_status(again)
+    assert progress['download_status'] == 'completed'
+    assert not progress.get('from_store')
+
+
+
+def test_cancel_finished_job_conflicts(extractor, video_id, tmp_path):
+    job_id = submit(video_id, tmp_path)
+    assert wait_for_status(job_id)['download_status'] == 'completed'
+
+    assert client.delete(f'/jobs/{job_id}').status_code == 409
+
+
+def test_cancel_failed_job_conflicts(extractor, video_id, tmp_path):
+    extractor.base_url += '/forbidden'
+    job_id = submit(video_id, tmp_path)
+    assert wait_for_status(job_id)['download_status'] == 'error'
+
+    response = client.delete(f'/jobs/{job_id}')
+    assert response.status_code == 409
+    assert response.json()['detail'] == 'Job already error'
+
+
+def test_cancel_twice_conflicts(extractor, video_id, tmp_path, monkeypatch):
+    monkeypatch.setattr(main.download_scheduler, 'cancel', lambda job_id: 'queued')
+    job_id = submit(video_id, tmp_path)
+
+    assert client.delete(f'/jobs/{job_id}').status_code == 200
+    assert client.delete(f'/jobs/{job_id}').status_code == 409
+
+
+def test_cancel_during_store_lookup(extractor, video_id, tmp_path, monkeypatch):
+    first = submit(video_id, tmp_path / 'first')
+    assert wait_for_status(first)['download_status'] == 'completed'
+
+    looking_up, release, served = threading.Event(), threading.Event(), threading.Event()
+    lookup, complete_from_store = main.download_store.lookup, main.complete_from_store
+
+    def slow_lookup(key):
+        looking_up.set()
+        release.wait(10)
+        return lookup(key)
+
+    def record_served(*args):
+        try:
+            return complete_from_store(*args)
+        finally:
+            served.set()
+
+    monkeypatch.setattr(main.download_store, 'lookup', slow_lookup)
+    monkeypatch.setattr(main, 'complete_from_store', record_served)
+    job_id = submit(video_id, tmp_path / 'second')
+    assert looking_up.wait(10)
+    response = client.delete(f'/jobs/{job_id}')
+    assert response.status_code == 200, response.text
+    release.set()
+
+    assert served.wait(10)
+    assert client.get(f'/progress/{job_id}').json()['download_status'] == 'cancelled'
+    assert not (tmp_path / 'second').exists() or not any((tmp_path / 'second').iterdir())
+
+
+def test_cancelled_record_never_completes():
+    registry = main.ProgressRegistry()
+    registry.create('job')
+    registry.update('job', {'download_status': 'cancelled'})
+
+    assert registry.update('job', {'download_status': 'completed', 'download_progress': 100}) is False
+    assert registry.snapshot('job')['download_status'] == 'cancelled'
+
+
+def test_cancel_during_extraction_leaves_journal(extractor, video_id, tmp_path, monkeypatch):
+    extracting, release, prepared = threading.Event(), threading.Event(), threading.Event()
+    extract_video_info, prepare_download = main.extract_video_info, main.prepare_download
+
+    def slow_extract(*args):
+        extracting.set()
+        release.wait(10)
+        return extract_video_info(*args)
+
+    def record_prepared(*args):
+        try:
+            return prepare_download(*args)
+        finally:
+            prepared.set()
+
+    monkeypatch.setattr(main, 'extract_video_info', slow_extract)
+    monkeypatch.setattr(main, 'prepare_download', record_prepared)
+    job_id = submit(video_id, tmp_path)
+    assert extracting.wait(10)
+    assert client.delete(f'/jobs/{job_id}').json()['cancelled_while'] == 'extracting'
+    main.job_journal.flush()
+    release.set()
+
+    assert prepared.wait(10)
+    main.job_journal.flush()
+    rows = main.job_journal._db.execute("SELECT job_id FROM jobs WHERE job_id = ?", (job_id,)).fetchall()
+    assert rows == []
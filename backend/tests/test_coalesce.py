@@ -0,0 +1,63 @@
+"""Cancelling one of several coalesced requests for the same download."""
+from fastapi.testclient import TestClient
+
+import main
+from conftest import wait_for_status
+
+client = TestClient(main.app)
+
+
+def submit(video_id: str, save_path) -> dict:
+    response = client.post('/download', json={
+        'url': f'https://www.youtube.com/watch?v={video_id}',
+        'format': 'mp4',
+        'quality': 'best',
+        'save_path': str(save_path),
+    })
+    assert response.status_code == 202, response.text
+    return response.json()
+
+
+def submit_coalesced(extractor, video_id, save_path, count: int) -> list:
+    extractor.base_url += '/slow'
+    primary = submit(video_id, save_path)
+    followers = [submit(video_id, save_path) for _ in range(count - 1)]
+    assert all(follower['coalesced_with'] == primary['job_id'] for follower in followers)
+    wait_for_status(primary['job_id'], statuses=('downloading',))
+    return [primary['job_id']] + [follower['job_id'] for follower in followers]
+
+
+def test_cancel_follower_leaves_primary_running(extractor, video_id, tmp_path):
+    primary, follower = submit_coalesced(extractor, video_id, tmp_path, 2)
+
+    assert client.delete(f'/jobs/{follower}').status_code == 200
+    assert client.get(f'/jobs/{follower}').status_code == 404
+    assert wait_for_status(primary)['download_status'] == 'completed'
+
+
+def test_cancel_primary_promotes_follower(extractor, video_id, tmp_path):
+    primary, heir, other = submit_coalesced(extractor, video_id, tmp_path, 3)
+
+    response = client.delete(f'/jobs/{primary}')
+    assert response.status_code == 200
+    assert response.json()['promoted_to'] == heir
+    assert client.get(f'/jobs/{primary}').status_code == 404
+
+    assert wait_for_status(heir)['download_status'] == 'completed'
+    assert wait_for_status(other)['download_status'] == 'completed'
+    job = client.get(f'/jobs/{heir}').json()
+    assert job['coalesced_with'] is None
+    assert job['video_info']['job_id'] == heir
+    assert client.get(f'/jobs/{other}').json()['coalesced_with'] == heir
+
+
+def test_cancel_promoted_follower_stops_download(extractor, video_id, tmp_path):
+    primary, heir = submit_coalesced(extractor, video_id, tmp_path, 2)
+
+    assert client.delete(f'/jobs/{primary}').json()['promoted_to'] == heir
+    with main.jobs_lock:
+        assert main.download_owners[primary] == heir
+    response = client.delete(f'/jobs/{heir}')
+    assert response.status_code == 200
+    assert response.json()['cancelled_while'] == 'running'
+    assert wait_for_status(heir)['download_status'] == 'cancelled'
@@ -0,0 +1,58 @@
+"""Each download job extracts metadata exactly once (and not at all on a store hit)."""
+from fastapi.testclient import TestClient
+
+import main
+from conftest import wait_for_status
+
+client = TestClient(main.app)
+
+
+def submit(video_id: str, save_path) -> str:
+    response = client.post('/download', json={
+        'url': f'https://www.youtube.com/watch?v={video_id}',
+        'format': 'mp4',
+        'quality': 'best',
+        'save_path': str(save_path),
+    })
+    assert response.status_code == 202, response.text
+    return response.json()['job_id']
+
+
+def test_fresh_job_extracts_once(extractor, video_id, tmp_path):
+    job_id = submit(video_id, tmp_path)
+    progress = wait_for_status(job_id)
+
+    assert progress['download_status'] == 'completed', progress
+    assert len(extractor.calls) == 1
+    assert (tmp_path / progress['local_filename']).stat().st_size > 0
+
+
+def test_download_store_hit_does_not_extract(extractor, video_id, tmp_path):
+    first = submit(video_id, tmp_path / 'first')
+    assert wait_for_status(first)['download_status'] == 'completed'
+    extractor.calls.clear()
+
+    second = submit(video_id, tmp_path / 'second')
+    progress = wait_for_status(second)
+
+    assert progress['download_status'] == 'completed', progress
+    assert progress.get('from_store')
+    assert extractor.calls == []
+
+
+def test_store_hit_copies_when_hardlink_fails(extractor, video_id, tmp_path, monkeypatch):
+    first = submit(video_id, tmp_path / 'first')
+    assert wait_for_status(first)['download_status'] == 'completed'
+    fallbacks = main.download_store.stats()['copy_fallbacks']
+
+    def cross_device(source, target):
+        raise OSError(18, 'Invalid cross-device link')
+
+    monkeypatch.setattr(main.os, 'link', cross_device)
+    second = submit(video_id, tmp_path / 'second')
+    progress = wait_for_status(second)
+
+    assert progress['download_status'] == 'completed' and progress.get('from_store')
+    assert (tmp_path / 'second' / progress['local_filename']).stat().st_nlink == 1
+    assert main.download_store.stats()['copy_fallbacks'] == fallbacks + 1
+    assert 'ytdl_download_store_copy_fallbacks_total' in client.get('/metrics').text
@@ -0,0 +1,116 @@
+"""Shared job store backends (SQLite and Redis) and the API's use of them."""
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+fakeredis = pytest.importorskip('fakeredis')
+
+client = TestClient(main.app)
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        return main.SQLiteJobStore(str(tmp_path / 'jobs.sqlite3'))
+    return main.RedisJobStore(fakeredis.FakeRedis(decode_responses=True), finished_ttl=60)
+
+
+def enqueue(store, job_id: str):
+    store.enqueue(job_id, {'url': f'https://youtu.be/{job_id}'}, {'job_id': job_id, 'status': 'extracting'},
+                  {'download_status': 'queued'})
+
+
+def test_enqueue_claim_in_order(store):
+    enqueue(store, 'a')
+    enqueue(store, 'b')
+
+    assert store.claim('w1', timeout=1) == ('a', {'url': 'https://youtu.be/a'})
+    assert store.claim('w2', timeout=1)[0] == 'b'
+    assert store.claim('w1', timeout=1) is None
+    assert store.stats()['queued'] == 0
+    assert store.stats()['claimed'] == 2
+
+
+def test_changes_feed(store):
+    cursor, _ = store.changes(None, timeout=0.1)
+    enqueue(store, 'a')
+    store.put_many([('a', None, {'download_status': 'downloading', 'download_progress': 50.0})])
+
+    cursor, changes = store.changes(cursor, timeout=1)
+    # SQLite 每个任务只保留最新一行，Redis 流保留每次写入
+    assert {job_id for job_id, _, _ in changes} == {'a'}
+    assert changes[-1][2]['download_progress'] == 50.0
+    assert store.changes(cursor, timeout=0.1)[1] == []
+
+
+def test_get_returns_last_published(store):
+    assert store.get('a') is None
+    enqueue(store, 'a')
+    store.put_many([('a', None, {'download_status': 'downloading', 'download_progress': 50.0})])
+
+    job, progress = store.get('a')
+    assert job['job_id'] == 'a'
+    assert progress['download_progress'] == 50.0
+
+
+def test_cancel_queued_and_claimed(store):
+    enqueue(store, 'queued')
+    enqueue(store, 'claimed')
+    assert store.claim('w1', timeout=1)[0] == 'queued'
+    assert store.cancel('claimed') is True
+
+    assert store.cancel('queued') is False
+    assert store.cancelled(['queued', 'claimed']) == ['queued']
+    store.release('queued')
+    assert store.cancelled(['queued']) == []
+
+
+def test_requeue_from_dead_worker(store):
+    enqueue(store, 'a')
+    store.heartbeat('dead', {'capacity': 1})
+    assert store.claim('dead', timeout=1)[0] == 'a'
+    store.put_many([('a', None, {'download_status': 'downloading', 'save_path': '/tmp/a.mp4'})])
+    assert store.requeue_stale(dead_after=60) == []
+
+    time.sleep(0.3)
+    store.heartbeat('alive', {'capacity': 1})
+    assert store.requeue_stale(dead_after=0.2) == ['a']
+    assert list(store.stats()['workers']) == ['alive']
+    # 续传时沿用已确定的文件路径
+    assert store.claim('alive', timeout=1) == ('a', {'url': 'https://youtu.be/a', 'resume_path': '/tmp/a.mp4'})
+
+
+def test_api_store_calls_leave_event_loop(tmp_path, monkeypatch, video_id):
+    """POST /download, DELETE /jobs/{id}, /stats and /metrics must not run blocking store I/O on the event loop."""
+    store = main.SQLiteJobStore(str(tmp_path / 'jobs.sqlite3'))
+    on_loop = []
+
+    def check_loop(method):
+        def wrapper(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(method.__name__)
+            except RuntimeError:
+                pass
+            return method(*args, **kwargs)
+        return wrapper
+
+    for name in ('enqueue', 'put_many', 'cancel', 'stats'):
+        monkeypatch.setattr(store, name, check_loop(getattr(store, name)))
+    monkeypatch.setattr(main, 'job_store', store)
+    monkeypatch.setattr(main.download_store, 'stats', check_loop(main.download_store.stats))
+
+    response = client.post('/download', json={
+        'url': f'https://www.youtube.com/watch?v={video_id}', 'format': 'mp4', 'quality': 'best',
+        'save_path': str(tmp_path),
+    })
+    assert response.status_code == 202, response.text
+    job_id = response.json()['job_id']
+    assert client.delete(f'/jobs/{job_id}').json()['cancelled_while'] == 'queued'
+    assert client.get('/stats').json()['job_store']['queued'] == 0
+    assert client.get('/metrics').status_code == 200
+    assert on_loop == []
@@ -0,0 +1,63 @@
+"""Two API processes sharing one job store (``uvicorn --workers N``)."""
+import importlib.util
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture
+def api_pair(tmp_path, monkeypatch):
+    """This module's app and a second, independently imported copy of main.py, both on one SQLite store."""
+    store_url = f"sqlite:///{tmp_path / 'jobs.sqlite3'}"
+    monkeypatch.setenv('JOB_STORE', store_url)
+    spec = importlib.util.spec_from_file_location('main_other_process', main.__file__)
+    other = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(other)
+    monkeypatch.setattr(main, 'job_store', main.open_job_store(store_url))
+    # 两个进程都不启动 follow_job_store，只能依靠直接读取共享存储
+    return TestClient(main.app), TestClient(other.app)
+
+
+def submit(client, video_id: str, save_path) -> str:
+    response = client.post('/download', json={
+        'url': f'https://www.youtube.com/watch?v={video_id}', 'format': 'mp4', 'quality': 'best',
+        'save_path': str(save_path),
+    })
+    assert response.status_code == 202, response.text
+    return response.json()['job_id']
+
+
+def test_other_process_answers_before_change_feed(api_pair, video_id, tmp_path):
+    first, second = api_pair
+    job_id = submit(first, video_id, tmp_path)
+
+    job = second.get(f'/jobs/{job_id}')
+    assert job.status_code == 200, job.text
+    assert job.json()['url'].endswith(video_id)
+    assert second.get(f'/progress/{job_id}').status_code == 200
+
+    response = second.delete(f'/jobs/{job_id}')
+    assert response.status_code == 200, response.text
+    assert response.json()['cancelled_while'] == 'queued'
+    assert main.job_store.claim('worker', timeout=0.1) is None
+
+
+def test_unknown_job_is_still_404(api_pair):
+    _, second = api_pair
+    assert second.get('/jobs/does-not-exist').status_code == 404
+    assert second.delete('/jobs/does-not-exist').status_code == 404
+
+
+@pytest.mark.parametrize('method, path, body', [
+    ('put', '/bandwidth', {'global_limit_kbps': 100}),
+    ('put', '/jobs/any/bandwidth', {'limit_kbps': 100}),
+    ('put', '/scheduler', {'workers': 2}),
+])
+def test_runtime_settings_rejected_with_workers(api_pair, method, path, body):
+    first, _ = api_pair
+    response = getattr(first, method)(path, json=body)
+    assert response.status_code == 409
+    assert 'worker' in response.json()['detail']
@@ -0,0 +1,106 @@
+"""DownloadProgress hook, ProgressRegistry and the progress WebSocket."""
+import asyncio
+import json
+import time
+
+from fastapi import WebSocketDisconnect
+from fastapi.testclient import TestClient
+
+import main
+
+
+def test_finished_publishes_final_bytes(video_id):
+    main.download_progress.create(video_id)
+    hook = main.DownloadProgress(min_interval=60)
+    hook.job_id = video_id
+
+    for downloaded in (0, 40_000, 80_000):
+        hook({'status': 'downloading', 'filename': 'a.mp4', 'downloaded_bytes': downloaded,
+              'total_bytes_estimate': 90_000, 'speed': 1_000_000})
+    # 节流期间只发布了第一次调用
+    assert main.download_progress.get(video_id).downloaded_bytes == 0
+
+    hook({'status': 'finished', 'filename': 'a.mp4', 'total_bytes': 100_000})
+    record = main.download_progress.get(video_id)
+    assert (record.downloaded_bytes, record.total_bytes) == (100_000, 100_000)
+    assert record.speed is None and record.eta is None
+    assert record.download_status == 'processing'
+
+
+def test_expired_records_vanish_without_new_finishes():
+    evicted = []
+    registry = main.ProgressRegistry(terminal_ttl=0.2, sweep_interval=0.1, on_evict=evicted.append)
+    registry.create('done')
+    registry.create('running')
+    registry.update('done', {'download_status': 'completed'})
+    assert registry.get('done') is not None
+
+    time.sleep(0.25)
+    # 读取时过期记录立即不可见，后台线程随后将其淘汰
+    assert registry.get('done') is None and registry.snapshot('done') is None
+    deadline = time.monotonic() + 2
+    while not evicted and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert evicted == ['done']
+    assert len(registry) == 1 and registry.get('running') is not None
+
+
+def test_websocket_rejects_malformed_commands(video_id):
+    main.download_progress.create(video_id)
+    with TestClient(main.app).websocket_connect('/ws/progress') as ws:
+        for message in ('not json', '[1, 2]', '{"subscribe": "abc"}', '{"unsubscribe": [1]}'):
+            ws.send_text(message)
+            assert 'error' in ws.receive_json()
+        # 出错后连接仍可正常订阅
+        ws.send_json({'subscribe': [video_id]})
+        assert ws.receive_json()['job_id'] == video_id
+
+
+class ClosingWebSocket:
+    """Sends the given messages, then disconnects without closing the handler's side."""
+
+    def __init__(self, *messages):
+        self.messages = list(messages)
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self):
+        if self.messages:
+            return self.messages.pop(0)
+        await asyncio.sleep(0.05)
+        raise WebSocketDisconnect()
+
+    async def receive_json(self):
+        return json.loads(await self.receive_text())
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+
+def test_websocket_disconnect_ends_handler_at_once(video_id):
+    record = main.download_progress.create(video_id)
+    ws = ClosingWebSocket(json.dumps({'subscribe': [video_id]}))
+
+    # 不必等到 PROGRESS_STREAM_KEEPALIVE 心跳超时
+    asyncio.run(asyncio.wait_for(main.progress_websocket(ws), 2))
+    assert ws.sent[0]['job_id'] == video_id
+    assert record.listeners == []
+
+
+def test_parallel_streams_wait_for_unstarted_stream(video_id):
+    main.download_progress.create(video_id)
+    hook = main.DownloadProgress(min_interval=0)
+    hook.job_id = video_id
+    hook.expect_streams(['a.f137.mp4', 'a.f140.m4a'])
+
+    # 音频流在视频流报告任何进度之前就已完成
+    hook({'status': 'downloading', 'filename': 'a.f140.m4a', 'downloaded_bytes': 10_000, 'total_bytes': 10_000})
+    hook({'status': 'finished', 'filename': 'a.f140.m4a', 'total_bytes': 10_000})
+    assert main.download_progress.get(video_id).download_status == 'downloading'
+
+    hook({'status': 'finished', 'filename': 'a.f137.mp4', 'total_bytes': 90_000})
+    record = main.download_progress.get(video_id)
+    assert record.download_status == 'processing'
+    assert record.downloaded_bytes == 100_000
@@ -0,0 +1,86 @@
+"""DownloadScheduler queue order and the adaptive ConcurrencyController."""
+from fastapi.testclient import TestClient
+
+import main
+
+
+def test_round_robin_order_and_changed_positions_only(monkeypatch):
+    published = []
+    monkeypatch.setattr(main, 'update_progress', lambda job_id, data: published.append((job_id, data)))
+    scheduler = main.DownloadScheduler(workers=0)
+
+    for job_id, client in (('a1', 'a'), ('a2', 'a'), ('a3', 'a'), ('b1', 'b')):
+        scheduler.submit(job_id, print, (), client=client)
+    assert scheduler._queue_order() == ['a1', 'b1', 'a2', 'a3']
+
+    published.clear()
+    scheduler.submit('c1', print, (), client='c')
+    # c1 排在 b1 之后，只有它和被挤后的 a2、a3 需要推送
+    assert scheduler._queue_order() == ['a1', 'b1', 'c1', 'a2', 'a3']
+    assert published == [('c1', {'queue_position': 3}), ('a2', {'queue_position': 4}), ('a3', {'queue_position': 5})]
+
+    published.clear()
+    scheduler.cancel('a3')
+    assert published == []
+
+
+class FakeScheduler:
+    def __init__(self, workers: int, queued: int):
+        self.workers, self.queued = workers, queued
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "queued": self.queued}
+
+    def set_workers(self, workers: int):
+        self.workers = workers
+
+
+def make_controller(workers: int = 2, queued: int = 5):
+    scheduler = FakeScheduler(workers, queued)
+    return main.ConcurrencyController(scheduler, min_workers=1, max_workers=8, hold=60), scheduler
+
+
+def test_controller_adds_worker_while_jobs_queue():
+    controller, scheduler = make_controller()
+    controller.record_speed('a', 1000.0)
+
+    decision = controller.evaluate()
+    assert (decision['action'], decision['workers_to'], scheduler.workers) == ('increase', 3, 3)
+    scheduler.queued = 0
+    controller.record_speed('a', 2000.0)
+    assert controller.evaluate() is None and scheduler.workers == 3
+
+
+def test_controller_takes_back_worker_without_gain():
+    controller, scheduler = make_controller()
+    controller.record_speed('a', 1000.0)
+    controller.evaluate()
+
+    decision = controller.evaluate()
+    assert (decision['action'], scheduler.workers) == ('no_gain', 2)
+    # 暂停增长期间即使仍有排队也不再加线程
+    assert controller.evaluate() is None and scheduler.workers == 2
+
+
+def test_controller_halves_on_throttling():
+    controller, scheduler = make_controller(workers=6)
+    controller.record_attempt()
+    controller.record_attempt('throttled')
+
+    decision = controller.evaluate()
+    assert (decision['action'], scheduler.workers) == ('throttled', 3)
+    assert controller.evaluate() is None
+
+
+def test_put_scheduler_clamps_workers_while_adaptive():
+    client = TestClient(main.app)
+    main.concurrency_controller._baseline = (2, 1e9)
+    try:
+        response = client.put('/scheduler', json={'workers': 40, 'adaptive': True})
+        assert response.status_code == 200, response.text
+        assert response.json()['workers'] == main.concurrency_controller.max_workers
+        # 之前加线程时的基线作废，下一个窗口不会把新线程数撤回
+        assert main.concurrency_controller._baseline is None
+    finally:
+        client.put('/scheduler', json={'workers': 4})
+    assert not main.concurrency_controller.enabled
@@ -0,0 +1,74 @@
+"""GET /stream/{video_id} through FFmpeg, using a fake ffmpeg on PATH."""
+import os
+import stat
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+
+# 假的 ffmpeg：把命令行参数写到 stdout；FAKE_FFMPEG_FAIL 时只写 stderr 并以 1 退出
+FAKE_FFMPEG = f'''#!{sys.executable}
+import os, sys
+if os.environ.get('FAKE_FFMPEG_FAIL'):
+    sys.stderr.write('Could not find tag for codec aac in stream #1\\\\n')
+    sys.exit(1)
+sys.stdout.write(' '.join(sys.argv[1:]))
+'''
+
+DASH_FORMATS = [
+    {'format_id': '247', 'ext': 'webm', 'vcodec': 'vp9', 'acodec': 'none', 'height': 720, 'tbr': 1500,
+     'protocol': 'https', 'url': 'https://media.invalid/247'},
+    {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 129,
+     'protocol': 'https', 'url': 'https://media.invalid/140'},
+    {'format_id': '251', 'ext': 'webm', 'vcodec': 'none', 'acodec': 'opus', 'abr': 120,
+     'protocol': 'https', 'url': 'https://media.invalid/251'},
+]
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    path = tmp_path / 'ffmpeg'
+    path.write_text(FAKE_FFMPEG)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+
+def serve_formats(monkeypatch, formats: list):
+    def extract_video_info(url: str, format: str, quality: str) -> tuple:
+        selector = main.compile_format_selector(format, quality)
+        best, audio, _ = selector.select(formats)
+        return {'id': 'x', 'title': 'clip', 'formats': formats}, best, selector.download_spec(best, audio)
+    monkeypatch.setattr(main, 'extract_video_info', extract_video_info)
+
+
+def test_webm_merges_opus_audio(fake_ffmpeg, monkeypatch):
+    serve_formats(monkeypatch, DASH_FORMATS)
+    response = client.get('/stream/abcdefghijk?format=webm&quality=720p')
+
+    assert response.status_code == 200, response.text
+    command = response.text
+    assert '-i https://media.invalid/247 -i https://media.invalid/251' in command
+    assert 'libopus' not in command
+    assert command.endswith('-c copy -f webm pipe:1')
+
+
+def test_webm_transcodes_aac_audio(fake_ffmpeg, monkeypatch):
+    serve_formats(monkeypatch, DASH_FORMATS[:2])
+    response = client.get('/stream/abcdefghijk?format=webm&quality=720p')
+
+    assert response.status_code == 200, response.text
+    assert '-i https://media.invalid/140' in response.text
+    assert '-c copy -c:a libopus' in response.text
+
+
+def test_ffmpeg_early_exit_is_502(fake_ffmpeg, monkeypatch):
+    monkeypatch.setenv('FAKE_FFMPEG_FAIL', '1')
+    serve_formats(monkeypatch, DASH_FORMATS)
+    response = client.get('/stream/abcdefghijk?format=webm&quality=720p')
+
+    assert response.status_code == 502
+    assert 'Could not find tag for codec aac' in response.json()['detail']
@@ -0,0 +1,90 @@
+"""YoutubeDLPool reuse and its fallback for unsupported yt-dlp builds."""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import main
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class ConnectionCountingServer(ThreadingHTTPServer):
+    daemon_threads = True
+    connections = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
+
+
+@pytest.fixture
+def keepalive_url():
+    server = ConnectionCountingServer(('127.0.0.1', 0), KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server, f'http://127.0.0.1:{server.server_address[1]}/clip'
+    server.shutdown()
+
+
+def test_reuses_request_director():
+    pool = main.YoutubeDLPool({'quiet': True})
+    assert pool.supported()
+    with pool.ydl({}) as ydl:
+        first = ydl._request_director
+    with pool.ydl({'noprogress': True}) as ydl:
+        assert ydl._request_director is first
+    assert pool.stats()['reused'] == 1
+
+
+def test_falls_back_to_fresh_instance_on_unsupported_version(monkeypatch):
+    pool = main.YoutubeDLPool({'quiet': True})
+    monkeypatch.setattr(pool, 'MIN_YT_DLP_VERSION', (9999, 1, 1))
+    with pool.ydl({}) as ydl:
+        first = ydl._request_director
+    with pool.ydl({}) as ydl:
+        assert ydl._request_director is not first
+    stats = pool.stats()
+    assert stats['supported'] is False
+    assert (stats['created'], stats['reused'], stats['warm']) == (0, 0, False)
+
+
+def test_falls_back_when_internals_change(monkeypatch):
+    pool = main.YoutubeDLPool({'quiet': True})
+    monkeypatch.delattr(main.yt_dlp.YoutubeDL, 'cookiejar')
+    assert pool.supported() is False
+
+
+def test_second_job_reuses_connection(keepalive_url):
+    """Needs yt-dlp's requests handler (requests>=2.32.2); urllib never keeps connections alive."""
+    if main.yt_dlp.dependencies.requests is None:
+        pytest.skip("yt-dlp's requests handler is not available")
+    server, url = keepalive_url
+    pool = main.YoutubeDLPool({'quiet': True})
+    for _ in range(2):
+        with pool.ydl({}) as ydl:
+            assert ydl.urlopen(url).read() == b'ok'
+    assert server.connections == 1
+    assert pool.stats()['reused'] == 1
+
+
+def test_leased_director_logs_to_current_job():
+    pool = main.YoutubeDLPool({'quiet': True})
+    with pool.ydl({}) as first:
+        director = first._request_director
+        assert director.logger._ydl is first
+    # 归还后不再引用已结束的任务
+    assert director.logger._ydl is None
+    with pool.ydl({}) as second:
+        assert second._request_director is director
+        assert director.logger._ydl is second
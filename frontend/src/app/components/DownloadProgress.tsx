@@ -7,20 +7,32 @@ interface DownloadProgressProps {
   speed: string;
   eta: string;
   status: string;
+  queuePosition?: number;
+  onCancel?: () => void;
 }
 
 const getStatusText = (status: string): string => {
   switch (status) {
     case 'preparing':
       return '准备中';
+    case 'queued':
+      return '排队中';
     case 'downloading':
       return '下载中';
+    case 'retrying':
+      return '等待重试';
     case 'processing':
       return '处理中';
+    case 'queued_for_transcode':
+      return '等待转码';
+    case 'transcoding':
+      return '转码中';
     case 'completed':
       return '已完成';
     case 'error':
       return '出错';
+    case 'cancelled':
+      return '已取消';
     default:
       return status;
   }
@@ -29,10 +41,14 @@ const getStatusText = (status: string): string => {
 const getStatusColor = (status: string): string => {
   switch (status) {
     case 'preparing':
+    case 'queued':
+    case 'retrying':
       return 'bg-yellow-500';
     case 'downloading':
       return 'bg-blue-500';
     case 'processing':
+    case 'queued_for_transcode':
+    case 'transcoding':
       return 'bg-purple-500';
     case 'completed':
       return 'bg-green-500';
@@ -43,7 +59,10 @@ const getStatusColor = (status: string): string => {
   }
 };
 
-const DownloadProgress: React.FC<DownloadProgressProps> = ({ progress, speed, eta, status }) => {
+const isCancellable = (status: string): boolean =>
+  ['preparing', 'queued', 'downloading', 'retrying', 'queued_for_transcode', 'transcoding'].includes(status);
+
+const DownloadProgress: React.FC<DownloadProgressProps> = ({ progress, speed, eta, status, queuePosition, onCancel }) => {
   return (
     <div className="mt-4">
       <div className="flex items-center justify-between mb-2">
@@ -52,12 +71,24 @@ const DownloadProgress: React.FC<DownloadProgressProps> = ({ progress, speed, et
             {getStatusText(status)}
           </span>
           <span className="text-sm text-gray-600">
+            {status === 'queued' && queuePosition && `队列位置: ${queuePosition}`}
             {status === 'downloading' && `${speed} • 剩余时间: ${eta}`}
             {status === 'completed' && '下载完成'}
             {status === 'error' && '下载失败'}
           </span>
         </div>
-        <span className="text-sm font-medium">{progress}%</span>
+        <div className="flex items-center gap-3">
+          <span className="text-sm font-medium">{progress}%</span>
+          {onCancel && isCancellable(status) && (
+            <button
+              type="button"
+              onClick={onCancel}
+              className="text-sm text-red-600 hover:text-red-800"
+            >
+              取消
+            </button>
+          )}
+        </div>
       </div>
       <div className="w-full bg-gray-200 rounded-full h-2">
         <div
@@ -5,6 +5,7 @@ import Image from 'next/image';
 import DownloadProgress from './components/DownloadProgress'; // Import the new component
 
 interface VideoInfo {
+  job_id: string;
   title: string;
   author: string;
   length: number;
@@ -19,6 +20,7 @@ interface VideoInfo {
   download_speed: string;
   download_eta: string;
   download_status: string;
+  queue_position?: number;
   local_filename: string;
   save_path: string;  // 添加保存路径字段
 }
@@ -105,22 +107,28 @@ export default function Home() {
     }
   };
 
-  // Add polling mechanism for download progress
+  // Subscribe to pushed progress updates (SSE), falling back to polling
   useEffect(() => {
     let intervalId: NodeJS.Timeout;
+    let eventSource: EventSource | null = null;
 
-    if (videoInfo?.download_status === 'downloading' || videoInfo?.download_status === 'preparing' || videoInfo?.download_status === 'processing') {
+    const activeStatuses = ['preparing', 'queued', 'downloading', 'retrying', 'processing', 'queued_for_transcode', 'transcoding'];
+    const isActive = activeStatuses.includes(videoInfo?.download_status ?? '');
+    if (!isActive || !videoInfo?.job_id) {
+      return;
+    }
+
+    const startPolling = () => {
       intervalId = setInterval(async () => {
         try {
-          const encodedFilename = encodeURIComponent(videoInfo.local_filename);
-          const response = await fetch(`/api/progress/${encodedFilename}`);
+          const response = await fetch(`/api/progress/${videoInfo.job_id}`);
           const data = await response.json();
           
           if (response.ok) {
             setVideoInfo(prev => prev ? { ...prev, ...data } : null);
             
             // Clear interval if download is complete, failed, or completed processing
-            if (data.download_status === 'completed' || data.download_status === 'error') {
+            if (data.download_status === 'completed' || data.download_status === 'error' || data.download_status === 'cancelled') {
               clearInterval(intervalId);
             }
           }
@@ -128,14 +136,34 @@ export default function Home() {
           console.error('Error fetching progress:', error);
         }
       }, 1000);
+    };
+
+    if (typeof EventSource !== 'undefined') {
+      eventSource = new EventSource(`/api/progress/${videoInfo.job_id}/stream`);
+      eventSource.addEventListener('progress', (event) => {
+        const delta = JSON.parse((event as MessageEvent).data);
+        setVideoInfo(prev => prev ? { ...prev, ...delta } : null);
+        if (delta.download_status === 'completed' || delta.download_status === 'error' || delta.download_status === 'cancelled') {
+          eventSource?.close();
+        }
+      });
+      eventSource.onerror = () => {
+        // 推送连接失败时退回到轮询
+        eventSource?.close();
+        eventSource = null;
+        startPolling();
+      };
+    } else {
+      startPolling();
     }
 
     return () => {
+      eventSource?.close();
       if (intervalId) {
         clearInterval(intervalId);
       }
     };
-  }, [videoInfo?.download_status, videoInfo?.local_filename]);
+  }, [videoInfo?.job_id]);
 
   useEffect(() => {
     // Fetch available formats when component mounts
@@ -201,7 +229,24 @@ export default function Home() {
         throw new Error(data.detail || '无法获取视频信息');
       }
 
-      setVideoInfo(data);
+      // 后端立即返回任务 ID，轮询 /jobs/{id} 直到视频信息解析完成
+      const jobId = data.job_id;
+      for (;;) {
+        const jobResponse = await fetch(`/api/jobs/${jobId}`);
+        const job = await jobResponse.json();
+
+        if (!jobResponse.ok) {
+          throw new Error(job.detail || '无法获取任务状态');
+        }
+        if (job.status === 'error') {
+          throw new Error(job.error_message || '无法获取视频信息');
+        }
+        if (job.video_info) {
+          setVideoInfo({ ...job.video_info, ...job.progress });
+          break;
+        }
+        await new Promise(resolve => setTimeout(resolve, 500));
+      }
     } catch (err) {
       setError(err instanceof Error ? err.message : '发生错误');
     } finally {
@@ -209,6 +254,20 @@ export default function Home() {
     }
   };
 
+  const handleCancel = async () => {
+    if (!videoInfo?.job_id) {
+      return;
+    }
+    try {
+      const response = await fetch(`/api/jobs/${videoInfo.job_id}`, { method: 'DELETE' });
+      if (response.ok) {
+        setVideoInfo(prev => prev ? { ...prev, download_status: 'cancelled' } : null);
+      }
+    } catch (err) {
+      console.error('Error cancelling download:', err);
+    }
+  };
+
   const formatDuration = (seconds: number) => {
     const minutes = Math.floor(seconds / 60);
     const remainingSeconds = seconds % 60;
@@ -362,6 +421,8 @@ export default function Home() {
                     speed={videoInfo.download_speed || '0 KB/s'}
                     eta={videoInfo.download_eta || 'calculating...'}
                     status={videoInfo.download_status}
+                    queuePosition={videoInfo.queue_position}
+                    onCancel={handleCancel}
                   />
                 )}
               </div>
@@ -44,6 +44,23 @@ const swaggerConfig = {
                     description: '保存路径 (可选，默认为 downloads 文件夹)',
                     example: 'C:\\Downloads\\YouTube',
                   },
+                  rate_limit: {
+                    type: 'integer',
+                    description: '单任务限速 KiB/s (可选)',
+                    example: 512,
+                  },
+                  download_mode: {
+                    type: 'string',
+                    enum: ['standard', 'parallel'],
+                    default: 'standard',
+                    description: 'parallel: 音视频流并行下载、分片并发、分块请求',
+                  },
+                  fragment_concurrency: {
+                    type: 'integer',
+                    minimum: 1,
+                    maximum: 32,
+                    description: 'parallel 模式下的分片并发数 (可选)',
+                  },
                 },
                 required: ['url'],
               },
@@ -51,29 +68,22 @@ const swaggerConfig = {
           },
         },
         responses: {
-          200: {
-            description: 'Video information and download details',
+          202: {
+            description: '任务已提交，元数据在后台解析',
             content: {
               'application/json': {
                 schema: {
                   type: 'object',
                   properties: {
-                    title: { type: 'string' },
-                    author: { type: 'string' },
-                    length: { type: 'number' },
-                    views: { type: 'number' },
-                    thumbnail_url: { type: 'string' },
-                    download_url: { type: 'string' },
-                    is_short: { type: 'boolean' },
-                    resolution: { type: 'string' },
-                    filesize: { type: 'number' },
-                    ext: { type: 'string' },
-                    download_progress: { type: 'number' },
-                    download_speed: { type: 'string' },
-                    download_eta: { type: 'string' },
-                    download_status: { type: 'string' },
-                    local_filename: { type: 'string' },
-                    save_path: { type: 'string' },
+                    job_id: { type: 'string' },
+                    status: { type: 'string' },
+                    coalesced_with: {
+                      type: 'string',
+                      nullable: true,
+                      description: '相同请求正在进行时，共享的主任务 ID',
+                    },
+                    job_url: { type: 'string' },
+                    progress_url: { type: 'string' },
                   },
                 },
               },
@@ -95,18 +105,122 @@ const swaggerConfig = {
         },
       },
     },
-    '/progress/{filename}': {
+    '/jobs/{job_id}': {
+      delete: {
+        summary: 'Cancel a queued or running job',
+        parameters: [
+          {
+            name: 'job_id',
+            in: 'path',
+            required: true,
+            schema: {
+              type: 'string',
+            },
+          },
+        ],
+        responses: {
+          200: {
+            description: 'Job cancelled',
+            content: {
+              'application/json': {
+                schema: {
+                  type: 'object',
+                  properties: {
+                    job_id: { type: 'string' },
+                    status: { type: 'string' },
+                    cancelled_while: { type: 'string', enum: ['extracting', 'queued', 'running'] },
+                  },
+                },
+              },
+            },
+          },
+          404: {
+            description: 'Job not found',
+          },
+          409: {
+            description: 'Job already completed, failed or cancelled',
+          },
+        },
+      },
+      get: {
+        summary: 'Get job status and video information',
+        parameters: [
+          {
+            name: 'job_id',
+            in: 'path',
+            required: true,
+            schema: {
+              type: 'string',
+            },
+            description: 'The job ID returned by /download',
+          },
+        ],
+        responses: {
+          200: {
+            description: 'Job status; video_info is null until extraction finishes',
+            content: {
+              'application/json': {
+                schema: {
+                  type: 'object',
+                  properties: {
+                    job_id: { type: 'string' },
+                    status: { type: 'string', enum: ['extracting', 'ready', 'error'] },
+                    url: { type: 'string' },
+                    format: { type: 'string' },
+                    quality: { type: 'string' },
+                    error_message: { type: 'string', nullable: true },
+                    video_info: {
+                      type: 'object',
+                      nullable: true,
+                      properties: {
+                        title: { type: 'string' },
+                        author: { type: 'string' },
+                        length: { type: 'number' },
+                        views: { type: 'number' },
+                        thumbnail_url: { type: 'string' },
+                        download_url: { type: 'string' },
+                        is_short: { type: 'boolean' },
+                        resolution: { type: 'string' },
+                        filesize: { type: 'number' },
+                        ext: { type: 'string' },
+                        local_filename: { type: 'string' },
+                        save_path: { type: 'string' },
+                      },
+                    },
+                    progress: { type: 'object' },
+                  },
+                },
+              },
+            },
+          },
+          404: {
+            description: 'Job not found',
+            content: {
+              'application/json': {
+                schema: {
+                  type: 'object',
+                  properties: {
+                    detail: { type: 'string' },
+                  },
+                },
+              },
+            },
+          },
+        },
+      },
+    },
+    '/progress/{job_id}': {
       get: {
         summary: 'Get download progress',
         parameters: [
           {
-            name: 'filename',
+            name: 'job_id',
             in: 'path',
             required: true,
             schema: {
               type: 'string',
             },
-            description: 'The filename of the downloading video',
+            description: 'The job ID returned by /download',
           },
         ],
         responses: {
@@ -143,6 +257,245 @@ const swaggerConfig = {
         },
       },
     },
+    '/progress/{job_id}/stream': {
+      get: {
+        summary: 'Stream download progress (Server-Sent Events)',
+        description: '每次进度有变化时推送 `progress` 事件，数据只包含变化的字段；任务完成或失败后关闭连接。多任务订阅可使用 WebSocket `/ws/progress`。',
+        parameters: [
+          {
+            name: 'job_id',
+            in: 'path',
+            required: true,
+            schema: {
+              type: 'string',
+            },
+            description: 'The job ID returned by /download',
+          },
+        ],
+        responses: {
+          200: {
+            description: 'text/event-stream of progress deltas',
+            content: {
+              'text/event-stream': {
+                schema: {
+                  type: 'string',
+                },
+              },
+            },
+          },
+          404: {
+            description: 'Download not found',
+          },
+        },
+      },
+    },
+    '/batch': {
+      post: {
+        summary: 'Download a playlist or channel',
+        description: '使用 extract_flat 列出播放列表/频道中的视频，并按并发上限分批提交下载任务。',
+        requestBody: {
+          required: true,
+          content: {
+            'application/json': {
+              schema: {
+                type: 'object',
+                properties: {
+                  url: {
+                    type: 'string',
+                    description: 'Playlist or channel URL',
+                    example: 'https://www.youtube.com/playlist?list=example',
+                  },
+                  format: { type: 'string', enum: ['mp4', 'webm', 'mp3', '3gp'], default: 'mp4' },
+                  quality: { type: 'string', enum: ['360p', '480p', '720p', '1080p', 'best'], default: '1080p' },
+                  save_path: { type: 'string' },
+                  rate_limit: { type: 'integer', description: '每个任务的限速 KiB/s (可选)' },
+                  download_mode: { type: 'string', enum: ['standard', 'parallel'], default: 'standard' },
+                  fragment_concurrency: { type: 'integer', minimum: 1, maximum: 32 },
+                  concurrency: { type: 'integer', minimum: 1, maximum: 16, default: 4 },
+                  max_items: { type: 'integer', minimum: 0, default: 0, description: '0 表示不限制' },
+                  skip_existing: { type: 'boolean', default: true, description: '跳过已下载过的视频' },
+                },
+                required: ['url'],
+              },
+            },
+          },
+        },
+        responses: {
+          202: {
+            description: 'Batch accepted',
+            content: {
+              'application/json': {
+                schema: {
+                  type: 'object',
+                  properties: {
+                    batch_id: { type: 'string' },
+                    status: { type: 'string' },
+                    batch_url: { type: 'string' },
+                  },
+                },
+              },
+            },
+          },
+        },
+      },
+    },
+    '/batch/{batch_id}': {
+      get: {
+        summary: 'Get aggregate batch progress and per-item status',
+        parameters: [
+          {
+            name: 'batch_id',
+            in: 'path',
+            required: true,
+            schema: {
+              type: 'string',
+            },
+          },
+        ],
+        responses: {
+          200: {
+            description: 'Batch status, counts per item status, overall progress and items',
+          },
+          404: {
+            description: 'Batch not found',
+          },
+        },
+      },
+    },
+    '/scheduler': {
+      get: {
+        summary: 'Get download scheduler status',
+        responses: {
+          200: {
+            description: 'Worker count, active and queued jobs per priority class, whether adaptive concurrency is on',
+          },
+        },
+      },
+      put: {
+        summary: 'Pin the number of download workers or switch adaptive concurrency on/off',
+        description: '只指定 `workers` 时固定线程数并关闭自适应并发；`adaptive: true` 重新开启，以 `workers`（如给出）为起点。',
+        requestBody: {
+          required: true,
+          content: {
+            'application/json': {
+              schema: {
+                type: 'object',
+                properties: {
+                  workers: { type: 'integer', minimum: 1, maximum: 64 },
+                  adaptive: { type: 'boolean' },
+                },
+              },
+            },
+          },
+        },
+        responses: {
+          200: {
+            description: 'Updated scheduler status',
+          },
+          422: {
+            description: 'Neither workers nor adaptive given, or workers out of range',
+          },
+        },
+      },
+    },
+    '/bandwidth': {
+      get: {
+        summary: 'Get bandwidth limits and the rate assigned to each active download',
+        responses: {
+          200: {
+            description: 'Global and per-job limits, active jobs with their fair-share rate',
+          },
+        },
+      },
+      put: {
+        summary: 'Change bandwidth limits at runtime',
+        requestBody: {
+          required: true,
+          content: {
+            'application/json': {
+              schema: {
+                type: 'object',
+                properties: {
+                  global_limit_kbps: { type: 'integer', nullable: true, description: '总带宽 KiB/s，null 表示不限制' },
+                  job_limit_kbps: { type: 'integer', nullable: true, description: '默认单任务上限 KiB/s' },
+                },
+              },
+            },
+          },
+        },
+        responses: {
+          200: {
+            description: 'Updated bandwidth status',
+          },
+        },
+      },
+    },
+    '/jobs/{job_id}/bandwidth': {
+      put: {
+        summary: 'Set or clear the bandwidth cap of one job',
+        parameters: [
+          {
+            name: 'job_id',
+            in: 'path',
+            required: true,
+            schema: { type: 'string' },
+          },
+        ],
+        requestBody: {
+          required: true,
+          content: {
+            'application/json': {
+              schema: {
+                type: 'object',
+                properties: {
+                  limit_kbps: { type: 'integer', nullable: true, description: 'null 表示取消单独限速' },
+                },
+              },
+            },
+          },
+        },
+        responses: {
+          200: {
+            description: 'Cap applied',
+          },
+          404: {
+            description: 'Job not found',
+          },
+        },
+      },
+    },
+    '/stream/{video_id}': {
+      get: {
+        summary: 'Stream a video without saving it on the server',
+        description: 'Pipes the selected format straight to the response. Single-file formats are proxied and honour Range requests (206); video+audio selections and mp3 are remuxed/transcoded by FFmpeg on the fly and sent without range support',
+        parameters: [
+          { name: 'video_id', in: 'path', required: true, schema: { type: 'string' }, description: 'YouTube video ID' },
+          { name: 'format', in: 'query', schema: { type: 'string', enum: ['mp4', 'webm', 'mp3'], default: 'mp4' } },
+          { name: 'quality', in: 'query', schema: { type: 'string', enum: ['360p', '480p', '720p', '1080p', 'best'], default: '1080p' } },
+          { name: 'Range', in: 'header', schema: { type: 'string' }, description: 'Single byte range, e.g. bytes=0-1048575' },
+        ],
+        responses: {
+          200: { description: 'Whole file', content: { 'application/octet-stream': { schema: { type: 'string', format: 'binary' } } } },
+          206: { description: 'Requested byte range' },
+          400: { description: 'Format cannot be streamed (3gp)' },
+          416: { description: 'Range not satisfiable' },
+          422: { description: 'Invalid video ID, format or quality' },
+          502: { description: 'Extraction or upstream request failed' },
+        },
+      },
+    },
+    '/metrics': {
+      get: {
+        summary: 'Prometheus metrics',
+        description: 'Histograms for extraction, download and post-processing time, download throughput, queue depth, active workers, progress-hook call counts and cache hit ratios',
+        responses: {
+          200: {
+            description: 'Prometheus text exposition format',
+            content: { 'text/plain': { schema: { type: 'string' } } },
+          },
+        },
+      },
+    },
     '/formats': {
       get: {
         summary: 'Get available formats and qualities',
@@ -173,7 +526,7 @@ const swaggerConfig = {
     '/select_directory': {
       get: {
         summary: '打开系统文件夹选择对话框',
-        description: '打开系统原生的文件夹选择对话框，让用户选择视频保存位置',
+        description: '打开系统原生的文件夹选择对话框，让用户选择视频保存位置。无界面模式（HEADLESS）下不可用，返回 501',
         responses: {
           200: {
             description: '选择的文件夹路径',
@@ -192,6 +545,9 @@ const swaggerConfig = {
               },
             },
           },
+          501: {
+            description: '服务器运行在无界面模式，文件夹选择对话框已禁用',
+          },
           500: {
             description: '打开文件夹选择对话框失败',
             content: {